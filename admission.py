@@ -0,0 +1,93 @@
+import threading
+import time
+
+"""
+
+CloudLink Admission Module
+
+This module decides whether a new connection is accepted at all, before any per-client work is
+done for it. Connections are rejected if their address is blocked, if the server is at its
+connection limit, if their address already has too many connections, or if connections are
+arriving faster than the accept rate. A custom check can reject connections for other reasons
+(e.g. maintenance). Limits set to 0 are disabled.
+
+"""
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate # Tokens added per second
+        self.burst = burst # Most tokens the bucket holds
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self): # Takes a token, returns False if the bucket is empty
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + ((now - self.last) * self.rate))
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class AdmissionController:
+    def __init__(self, max_connections=0, max_per_ip=0, accept_rate=0, accept_burst=None, is_blocked=None, check=None):
+        self.lock = threading.Lock()
+        self.max_connections = max_connections # Connections open at once
+        self.max_per_ip = max_per_ip # Connections open at once from one address
+        self.bucket = None
+        self.set_rate(accept_rate, accept_burst)
+        self.is_blocked = is_blocked # is_blocked(ip) returns True for blocked addresses
+        self.check = check # check(ip) returns a rejection reason, or None to go on
+        self.connections = 0
+        self.per_ip = {} # Address -> open connections
+        self.stats = {"accepted": 0, "blocked": 0, "capacity": 0, "ip_limit": 0, "rate": 0, "check": 0}
+
+    def set_rate(self, accept_rate, accept_burst=None): # New connections per second, with bursts of up to accept_burst (default: one second's worth)
+        if accept_rate > 0:
+            if accept_burst == None:
+                accept_burst = max(1, accept_rate)
+            self.bucket = TokenBucket(accept_rate, accept_burst)
+        else:
+            self.bucket = None
+
+    def admit(self, ip): # Returns None if the connection is accepted (call release() when it closes), otherwise the reason
+        reason = None
+        if (not self.is_blocked == None) and self.is_blocked(ip):
+            reason = "blocked"
+        elif (not self.check == None) and (not self.check(ip) == None):
+            reason = "check"
+        with self.lock:
+            if not reason == None:
+                pass
+            elif (self.max_connections > 0) and (self.connections >= self.max_connections):
+                reason = "capacity"
+            elif (self.max_per_ip > 0) and (self.per_ip.get(ip, 0) >= self.max_per_ip):
+                reason = "ip_limit"
+            elif (not self.bucket == None) and (not self.bucket.take()):
+                # Only connections that passed every other check use up a token
+                reason = "rate"
+            
+            if reason == None:
+                self.connections += 1
+                self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+                self.stats["accepted"] += 1
+            else:
+                self.stats[reason] += 1
+        return reason
+
+    def release(self, ip): # Forgets a closed connection that was admitted
+        with self.lock:
+            self.connections -= 1
+            if ip in self.per_ip:
+                self.per_ip[ip] -= 1
+                if self.per_ip[ip] <= 0:
+                    del self.per_ip[ip]
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.stats.copy()
+            stats["connections"] = self.connections
+            stats["addresses"] = len(self.per_ip)
+        return stats
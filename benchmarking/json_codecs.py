@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Compares the JSON backends available to codec.py (and the MessagePack codec) on the packet
+shapes the Meower server actually sends and receives.
+
+Usage: python benchmarking/json_codecs.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import codec
+import msgpack_codec
+
+def make_post(i, origin="home"):
+    return {
+        "_id": "a1b2c3d4-e5f6-4a7b-8c9d-{0:012d}".format(i),
+        "post_origin": origin,
+        "type": 1,
+        "u": "user{0}".format(i % 50),
+        "t": {"mo": "03", "d": "14", "y": "2022", "h": "16", "mi": "20", "s": "09", "e": 1647274809 + i},
+        "p": "Hello from Meower! This is post number {0}, with some text to make it look real. éè :)".format(i),
+        "isDeleted": False
+    }
+
+PACKETS = {
+    # Outgoing
+    "statuscode": {"cmd": "statuscode", "val": "I:100 | OK", "listener": "listener_42"},
+    "ulist": {"cmd": "ulist", "val": "".join(["user{0};".format(i) for i in range(300)])},
+    "post broadcast": {"cmd": "direct", "val": {"mode": 1, "payload": make_post(1)}},
+    "chat state": {"cmd": "direct", "val": {"state": 101, "u": "user1", "chatid": "livechat"}},
+    "get_home (25 posts)": {"cmd": "direct", "val": {"mode": "home", "payload": {"index": [make_post(i) for i in range(25)], "page#": 1, "pages": 40, "query": {"post_origin": "home", "isDeleted": False}}}},
+    # Incoming
+    "post_home": {"cmd": "direct", "val": {"cmd": "post_home", "val": "Hello from Meower! This is a post."}, "listener": "post_1"},
+    "authpswd": {"cmd": "direct", "val": {"cmd": "authpswd", "val": {"username": "user1", "pswd": "hunter2hunter2"}}, "listener": "auth"},
+    "ping": {"cmd": "ping", "val": ""}
+}
+
+def timeit(function, arg, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        function(arg)
+    return ((time.perf_counter() - start) / iterations) * 1000000
+
+def main():
+    iterations = 20000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+
+    codecs = {}
+    for name, (dumps, loads) in codec.BACKENDS.items():
+        codecs[name] = (dumps, loads)
+    codecs["msgpack_codec"] = (msgpack_codec.packb, msgpack_codec.unpackb)
+
+    print("codec.py picked: {0}".format(codec.backend))
+    print("{0} iterations, times in microseconds per call\n".format(iterations))
+    print("{0:<22}{1:<15}{2:>10}{3:>10}{4:>10}".format("packet", "codec", "encode", "decode", "bytes"))
+    for packet_name, packet in PACKETS.items():
+        for codec_name, (encode, decode) in codecs.items():
+            data = encode(packet)
+            if not decode(data) == packet:
+                print("{0}: {1} does not round-trip!".format(packet_name, codec_name))
+            encode_time = timeit(encode, packet, iterations)
+            decode_time = timeit(decode, data, iterations)
+            if type(data) == str:
+                data = data.encode("utf-8")
+            print("{0:<22}{1:<15}{2:>10.2f}{3:>10.2f}{4:>10}".format(packet_name, codec_name, encode_time, decode_time, len(data)))
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+"""
+Load generator for the Meower server. Starts the server (CloudLink + Meower) in a child process
+on an in-memory database (memory_db.py), connects a number of simulated Scratch and JS clients
+that log in the way the real clients do (client type, IP, trust key, authpswd), then has them
+send a mix of commands for a while.
+
+Reports the p50/p99 latency of each command (until its status code comes back), how long
+home posts and chat posts take to reach the other clients, and the server process's CPU use
+and memory (RSS, read from /proc, so Linux only).
+
+Every client sends one command at a time, waiting for the reply and then for its share of
+--rate before the next. Posting is rate limited by the server (6 posts per 5 seconds per user),
+so keep the post weights and --rate low enough or the report fills up with RateLimit codes.
+
+Usage: python benchmarking/load_test.py [--clients 100] [--scratch 0.5] [--duration 20]
+                                        [--rate 2] [--chats 10] [--mode asyncio|threaded]
+                                        [--mix post_home=1,get_home=3,post_chat=1,set_chat_state=3,ping=4]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from websocket_asyncio import read_frame, encode_frame, OPCODE_TEXT, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG
+
+PASSWORD = "benchmark-password"
+TRUST_KEY = "meower" # The default trust key files.py creates
+DEFAULT_MIX = "post_home=1,get_home=3,post_chat=1,set_chat_state=3,ping=4"
+
+def chat_id(index):
+    return "bench-chat-{0}".format(index)
+
+def username(index):
+    return "bench{0}".format(index)
+
+def serve(args): # Runs in the child process: seeds the in-memory database and runs the server
+    from memory_db import MemoryDatabase
+    from files import Files
+    from security import Security
+    from main import Main
+
+    db = MemoryDatabase()
+    log = lambda event, *args, **kwargs: None
+    files = Files(logger=log, errorhandler=None, db=db)
+    accounts = Security(files=files, supporter=None, logger=log, errorhandler=None)
+    for i in range(args.clients):
+        # Cheap hashes, logging in is not what's being measured
+        accounts.create_account(username(i), PASSWORD, strength=4)
+    for i in range(args.chats):
+        members = [username(j) for j in range(args.clients) if j % args.chats == i]
+        files.create_item("chats", chat_id(i), {"nickname": chat_id(i), "owner": members[0] if members else "Server", "members": members})
+    for i in range(50):
+        files.create_item("posts", "bench-post-{0}".format(i), {"type": 1, "post_origin": "home", "u": username(0), "t": {"e": i}, "p": "Seed post {0}".format(i), "post_id": "bench-post-{0}".format(i), "isDeleted": False})
+
+    Main(mode=args.mode, port=args.port, db=db, rest_api=False)
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def read_proc_stats(pid): # Returns (CPU seconds, RSS bytes, peak RSS bytes) of a process, or None without /proc
+    try:
+        with open("/proc/{0}/stat".format(pid)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        rss = peak = 0
+        with open("/proc/{0}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+        return cpu, rss, peak
+    except (OSError, IndexError, ValueError):
+        return None
+
+class Results:
+    def __init__(self):
+        self.latency = {} # Command -> seconds
+        self.codes = {} # Command -> {status code: count}
+        self.delivery = {"home": [], "chat": []} # Seconds from sending a post to another client receiving it
+        self.sent_posts = {} # Post text -> time it was sent
+
+    def record(self, command, code, elapsed):
+        self.latency.setdefault(command, []).append(elapsed)
+        codes = self.codes.setdefault(command, {})
+        codes[code] = codes.get(code, 0) + 1
+
+class BenchClient:
+    def __init__(self, index, scratch, chatid, args, results):
+        self.index = index
+        self.username = username(index)
+        self.scratch = scratch
+        self.chatid = chatid
+        self.args = args
+        self.results = results
+        self.reader = None
+        self.writer = None
+        self.waiting = {} # Listener -> future for its status code
+        self.seq = 0
+        self.recording = False
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            "GET / HTTP/1.1\r\n"
+            "Host: {0}:{1}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            "Sec-WebSocket-Key: {2}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        ).format(self.args.host, self.args.port, key).encode())
+        response = await self.reader.readuntil(b"\r\n\r\n")
+        if not response.startswith(b"HTTP/1.1 101"):
+            raise ConnectionError("Handshake refused: {0}".format(response.split(b"\r\n")[0].decode()))
+        asyncio.ensure_future(self.read_loop())
+
+    def send(self, packet):
+        self.writer.write(encode_frame(json.dumps(packet), OPCODE_TEXT, mask=os.urandom(4)))
+
+    def send_direct(self, cmd, val, listener=None):
+        inner = {"cmd": cmd, "val": val}
+        if self.scratch and (not cmd in ["type", "ip"]):
+            # Scratch projects send Meower commands as JSON strings (the extension itself sends the handshake)
+            inner = json.dumps(inner)
+        packet = {"cmd": "direct", "val": inner}
+        if not listener == None:
+            packet["listener"] = listener
+        self.send(packet)
+
+    async def request(self, cmd, val): # Sends a command and waits for its status code, returns it
+        self.seq += 1
+        listener = "{0}-{1}".format(cmd, self.seq)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[listener] = future
+        start = time.perf_counter()
+        self.send_direct(cmd, val, listener)
+        try:
+            code = await asyncio.wait_for(future, self.args.timeout)
+        except asyncio.TimeoutError:
+            code = "Timeout"
+        finally:
+            self.waiting.pop(listener, None)
+        if self.recording:
+            self.results.record(cmd, code, time.perf_counter() - start)
+        return code
+
+    async def login(self):
+        await self.connect()
+        self.send_direct("type", "scratch" if self.scratch else "js")
+        self.send_direct("ip", "10.{0}.{1}.{2}".format((self.index >> 16) & 255, (self.index >> 8) & 255, self.index & 255))
+        self.seq += 1
+        listener = "trust-{0}".format(self.seq)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[listener] = future
+        self.send({"cmd": "direct", "val": TRUST_KEY, "listener": listener})
+        code = await asyncio.wait_for(future, self.args.timeout)
+        if not code == "OK":
+            raise ConnectionError("Trust key refused: {0}".format(code))
+        code = await self.request("authpswd", {"username": self.username, "pswd": PASSWORD})
+        if not code == "OK":
+            raise ConnectionError("Login failed for {0}: {1}".format(self.username, code))
+
+    async def read_loop(self):
+        try:
+            while True:
+                fin, rsv1, opcode, masked, length = await read_frame(self.reader)
+                payload = await self.reader.readexactly(length)
+                if opcode == OPCODE_PING:
+                    self.writer.write(encode_frame(payload, OPCODE_PONG, mask=os.urandom(4)))
+                elif opcode == OPCODE_CLOSE:
+                    return
+                elif opcode == OPCODE_TEXT:
+                    self.on_packet(json.loads(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def on_packet(self, packet):
+        now = time.perf_counter()
+        if (packet.get("cmd") == "statuscode") and ("listener" in packet):
+            future = self.waiting.get(packet["listener"])
+            if (not future == None) and (not future.done()):
+                future.set_result(packet["val"].split("| ", 1)[-1])
+        elif packet.get("cmd") == "direct":
+            val = packet.get("val")
+            if type(val) == str:
+                try:
+                    val = json.loads(val)
+                except ValueError:
+                    return
+            if (not type(val) == dict) or (not type(val.get("p")) == str):
+                return
+            sent = self.results.sent_posts.get(val["p"])
+            if (not sent == None) and self.recording and (not val.get("u") == self.username):
+                self.results.delivery["home" if val.get("post_origin") == "home" else "chat"].append(now - sent)
+
+    def post_text(self, kind):
+        text = "Benchmark {0} post {1} from {2}".format(kind, self.seq + 1, self.username)
+        self.results.sent_posts[text] = time.perf_counter()
+        return text
+
+    async def run(self, mix, deadline):
+        commands = list(mix)
+        weights = [mix[command] for command in commands]
+        interval = 1 / self.args.rate
+        # Spread the clients out instead of starting them all at once
+        await asyncio.sleep(random.random() * interval)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            command = random.choices(commands, weights)[0]
+            if command == "post_home":
+                await self.request("post_home", self.post_text("home"))
+            elif command == "get_home":
+                await self.request("get_home", {"page": 1})
+            elif command == "post_chat":
+                await self.request("post_chat", {"p": self.post_text("chat"), "chatid": self.chatid})
+            elif command == "set_chat_state":
+                await self.request("set_chat_state", {"state": 101, "chatid": self.chatid})
+            elif command == "ping":
+                await self.request("ping", "")
+            await asyncio.sleep(max(0, interval - (time.perf_counter() - start)))
+
+    def close(self):
+        if not self.writer == None:
+            try:
+                self.writer.write(encode_frame(b"\x03\xe8", OPCODE_CLOSE, mask=os.urandom(4)))
+                self.writer.close()
+            except (OSError, RuntimeError):
+                pass
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        command, weight = item.split("=")
+        if not command in ["post_home", "get_home", "post_chat", "set_chat_state", "ping"]:
+            raise SystemExit("Unknown command in --mix: {0}".format(command))
+        if float(weight) > 0:
+            mix[command] = float(weight)
+    return mix
+
+async def run_clients(args, server_pid):
+    results = Results()
+    mix = parse_mix(args.mix)
+    scratch_count = int(round(args.clients * args.scratch))
+    clients = [BenchClient(i, i < scratch_count, chat_id(i % args.chats), args, results) for i in range(args.clients)]
+
+    start = time.perf_counter()
+    for batch in range(0, len(clients), 50):
+        await asyncio.gather(*[client.login() for client in clients[batch:batch + 50]])
+    print("{0} clients logged in ({1} Scratch, {2} JS) in {3:.1f}s".format(len(clients), scratch_count, len(clients) - scratch_count, time.perf_counter() - start))
+
+    for client in clients:
+        client.recording = True
+    before = read_proc_stats(server_pid)
+    start = time.perf_counter()
+    await asyncio.gather(*[client.run(mix, start + args.duration) for client in clients])
+    elapsed = time.perf_counter() - start
+    after = read_proc_stats(server_pid)
+    # Give the last broadcasts a moment to arrive
+    await asyncio.sleep(0.5)
+    for client in clients:
+        client.close()
+    return results, elapsed, before, after
+
+def report(args, results, elapsed, before, after):
+    total = sum(len(values) for values in results.latency.values())
+    print("\n{0} requests in {1:.1f}s ({2:.0f}/s), {3} engine\n".format(total, elapsed, total / elapsed, args.mode))
+    print("{0:<16}{1:>8}{2:>10}{3:>10}{4:>10}  {5}".format("command", "count", "p50 ms", "p99 ms", "max ms", "status codes"))
+    for command in sorted(results.latency):
+        values = results.latency[command]
+        codes = ", ".join("{0} {1}".format(code, count) for code, count in sorted(results.codes[command].items()))
+        print("{0:<16}{1:>8}{2:>10.2f}{3:>10.2f}{4:>10.2f}  {5}".format(command, len(values), percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000, max(values) * 1000, codes))
+    print()
+    for kind, values in results.delivery.items():
+        if len(values) > 0:
+            print("{0:<16}{1:>8}{2:>10.2f}{3:>10.2f}{4:>10.2f}  (deliveries to other clients)".format(kind + " delivery", len(values), percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000, max(values) * 1000))
+    print()
+    if (before == None) or (after == None):
+        print("Server CPU/RSS: not available (needs /proc)")
+    else:
+        cpu = after[0] - before[0]
+        print("Server CPU: {0:.2f}s ({1:.0f}% of one core)".format(cpu, (cpu / elapsed) * 100))
+        print("Server RSS: {0:.1f} MB (peak {1:.1f} MB)".format(after[1] / 1048576, after[2] / 1048576))
+
+def wait_for_port(host, port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not process.poll() == None:
+            raise SystemExit("Server exited with status {0}".format(process.returncode))
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit("Server did not start listening on port {0}".format(port))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the Meower server")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--scratch", type=float, default=0.5, help="Fraction of clients that are Scratch clients")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run the command mix for")
+    parser.add_argument("--rate", type=float, default=2, help="Commands per second per client")
+    parser.add_argument("--chats", type=int, default=10, help="Group chats the clients are spread over")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Command weights")
+    parser.add_argument("--mode", default="asyncio", choices=["asyncio", "threaded"], help="CloudLink server engine")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds to wait for a reply")
+    parser.add_argument("--server-log", default=os.devnull, help="File for the server's output")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.chats = max(1, args.chats)
+
+    if args.serve:
+        serve(args)
+        return
+
+    with open(args.server_log, "w") as log:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"] + sys.argv[1:], stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_for_port(args.host, args.port, process)
+        results, elapsed, before, after = asyncio.run(run_clients(args, process.pid))
+        report(args, results, elapsed, before, after)
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+An in-memory stand-in for the parts of pymongo the Meower server uses, so the server can be
+benchmarked (or poked at) without a MongoDB instance. Pass a MemoryDatabase as Files(db=...).
+
+Queries support plain equality (matching array members like MongoDB does), dotted field names
+and the $all, $in, $ne and $regex operators. Updates support $set. Indexes are accepted and
+ignored, so lookups other than by _id scan the collection.
+"""
+
+import copy
+import re
+import threading
+import uuid
+
+def _get_field(document, key): # Looks up a dotted field name, returns (found, value)
+    value = document
+    for part in key.split("."):
+        if (not type(value) == dict) or (not part in value):
+            return False, None
+        value = value[part]
+    return True, value
+
+def _matches_value(value, expected):
+    if type(value) == list:
+        return (expected in value) or (value == expected)
+    return value == expected
+
+def _matches(document, query):
+    for key, condition in query.items():
+        found, value = _get_field(document, key)
+        if (type(condition) == dict) and (len(condition) > 0) and all(operator.startswith("$") for operator in condition):
+            for operator, argument in condition.items():
+                if operator == "$all":
+                    if (not type(value) == list) or (not all(item in value for item in argument)):
+                        return False
+                elif operator == "$in":
+                    if not any(_matches_value(value, item) for item in argument):
+                        return False
+                elif operator == "$ne":
+                    if _matches_value(value, argument):
+                        return False
+                elif operator == "$regex":
+                    if (not type(value) == str) or (re.search(argument, value) == None):
+                        return False
+                else:
+                    raise NotImplementedError("Query operator {0} is not supported".format(operator))
+        elif (not found) or (not _matches_value(value, condition)):
+            return False
+    return True
+
+def _project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    result = {}
+    for key, value in document.items():
+        if (key == "_id" and projection.get("_id", 1)) or projection.get(key):
+            result[key] = copy.deepcopy(value)
+    return result
+
+class DuplicateKeyError(Exception):
+    pass
+
+class MemoryCursor:
+    def __init__(self, documents, projection=None):
+        self.documents = documents
+        self.projection = projection
+        self.sort_key = None
+        self.sort_direction = 1
+        self.skip_count = 0
+        self.limit_count = 0
+
+    def sort(self, key, direction=1):
+        self.sort_key = key
+        self.sort_direction = direction
+        return self
+
+    def skip(self, count):
+        self.skip_count = count
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def __iter__(self):
+        documents = self.documents
+        if not self.sort_key == None:
+            # Documents without the field sort first, like MongoDB's null
+            def key(document):
+                found, value = _get_field(document, self.sort_key)
+                return (found, value if found else 0)
+            documents = sorted(documents, key=key, reverse=(self.sort_direction < 0))
+        documents = documents[self.skip_count:]
+        if self.limit_count > 0:
+            documents = documents[:self.limit_count]
+        for document in documents:
+            yield _project(document, self.projection)
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.documents = {} # _id -> document, in insertion order
+
+    def create_index(self, keys, **kwargs):
+        return "{0}_1".format(keys)
+
+    def _find(self, query):
+        if query == None:
+            query = {}
+        if ("_id" in query) and (not type(query["_id"]) == dict):
+            # Fast path for the lookups by ID Files does
+            document = self.documents.get(query["_id"])
+            if (not document == None) and _matches(document, query):
+                return [document]
+            return []
+        return [document for document in self.documents.values() if _matches(document, query)]
+
+    def find(self, query=None, projection=None):
+        with self.lock:
+            return MemoryCursor(self._find(query), projection)
+
+    def find_one(self, query=None, projection=None):
+        with self.lock:
+            documents = self._find(query)
+            if len(documents) == 0:
+                return None
+            return _project(documents[0], projection)
+
+    def count_documents(self, query):
+        with self.lock:
+            return len(self._find(query))
+
+    def insert_one(self, document):
+        with self.lock:
+            if not "_id" in document:
+                document["_id"] = uuid.uuid4().hex
+            if document["_id"] in self.documents:
+                raise DuplicateKeyError("Duplicate _id {0} in {1}".format(document["_id"], self.name))
+            self.documents[document["_id"]] = copy.deepcopy(document)
+
+    def _update(self, query, update, many):
+        if (len(update) == 0) or (not set(update) == {"$set"}):
+            raise NotImplementedError("Only $set updates are supported")
+        with self.lock:
+            documents = self._find(query)
+            if not many:
+                documents = documents[:1]
+            for document in documents:
+                for key, value in update["$set"].items():
+                    target = document
+                    parts = key.split(".")
+                    for part in parts[:-1]:
+                        target = target.setdefault(part, {})
+                    target[parts[-1]] = copy.deepcopy(value)
+
+    def update_one(self, query, update):
+        self._update(query, update, False)
+
+    def update_many(self, query, update):
+        self._update(query, update, True)
+
+    def find_one_and_replace(self, query, replacement):
+        with self.lock:
+            documents = self._find(query)
+            if len(documents) == 0:
+                return None
+            old = documents[0]
+            replacement = copy.deepcopy(replacement)
+            replacement["_id"] = old["_id"]
+            self.documents[old["_id"]] = replacement
+            return copy.deepcopy(old)
+
+    def _delete(self, query, many):
+        with self.lock:
+            documents = self._find(query)
+            if not many:
+                documents = documents[:1]
+            for document in documents:
+                del self.documents[document["_id"]]
+
+    def delete_one(self, query):
+        self._delete(query, False)
+
+    def delete_many(self, query):
+        self._delete(query, True)
+
+class _MemoryClient:
+    def __init__(self, database):
+        self.database = database
+
+    def get_database(self, name):
+        return self.database
+
+class MemoryDatabase:
+    def __init__(self, name="meowerserver"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.collections = {}
+        self.client = _MemoryClient(self)
+
+    def list_collection_names(self):
+        with self.lock:
+            return list(self.collections)
+
+    def create_collection(self, name):
+        return self[name]
+
+    def __getitem__(self, name):
+        with self.lock:
+            if not name in self.collections:
+                self.collections[name] = MemoryCollection(name)
+            return self.collections[name]
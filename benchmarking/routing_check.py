@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+Checks that CloudLink routes custom commands (UPL packets with an "id") to the target client
+intact, on both server engines. Client A sends a custom command with a listener and keys CloudLink
+doesn't know about to client B; B has to get the same packet with "origin" set and "id" removed,
+and A an "I:100 | OK" status code for its listener.
+
+Usage: python benchmarking/routing_check.py
+Exits with status 1 if a packet doesn't arrive as expected.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import websocket
+from cloudlink import CloudLink
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def connect(port):
+    for attempt in range(50): # Wait for the server to start listening
+        try:
+            ws = websocket.create_connection("ws://127.0.0.1:{0}/".format(port), timeout=5)
+            return ws
+        except (ConnectionRefusedError, OSError):
+            time.sleep(0.1)
+    raise RuntimeError("Server on port {0} didn't start".format(port))
+
+def wait_for(ws, match): # Returns the first packet match() accepts, or None if none arrives in time
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        try:
+            packet = json.loads(ws.recv())
+        except websocket.WebSocketTimeoutException:
+            return None
+        if match(packet):
+            return packet
+    return None
+
+def check(mode):
+    port = free_port()
+    cl = CloudLink()
+    def on_packet(packet): # setid is disabled, so clients are named the way Supporter.autoID names them after authpswd
+        if packet.cmd == "login":
+            cl.statedata["ulist"]["objs"][packet.client["id"]]["username"] = packet.val
+            cl._add_username(packet.val, packet.client)
+            cl.sendCode(packet.client, "OK", packet.listener_detected, packet.listener)
+    cl.callback("on_packet", on_packet)
+    threading.Thread(target=cl.server, kwargs={"port": port, "mode": mode}, daemon=True).start()
+
+    clients = {}
+    for name in ("A", "B"):
+        ws = connect(port)
+        ws.send(json.dumps({"cmd": "direct", "val": {"cmd": "login", "val": name}, "listener": "login"}))
+        wait_for(ws, lambda packet: packet.get("listener") == "login")
+        clients[name] = ws
+
+    sent = {"cmd": "custom", "val": {"text": "hi", "list": [1, 2]}, "id": "B", "listener": "route", "color": "blue", "meta": {"n": 1}}
+    clients["A"].send(json.dumps(sent))
+    status = wait_for(clients["A"], lambda packet: packet.get("listener") == "route")
+    received = wait_for(clients["B"], lambda packet: packet.get("cmd") == "custom")
+
+    expected = dict(sent, origin="A")
+    del expected["id"]
+    failures = []
+    if status != {"cmd": "statuscode", "val": cl.codes["OK"], "listener": "route"}:
+        failures.append("A got {0!r}".format(status))
+    if received != expected:
+        failures.append("B got {0!r}, expected {1!r}".format(received, expected))
+
+    for ws in clients.values():
+        ws.close()
+    print("{0}: {1}".format(mode, "; ".join(failures) if failures else "ok"))
+    return not failures
+
+def main():
+    results = [check(mode) for mode in ("threaded", "asyncio")]
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from threading import Lock
+
 from .better_profanity import Profanity
 
 __all__ = ["name", "__version__", "profanity"]
@@ -7,4 +9,15 @@ __all__ = ["name", "__version__", "profanity"]
 name = "better_profanity"
 __version__ = "0.7.0"
 
-profanity = Profanity()
+_profanity_lock = Lock()
+
+
+def __getattr__(attribute):
+    # The shared `profanity` instance is created on first use, not when the package is imported
+    global profanity
+    if attribute == "profanity":
+        with _profanity_lock:
+            if "profanity" not in globals():
+                profanity = Profanity()
+        return profanity
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, attribute))
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+"""Builds the precompiled word list artifact: python -m better_profanity [--output PATH] [--check]"""
+
+from .compiled import main
+
+main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks `Profanity.censor` on a corpus of chat messages and guards against superlinear
+worst cases.
+
+The corpus has five kinds of messages, up to 360 characters (the longest Meower post):
+normal chat, leetspeak, unicode letters from `alphabetic_unicode.json`, long unbroken
+tokens and separator-heavy strings. For each kind the benchmark reports the per-message
+latency (p50, p99, max) and the throughput.
+
+The guard then times messages of each kind at growing lengths and fits how the latency
+scales with the length. It fails if, for any kind, doubling the length more than roughly
+doubles the time (the fitted exponent is above --max-exponent).
+
+Usage: python benchmarking/scripts/benchmark.py [--messages N] [--seed N] [--no-guard]
+Exits with status 1 if the guard fails.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+# The directory that contains the better_profanity package
+PACKAGE_PARENT = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir)
+)
+sys.path.insert(0, PACKAGE_PARENT)
+
+from better_profanity import Profanity  # noqa: E402
+from better_profanity.utils import (  # noqa: E402
+    get_complete_path_of_file,
+    read_wordlist,
+)
+
+MAX_LENGTH = 360
+GUARD_LENGTHS = (90, 180, 360, 720, 1440)
+
+CHAT_WORDS = (
+    "hey hi hello lol yeah no what how are you doing today i think that is so cool "
+    "meower post chat game project scratch remix thanks bye see you later gg nice "
+    "anyone here? did you see the new update it's broken again can you help me"
+).split()
+SEPARATORS = " _-.,!?*/|~+=:;()[]<>\n\t"
+
+
+def load_unicode_letters():
+    with open(get_complete_path_of_file("alphabetic_unicode.json"), encoding="utf-8") as file:
+        return [char for char in json.load(file) if ord(char) > 127]
+
+
+class Corpus:
+    """Generates messages of each kind, of about the requested length."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.swear_words = list(read_wordlist(get_complete_path_of_file("profanity_wordlist.txt")))
+        self.unicode_letters = load_unicode_letters()
+        self.chars_mapping = Profanity().CHARS_MAPPING
+        self.kinds = {
+            "normal chat": self.normal_chat,
+            "leetspeak": self.leetspeak,
+            "unicode": self.unicode,
+            "long tokens": self.long_tokens,
+            "separators": self.separators,
+        }
+
+    def _fill(self, length, next_word, joiner=" "):
+        parts = []
+        size = 0
+        while size < length:
+            word = next_word()
+            parts.append(word)
+            size += len(word) + len(joiner)
+        return joiner.join(parts)[:length]
+
+    def normal_chat(self, length):
+        def next_word():
+            if self.rng.random() < 0.05:
+                return self.rng.choice(self.swear_words)
+            return self.rng.choice(CHAT_WORDS)
+
+        return self._fill(length, next_word)
+
+    def leetspeak(self, length):
+        def next_word():
+            word = self.rng.choice(self.swear_words if self.rng.random() < 0.5 else CHAT_WORDS)
+            chars = []
+            for char in word:
+                if char in self.chars_mapping and self.rng.random() < 0.5:
+                    char = self.rng.choice(self.chars_mapping[char])
+                chars.append(char.upper() if self.rng.random() < 0.2 else char)
+            return "".join(chars)
+
+        return self._fill(length, next_word)
+
+    def unicode(self, length):
+        if self.rng.random() < 0.5:
+            # One unbroken word, lowercased one character at a time when it's checked
+            return "".join(self.rng.choice(self.unicode_letters) for _ in range(length))
+
+        def next_word():
+            return "".join(self.rng.choice(self.unicode_letters) for _ in range(self.rng.randint(1, 12)))
+
+        return self._fill(length, next_word)
+
+    def long_tokens(self, length):
+        # One unbroken token, sometimes ending (or starting) with a swear word
+        word = self.rng.choice(self.swear_words).replace(" ", "")
+        filler = "".join(self.rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(length))
+        if self.rng.random() < 0.5:
+            return (filler + word)[-length:]
+        return (word + filler)[:length]
+
+    def separators(self, length):
+        def next_word():
+            if self.rng.random() < 0.5:
+                return "".join(self.rng.choice(SEPARATORS) for _ in range(self.rng.randint(1, 6)))
+            # Swear words spelled out with separators between the letters, like "f.u.c.k"
+            word = self.rng.choice(self.swear_words)
+            return self.rng.choice(SEPARATORS).join(word)
+
+        return self._fill(length, next_word, joiner=self.rng.choice(SEPARATORS))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def time_censor(profanity, text):
+    start = time.perf_counter()
+    profanity.censor(text)
+    return time.perf_counter() - start
+
+
+def run_benchmark(profanity, corpus, messages):
+    print("{0:<14}{1:>9}{2:>10}{3:>10}{4:>10}{5:>12}{6:>12}".format(
+        "kind", "messages", "p50 us", "p99 us", "max us", "msgs/s", "chars/s"
+    ))
+    for name, generate in corpus.kinds.items():
+        texts = [generate(corpus.rng.randint(1, MAX_LENGTH)) for _ in range(messages)]
+        latencies = [time_censor(profanity, text) for text in texts]
+        total = sum(latencies)
+        print("{0:<14}{1:>9}{2:>10.1f}{3:>10.1f}{4:>10.1f}{5:>12.0f}{6:>12.0f}".format(
+            name,
+            len(texts),
+            percentile(latencies, 0.5) * 1e6,
+            percentile(latencies, 0.99) * 1e6,
+            max(latencies) * 1e6,
+            len(texts) / total,
+            sum(len(text) for text in texts) / total,
+        ))
+
+
+def fit_exponent(lengths, times):
+    """Return the least-squares slope of log(time) against log(length)."""
+    xs = [math.log(length) for length in lengths]
+    ys = [math.log(max(value, 1e-9)) for value in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum(
+        (x - mean_x) ** 2 for x in xs
+    )
+
+
+def run_guard(profanity, corpus, samples, max_exponent):
+    print("\nScaling guard (mean time per message by length, fitted exponent)")
+    print("{0:<14}".format("kind") + "".join("{0:>10}".format(length) for length in GUARD_LENGTHS) + "  exponent")
+    failed = []
+    for name, generate in corpus.kinds.items():
+        times = []
+        for length in GUARD_LENGTHS:
+            texts = [generate(length) for _ in range(samples)]
+            # Best of three runs per text keeps scheduler noise out of the fit, and the mean
+            # (not the median) keeps the slow messages of a kind in it
+            times.append(sum(min(time_censor(profanity, text) for _ in range(3)) for text in texts) / len(texts))
+        exponent = fit_exponent(GUARD_LENGTHS, times)
+        status = "ok" if exponent <= max_exponent else "SUPERLINEAR"
+        if exponent > max_exponent:
+            failed.append(name)
+        print("{0:<14}".format(name) + "".join("{0:>8.0f}us".format(value * 1e6) for value in times) + "  {0:8.2f} {1}".format(exponent, status))
+    if failed:
+        print("\nFAILED: latency grows faster than length^{0} for: {1}".format(max_exponent, ", ".join(failed)))
+    else:
+        print("\nOK: every kind scales at most like length^{0}".format(max_exponent))
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=500, help="messages of each kind to benchmark")
+    parser.add_argument("--samples", type=int, default=20, help="messages of each kind and length for the guard")
+    parser.add_argument("--max-exponent", type=float, default=1.25, help="highest allowed latency/length exponent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-guard", action="store_true", help="only run the benchmark")
+    args = parser.parse_args()
+
+    corpus = Corpus(random.Random(args.seed))
+    profanity = Profanity()
+    profanity.censor("warm up")
+
+    run_benchmark(profanity, corpus, args.messages)
+    if not args.no_guard and not run_guard(profanity, corpus, args.samples, args.max_exponent):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
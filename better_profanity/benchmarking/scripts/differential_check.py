@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checks that `Profanity.censor` gives exactly the same output as the linear word list scan
+it replaced, on a random corpus built from the word list (leetspeak, mixed case, separators,
+prefixes and suffixes, unicode) and on a few custom word lists and whitelists.
+
+Usage: python benchmarking/scripts/differential_check.py [--texts N] [--seed N]
+Exits with status 1 if any text is censored differently.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+# The directory that contains the better_profanity package
+PACKAGE_PARENT = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir)
+)
+sys.path.insert(0, PACKAGE_PARENT)
+
+from better_profanity import Profanity  # noqa: E402
+from better_profanity.utils import (  # noqa: E402
+    get_complete_path_of_file,
+    get_replacement_for_swear_word,
+    read_wordlist,
+)
+
+
+class ReferenceProfanity(Profanity):
+    """The engine before `WordMatcher`: every lookup compares the text with every word."""
+
+    def _get_word_matcher(self):
+        return self.CENSOR_WORDSET
+
+    def _check_for_profanity_within(self, cur_word, censor_char, next_words_indices):
+        if cur_word in self.CENSOR_WORDSET:
+            return cur_word
+
+        if not cur_word.lower() in self.whitelist:
+            for idx, chr in iter(enumerate(cur_word)):
+                if cur_word[idx:].lower() in self.CENSOR_WORDSET:
+                    cur_word = cur_word[:idx] + get_replacement_for_swear_word(
+                        censor_char
+                    )
+                    break
+
+            cur_check_word = cur_word + "a"
+
+            for idx, chr in iter(enumerate(cur_word)):
+                if cur_check_word.lower() in self.CENSOR_WORDSET:
+                    cur_word = (
+                        get_replacement_for_swear_word(censor_char)
+                        + cur_word[len(cur_check_word) :]
+                    )
+                    break
+
+                cur_check_word = cur_check_word[:-1]
+
+        return cur_word
+
+
+CLEAN_WORDS = [
+    "hello",
+    "world",
+    "class",
+    "assess",
+    "grape",
+    "scunthorpe",
+    "cockpit",
+    "therapist",
+    "shiitake",
+    "what's",
+    "Ünïcödé",
+    "İstanbul",
+    "ΑΣ",
+    "naïve",
+    "",
+]
+SEPARATORS = [" ", " ", " ", "  ", "_", "-", ".", ", ", "!", "?\n", " * ", "\t"]
+AFFIXES = ["", "", "", "s", "ed", "ing", "er", "a", "y", "123", "pre", "un", "xx"]
+
+
+def leetspeak(word, chars_mapping, rng):
+    chars = []
+    for char in word:
+        if char in chars_mapping and rng.random() < 0.3:
+            char = rng.choice(chars_mapping[char])
+        if rng.random() < 0.2:
+            char = char.upper()
+        chars.append(char)
+    return "".join(chars)
+
+
+def random_text(words, chars_mapping, rng):
+    parts = []
+    for _ in range(rng.randint(1, 10)):
+        if rng.random() < 0.5:
+            word = leetspeak(rng.choice(words), chars_mapping, rng)
+            if rng.random() < 0.3:
+                word = rng.choice(AFFIXES) + word + rng.choice(AFFIXES)
+            if rng.random() < 0.1:
+                # A swear word split over two words, like "hand job"
+                middle = rng.randint(0, len(word))
+                word = word[:middle] + rng.choice(SEPARATORS) + word[middle:]
+        else:
+            word = rng.choice(CLEAN_WORDS)
+        parts.append(word)
+        parts.append(rng.choice(SEPARATORS))
+    if rng.random() < 0.5:
+        parts.pop()
+    return "".join(parts)
+
+
+def check(name, setup, texts):
+    new, reference = Profanity(), ReferenceProfanity()
+    setup(new)
+    setup(reference)
+    differences = 0
+    for text in texts:
+        for censor_char in ("*", "-"):
+            expected = reference.censor(text, censor_char)
+            result = new.censor(text, censor_char)
+            if result != expected:
+                differences += 1
+                if differences <= 10:
+                    print("  {0!r}\n    expected {1!r}\n    got      {2!r}".format(text, expected, result))
+    print("{0}: {1} texts, {2} differences".format(name, len(texts), differences))
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--texts", type=int, default=2000, help="random texts per word list")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    default_words = list(read_wordlist(get_complete_path_of_file("profanity_wordlist.txt")))
+    chars_mapping = Profanity().CHARS_MAPPING
+    texts = [random_text(default_words, chars_mapping, rng) for _ in range(args.texts)]
+    custom_words = ["grape", "bass", "h3ll0", "multi word", "a*b"]
+    custom_texts = [random_text(custom_words + CLEAN_WORDS, chars_mapping, rng) for _ in range(args.texts // 4)]
+    whitelist = [rng.choice(default_words) for _ in range(20)]
+
+    differences = 0
+    differences += check("default word list", lambda profanity: None, texts)
+    differences += check(
+        "default word list with a whitelist",
+        lambda profanity: profanity.load_censor_words(whitelist_words=list(whitelist)),
+        texts,
+    )
+    differences += check(
+        "custom word list",
+        lambda profanity: profanity.load_censor_words(custom_words=custom_words),
+        custom_texts,
+    )
+    differences += check(
+        "added words",
+        lambda profanity: profanity.add_censor_words(["Grape", "bass"]),
+        texts[: args.texts // 4] + custom_texts,
+    )
+
+    def multi_character_substitutions(profanity):
+        profanity.CHARS_MAPPING = dict(profanity.CHARS_MAPPING)
+        profanity.CHARS_MAPPING.update({"c": ("c", "k", "ck"), "h": ("h", ""), "x": ("x", "ks")})
+        profanity.load_censor_words(custom_words=custom_words + ["chuck", "hex", "shh"])
+
+    multi_texts = [
+        random_text(custom_words + ["chuck", "hex", "shh", "kuk", "hecks", "suck"], chars_mapping, rng)
+        for _ in range(args.texts // 4)
+    ]
+    differences += check("multi-character substitutions", multi_character_substitutions, multi_texts)
+    unicode_words = ["föck", "σας", "ςσ", "i̇x", "straße", "grape"]
+    unicode_texts = [
+        random_text(unicode_words + ["FÖCK", "ΣΑΣ", "ΑΣ", "İX", "STRASSE", "xxföck", "ΣΣ"], chars_mapping, rng)
+        for _ in range(args.texts // 4)
+    ]
+    differences += check(
+        "non-ASCII word list",
+        lambda profanity: profanity.load_censor_words(custom_words=list(unicode_words)),
+        unicode_texts,
+    )
+    sys.exit(1 if differences > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@
 
 from collections.abc import Iterable
 
-from .constants import ALLOWED_CHARACTERS, ALLOWED_CONTANING_PROFANITY
+from .compiled import get_artifact
+from .constants import get_allowed_characters, get_allowed_containing_profanity
 from .utils import (
     any_next_words_form_swear_word,
     get_complete_path_of_file,
@@ -10,6 +11,7 @@ from .utils import (
     read_wordlist,
 )
 from .varying_string import VaryingString
+from .word_matcher import WordMatcher
 
 
 class Profanity:
@@ -30,6 +32,9 @@ class Profanity:
         ):
             raise TypeError("words must be of type str, list, or None")
         self.CENSOR_WORDSET = []
+        self._word_matcher = None
+        # (wordset, its size, compiled tries) while CENSOR_WORDSET is the default word list
+        self._compiled_wordset = None
         self.CHARS_MAPPING = {
             "a": ("a", "@", "*", "4"),
             "i": ("i", "*", "l", "1"),
@@ -42,11 +47,11 @@ class Profanity:
             "t": ("t", "7"),
         }
         self.MAX_NUMBER_COMBINATIONS = 1
-        self.ALLOWED_CHARACTERS = ALLOWED_CHARACTERS
+        self.ALLOWED_CHARACTERS = get_allowed_characters()
        
         self.whitelist = whitelist or set([])
         self.whitelist = set(self.whitelist)
-        self.whitelist.update(ALLOWED_CONTANING_PROFANITY)
+        self.whitelist.update(get_allowed_containing_profanity())
       
         self._default_wordlist_filename = get_complete_path_of_file(
             "profanity_wordlist.txt"
@@ -70,6 +75,27 @@ class Profanity:
             self.load_censor_words()
         return self._hide_swear_words(text, censor_char)
 
+    def censor_many(self, texts, censor_char="*"):
+        """Censor every text in `texts` and return the results as a list.
+
+        Texts that appear more than once in `texts` are only censored once.
+        """
+        if not isinstance(censor_char, str):
+            censor_char = str(censor_char)
+
+        if not self.CENSOR_WORDSET:
+            self.load_censor_words()
+        censored = {}
+        results = []
+        for text in texts:
+            if not isinstance(text, str):
+                text = str(text)
+            result = censored.get(text)
+            if result is None:
+                result = censored[text] = self._hide_swear_words(text, censor_char)
+            results.append(result)
+        return results
+
     def load_censor_words_from_file(self, filename, **kwargs):
         words = read_wordlist(filename)
         self._populate_words_to_wordset(words, **kwargs)
@@ -77,9 +103,22 @@ class Profanity:
     def load_censor_words(self, custom_words=None, **kwargs):
         """Generate a set of words that need to be censored."""
         # Replace the words from `profanity_wordlist.txt` with a custom list
+        artifact = None
+        if not custom_words and self._default_wordlist_filename == get_complete_path_of_file(
+            "profanity_wordlist.txt"
+        ):
+            artifact = get_artifact()
+        if artifact is not None:
+            custom_words = artifact.words
         custom_words = custom_words or read_wordlist(self._default_wordlist_filename)
         self._populate_words_to_wordset(custom_words, **kwargs)
 
+        if artifact is not None:
+            # The words can be matched with the precompiled tries of the default word list
+            tries = artifact.get_tries(self.CHARS_MAPPING, self._excluded_words)
+            if tries is not None:
+                self._compiled_wordset = (self.CENSOR_WORDSET, len(self.CENSOR_WORDSET), tries)
+
     def add_censor_words(self, custom_words):
         if not isinstance(custom_words, (list, tuple, set)):
             raise TypeError(
@@ -132,6 +171,25 @@ class Profanity:
 
         # The default wordlist takes ~5MB+ of memory
         self.CENSOR_WORDSET = all_censor_words
+        self._excluded_words = whitelist_words
+        self._compiled_wordset = None
+
+    def _get_word_matcher(self):
+        """Return the `WordMatcher` of `CENSOR_WORDSET`, rebuilding it if the words changed."""
+        matcher = self._word_matcher
+        if matcher is None or not matcher.matches_wordset(self.CENSOR_WORDSET):
+            compiled = self._compiled_wordset
+            if (
+                compiled is not None
+                and compiled[0] is self.CENSOR_WORDSET
+                and compiled[1] == len(self.CENSOR_WORDSET)
+            ):
+                forward, reverse = compiled[2]
+                matcher = WordMatcher(self.CENSOR_WORDSET, trie=forward, reversed_trie=reverse)
+            else:
+                matcher = WordMatcher(self.CENSOR_WORDSET)
+            self._word_matcher = matcher
+        return matcher
 
     def _count_non_allowed_characters(self, word):
         count = 0
@@ -154,6 +212,8 @@ class Profanity:
 
     def _hide_swear_words(self, text, censor_char):
         """Replace the swear words with censor characters."""
+        censor_words = self._get_word_matcher()
+        allowed_characters = get_allowed_characters()
         censored_text = ""
         cur_word = ""
         skip_index = -1
@@ -173,7 +233,7 @@ class Profanity:
         for index, char in iter(enumerate(text)):
             if index < skip_index:
                 continue
-            if char in ALLOWED_CHARACTERS:
+            if char in allowed_characters:
                 cur_word += char
                 continue
 
@@ -193,7 +253,7 @@ class Profanity:
 
           
             contains_swear_word, end_index = any_next_words_form_swear_word(
-                cur_word, next_words_indices, self.CENSOR_WORDSET
+                cur_word, next_words_indices, censor_words
             )
             if contains_swear_word:
                 cur_word = get_replacement_for_swear_word(censor_char)
@@ -202,7 +262,7 @@ class Profanity:
                 next_words_indices = []
 
             # If the current a swear word
-            if cur_word.lower() in self.CENSOR_WORDSET:
+            if cur_word.lower() in censor_words:
                 cur_word = get_replacement_for_swear_word(censor_char)
 
             
@@ -215,7 +275,7 @@ class Profanity:
                   
         # Final check
         if cur_word != "" and skip_index < len(text) - 1:
-            if cur_word.lower() in self.CENSOR_WORDSET:
+            if cur_word.lower() in censor_words:
                 cur_word = get_replacement_for_swear_word(censor_char)
 
                       
@@ -228,27 +288,62 @@ class Profanity:
     def _check_for_profanity_within(self, cur_word, censor_char, next_words_indices):
       """Checks if there is profanity within """
       
-      if cur_word in self.CENSOR_WORDSET:
+      censor_words = self._get_word_matcher()
+      if cur_word in censor_words:
         return cur_word
       
       if not cur_word.lower() in self.whitelist:
-        for idx, chr in iter(enumerate(cur_word)):
-          if cur_word[idx:].lower() in self.CENSOR_WORDSET:
-            cur_word = cur_word[:idx] + get_replacement_for_swear_word(censor_char)
-            
-            break
+        idx = self._get_swear_word_suffix_start(cur_word, censor_words)
+        if idx >= 0:
+          cur_word = cur_word[:idx] + get_replacement_for_swear_word(censor_char)
 
         cur_check_word = cur_word + 'a'
         
-        for idx, chr in iter(enumerate(cur_word)):
-          if cur_check_word.lower() in self.CENSOR_WORDSET:
-            cur_word = get_replacement_for_swear_word(censor_char) + cur_word[len(cur_check_word):]
-            break
-            
-          cur_check_word = cur_check_word[:-1]
+        length = self._get_swear_word_prefix_length(cur_check_word, censor_words)
+        if length >= 0:
+          cur_word = get_replacement_for_swear_word(censor_char) + cur_word[length:]
       
       return cur_word
   
+    def _get_swear_word_suffix_start(self, word, censor_words):
+        """Return where the longest suffix of `word` that is a swear word starts, or -1."""
+        # Lowercasing ASCII doesn't depend on the rest of the word, so the ASCII suffixes are
+        # checked in one pass. The longer ones all contain the last non-ASCII character, and
+        # only need lowercasing and checking one by one if that character could match.
+        start = len(word)
+        while start > 0 and word[start - 1].isascii():
+            start -= 1
+        if start > 0 and self._could_match_lowercase(word[start - 1], censor_words):
+            for idx in range(start):
+                if word[idx:].lower() in censor_words:
+                    return idx
+        length = censor_words.longest_suffix(word[start:].lower())
+        if length > 0:
+            return len(word) - length
+        return -1
+
+    def _get_swear_word_prefix_length(self, word, censor_words):
+        """Return the length of the longest prefix of `word` (2 characters or more) that is a swear word, or -1."""
+        end = 0
+        while end < len(word) and word[end].isascii():
+            end += 1
+        if end < len(word) and self._could_match_lowercase(word[end], censor_words):
+            for length in range(len(word), max(end, 1), -1):
+                if word[:length].lower() in censor_words:
+                    return length
+        length = censor_words.longest_prefix(word[:end].lower())
+        if length > 1:
+            return length
+        return -1
+
+    def _could_match_lowercase(self, char, censor_words):
+        """Return True if `char` lowercased could be part of a swear word."""
+        forms = [char.lower()]
+        if char == "\u03a3":
+            # Capital sigma lowercases to a final sigma at the end of a word
+            forms.append("\u03c2")
+        return any(censor_words.in_alphabet(form) for form in forms)
+
     def _get_start_index_of_next_word(self, text, start_idx):
         """Return the index of the first character of the next word in the given text."""
         start_idx_of_next_word = len(text)
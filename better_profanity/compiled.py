@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+"""
+The precompiled word list artifact.
+
+Importing the package used to parse `alphabetic_unicode.json` and `contaning_allowed.txt`,
+and every `Profanity` built the whole substitution trie of the default word list the first
+time it censored something. `python -m better_profanity` does all of that once and
+writes the result to `profanity_wordlist.bin`: the allowed characters, the whitelist, the
+default words and the forward and reversed tries of the words. At runtime the file is
+memory-mapped, and the tries are read straight from it one node at a time, so processes
+running the filter share its pages instead of each building their own tries.
+
+The artifact records the size, modification time and hash of the files it was built from.
+Loading it only compares sizes and modification times; a file is hashed only when its
+modification time changed and its size didn't, as after a fresh checkout. If the artifact is
+missing, stale or unreadable, everything falls back to reading the text files, as before.
+Nothing is read until the filter first needs it.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from .utils import get_complete_path_of_file, read_wordlist
+
+MAGIC = b"BPWL"
+FORMAT_VERSION = 2
+ARTIFACT_FILENAME = "profanity_wordlist.bin"
+SOURCE_FILENAMES = (
+    "profanity_wordlist.txt",
+    "alphabetic_unicode.json",
+    "contaning_allowed.txt",
+)
+
+# Magic, format version and header length, followed by the JSON header and the sections
+_PREFIX = struct.Struct("<4sII")
+_SEPARATOR = "\x00"
+
+_artifact = None
+_artifact_loaded = False
+_artifact_lock = threading.Lock()
+
+
+def get_artifact_path():
+    return get_complete_path_of_file(ARTIFACT_FILENAME)
+
+
+def _hash_source(filename):
+    with open(get_complete_path_of_file(filename), "rb") as source_file:
+        return hashlib.sha256(source_file.read()).hexdigest()
+
+
+def get_sources():
+    """Return the size, modification time and SHA-256 of each file the artifact is built from."""
+    sources = {}
+    for filename in SOURCE_FILENAMES:
+        # Stat first, a file changed while it is hashed then looks modified
+        stat = os.stat(get_complete_path_of_file(filename))
+        sources[filename] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": _hash_source(filename),
+        }
+    return sources
+
+
+def sources_match(sources):
+    """Return True if the files are the ones `sources` (from `get_sources()`) describes."""
+    for filename in SOURCE_FILENAMES:
+        recorded = sources[filename]
+        stat = os.stat(get_complete_path_of_file(filename))
+        if stat.st_size != recorded["size"]:
+            return False
+        if stat.st_mtime_ns != recorded["mtime_ns"] and _hash_source(filename) != recorded["sha256"]:
+            return False
+    return True
+
+
+def _normalize_chars_mapping(chars_mapping):
+    return {char: tuple(options) for char, options in chars_mapping.items()}
+
+
+class CompiledWordTrie:
+    """
+    A `WordTrie` read from the artifact. Nodes are decoded from the memory-mapped arrays
+    when the matcher first needs them, and `excluded` nodes (whitelisted words) never end a
+    word.
+    """
+
+    def __init__(self, section, excluded=frozenset()):
+        self._combos = section["combos"]
+        self._offsets = section["offsets"]
+        self._terminal = section["terminal"]
+        self._combo_ids = section["combo_ids"]
+        self._children = section["children"]
+        self._excluded = excluded
+        self.alphabet = section["alphabet"]
+
+    def edges(self, node):
+        edges = {}
+        for index in range(self._offsets[node], self._offsets[node + 1]):
+            child = self._children[index]
+            for option in self._combos[self._combo_ids[index]]:
+                if option != "":
+                    edges.setdefault(option[0], []).append((child, option[1:]))
+        return edges
+
+    def empty_edges(self, node):
+        return [
+            self._children[index]
+            for index in range(self._offsets[node], self._offsets[node + 1])
+            if "" in self._combos[self._combo_ids[index]]
+        ]
+
+    def is_terminal(self, node):
+        return self._terminal[node] == 1 and node not in self._excluded
+
+
+class CompiledWordlist:
+    """A loaded artifact. Use `get_artifact()` rather than creating one."""
+
+    def __init__(self, path):
+        with open(path, "rb") as artifact_file:
+            self._mmap = mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("{0} is not a version {1} word list artifact".format(path, FORMAT_VERSION))
+        self.header = json.loads(
+            self._mmap[_PREFIX.size : _PREFIX.size + header_length].decode("utf-8")
+        )
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError("{0} was built for another byte order".format(path))
+        self._view = memoryview(self._mmap)
+        self.chars_mapping = _normalize_chars_mapping(self.header["chars_mapping"])
+        self.allowed_characters = set(self._strings("allowed_characters"))
+        self.whitelist = self._strings("whitelist")
+        self._words = None
+        self._tries = {
+            name: self._trie_section(name) for name in ("forward", "reverse")
+        }
+
+    def _section(self, name):
+        offset, length = self.header["sections"][name]
+        return self._view[offset : offset + length]
+
+    def _strings(self, name):
+        if self.header["counts"][name] == 0:
+            return []
+        return bytes(self._section(name)).decode("utf-8").split(_SEPARATOR)
+
+    def _trie_section(self, name):
+        combos = [tuple(options) for options in self.header["combos"][name]]
+        return {
+            "combos": combos,
+            "combo_ids_by_combo": {chars: index for index, chars in enumerate(combos)},
+            "offsets": self._section(name + ".offsets").cast("I"),
+            "terminal": self._section(name + ".terminal"),
+            "combo_ids": self._section(name + ".combo_ids").cast("I"),
+            "children": self._section(name + ".children").cast("I"),
+            "alphabet": set(self.header["alphabet"]),
+        }
+
+    @property
+    def words(self):
+        """The default word list, as `read_wordlist` returns it."""
+        if self._words is None:
+            self._words = tuple(self._strings("words"))
+        return self._words
+
+    def _find_word_node(self, section, combos):
+        node = 0
+        for chars in combos:
+            combo_id = section["combo_ids_by_combo"].get(chars)
+            if combo_id is None:
+                return None
+            for index in range(section["offsets"][node], section["offsets"][node + 1]):
+                if section["combo_ids"][index] == combo_id:
+                    node = section["children"][index]
+                    break
+            else:
+                return None
+        return node
+
+    def get_tries(self, chars_mapping, excluded_words=()):
+        """
+        Return the (forward, reversed) tries of the default word list without
+        `excluded_words`, or None if the words were built with another `chars_mapping`.
+        """
+        chars_mapping = _normalize_chars_mapping(chars_mapping)
+        if chars_mapping != self.chars_mapping:
+            return None
+        tries = []
+        for name in ("forward", "reverse"):
+            section = self._tries[name]
+            excluded = set()
+            for word in excluded_words:
+                combos = [chars_mapping.get(char, (char,)) for char in word]
+                if name == "reverse":
+                    combos = [tuple(option[::-1] for option in chars) for chars in combos[::-1]]
+                node = self._find_word_node(section, combos)
+                if node is not None:
+                    excluded.add(node)
+            tries.append(CompiledWordTrie(section, frozenset(excluded)))
+        return tuple(tries)
+
+
+def load(path=None):
+    """Return the artifact at `path`, or None if it is missing, stale or unreadable."""
+    path = path or get_artifact_path()
+    try:
+        artifact = CompiledWordlist(path)
+        if not sources_match(artifact.header["sources"]):
+            return None
+        return artifact
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        return None
+
+
+def get_artifact():
+    """Return the artifact next to the word list, loading it the first time, or None."""
+    global _artifact, _artifact_loaded
+    if not _artifact_loaded:
+        with _artifact_lock:
+            if not _artifact_loaded:
+                _artifact = load()
+                _artifact_loaded = True
+    return _artifact
+
+
+def _serialize_trie(words, reverse):
+    from array import array
+
+    from .word_matcher import build_trie
+
+    children, terminal = build_trie(words, reverse)
+    combos = []
+    combo_ids = {}
+    offsets = array("I", [0])
+    edge_combo_ids = array("I")
+    edge_children = array("I")
+    for node_children in children:
+        for chars, child in node_children.items():
+            if chars not in combo_ids:
+                combo_ids[chars] = len(combos)
+                combos.append(list(chars))
+            edge_combo_ids.append(combo_ids[chars])
+            edge_children.append(child)
+        offsets.append(len(edge_children))
+    sections = {
+        "offsets": offsets.tobytes(),
+        "terminal": bytes(1 if end else 0 for end in terminal),
+        "combo_ids": edge_combo_ids.tobytes(),
+        "children": edge_children.tobytes(),
+    }
+    return combos, sections
+
+
+def _join_strings(name, strings):
+    for string in strings:
+        if _SEPARATOR in string:
+            raise ValueError("{0} contains a NUL character: {1!r}".format(name, string))
+    return _SEPARATOR.join(strings).encode("utf-8")
+
+
+def build(path=None):
+    """Build the artifact from the text files and write it to `path`. Returns the header."""
+    from .better_profanity import Profanity
+    from .constants import read_allowed_characters, read_allowed_containing_profanity
+
+    path = path or get_artifact_path()
+    sources = get_sources()
+    profanity = Profanity()
+    words = list(read_wordlist(get_complete_path_of_file("profanity_wordlist.txt")))
+    allowed_characters = sorted(read_allowed_characters())
+    whitelist = read_allowed_containing_profanity()
+
+    # The same words `Profanity` censors with the default word list and no whitelist
+    profanity.load_censor_words_from_file(
+        get_complete_path_of_file("profanity_wordlist.txt")
+    )
+    wordset = profanity.CENSOR_WORDSET
+
+    sections = {
+        "allowed_characters": _join_strings("allowed_characters", allowed_characters),
+        "whitelist": _join_strings("whitelist", whitelist),
+        "words": _join_strings("words", words),
+    }
+    combos = {}
+    alphabet = set()
+    for name, reverse in (("forward", False), ("reverse", True)):
+        combos[name], trie_sections = _serialize_trie(wordset, reverse)
+        for chars in combos[name]:
+            for option in chars:
+                alphabet.update(option)
+        for section, data in trie_sections.items():
+            sections["{0}.{1}".format(name, section)] = data
+
+    header = {
+        "sources": sources,
+        "byteorder": sys.byteorder,
+        "chars_mapping": {char: list(options) for char, options in profanity.CHARS_MAPPING.items()},
+        "counts": {
+            "allowed_characters": len(allowed_characters),
+            "whitelist": len(whitelist),
+            "words": len(words),
+        },
+        "combos": combos,
+        "alphabet": "".join(sorted(alphabet)),
+        "built": time.time(),
+        "sections": {},
+    }
+
+    # The section offsets are part of the header, so lay the sections out after a header
+    # that is padded to a fixed size
+    header["sections"] = {name: [0, len(data)] for name, data in sections.items()}
+    header_length = len(json.dumps(header).encode("utf-8")) + 64 * len(sections)
+    offset = _PREFIX.size + header_length
+    for name, data in sections.items():
+        offset = (offset + 7) // 8 * 8
+        header["sections"][name] = [offset, len(data)]
+        offset += len(data)
+    header_bytes = json.dumps(header).encode("utf-8")
+    if len(header_bytes) > header_length:
+        raise ValueError("The artifact header doesn't fit in {0} bytes".format(header_length))
+    header_bytes = header_bytes.ljust(header_length, b" ")
+
+    temporary_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(temporary_path, "wb") as artifact_file:
+        artifact_file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, header_length))
+        artifact_file.write(header_bytes)
+        for name, data in sections.items():
+            artifact_file.write(b"\x00" * (header["sections"][name][0] - artifact_file.tell()))
+            artifact_file.write(data)
+    # Replaced in one step, so a process starting meanwhile sees the old or the new file
+    os.replace(temporary_path, path)
+    return header
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m better_profanity",
+        description="Build the precompiled word list artifact of better_profanity.",
+    )
+    parser.add_argument("--output", help="where to write it (default: {0})".format(get_artifact_path()))
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="don't build, exit with status 1 if the artifact is missing or stale",
+    )
+    args = parser.parse_args()
+
+    path = args.output or get_artifact_path()
+    if args.check:
+        if load(path) is None:
+            print("{0} is missing or out of date".format(path))
+            sys.exit(1)
+        print("{0} is up to date".format(path))
+        return
+
+    start = time.perf_counter()
+    header = build(path)
+    print(
+        "Wrote {0} ({1} bytes, {2} words, {3} allowed characters) in {4:.0f}ms".format(
+            path,
+            os.path.getsize(path),
+            header["counts"]["words"],
+            header["counts"]["allowed_characters"],
+            (time.perf_counter() - start) * 1000,
+        )
+    )
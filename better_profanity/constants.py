@@ -3,19 +3,61 @@
 from io import open
 from json import load
 from string import ascii_letters, digits
+from threading import Lock
 
+from .compiled import get_artifact
 from .utils import get_complete_path_of_file
 
-ALLOWED_CHARACTERS = set(ascii_letters)
-ALLOWED_CHARACTERS.update(set(digits))
-ALLOWED_CHARACTERS.update({"@", "$", "*", '"', "'"})
 
-# Pre-load the unicode characters
-with open(get_complete_path_of_file("alphabetic_unicode.json"), "r") as json_file:
-    ALLOWED_CHARACTERS.update(load(json_file))
+def read_allowed_characters():
+    """Return the characters words are made of, from `alphabetic_unicode.json`."""
+    allowed_characters = set(ascii_letters)
+    allowed_characters.update(set(digits))
+    allowed_characters.update({"@", "$", "*", '"', "'"})
 
+    with open(get_complete_path_of_file("alphabetic_unicode.json"), "r") as json_file:
+        allowed_characters.update(load(json_file))
+    return allowed_characters
 
 
-with open(get_complete_path_of_file("contaning_allowed.txt"), "r") as txt_file:
-  ALLOWED_CONTANING_PROFANITY = [a.strip() for a in  txt_file.readlines()]
-  
\ No newline at end of file
+def read_allowed_containing_profanity():
+    """Return the words that are allowed even though they contain a swear word."""
+    with open(get_complete_path_of_file("contaning_allowed.txt"), "r") as txt_file:
+        return [a.strip() for a in txt_file.readlines()]
+
+
+_allowed = None
+_allowed_lock = Lock()
+
+
+def _get_allowed():
+    """Read the allowed characters and words the first time they are needed."""
+    global _allowed
+    if _allowed is None:
+        with _allowed_lock:
+            if _allowed is None:
+                # From the precompiled artifact when it is up to date
+                artifact = get_artifact()
+                if artifact is not None:
+                    _allowed = (artifact.allowed_characters, artifact.whitelist)
+                else:
+                    _allowed = (read_allowed_characters(), read_allowed_containing_profanity())
+    return _allowed
+
+
+def get_allowed_characters():
+    return _get_allowed()[0]
+
+
+def get_allowed_containing_profanity():
+    return _get_allowed()[1]
+
+
+def __getattr__(name):
+    # `ALLOWED_CHARACTERS` and `ALLOWED_CONTANING_PROFANITY` are resolved on first use,
+    # importing the package doesn't read anything
+    if name == "ALLOWED_CHARACTERS":
+        return get_allowed_characters()
+    if name == "ALLOWED_CONTANING_PROFANITY":
+        return get_allowed_containing_profanity()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
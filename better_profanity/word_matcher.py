@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+def build_trie(words, reverse=False):
+    """
+    Return the trie of the `VaryingString` words' substitutions as (children, terminal): for
+    each node, a dict of substitution tuple -> child node, and whether a word ends there.
+    """
+    children = [{}]
+    terminal = [False]
+    for word in words:
+        combos = word._char_combos
+        if reverse:
+            combos = [tuple(option[::-1] for option in chars) for chars in combos[::-1]]
+        node = 0
+        for chars in combos:
+            child = children[node].get(chars)
+            if child is None:
+                child = children[node][chars] = len(children)
+                children.append({})
+                terminal.append(False)
+            node = child
+        terminal[node] = True
+    return children, terminal
+
+
+class WordTrie:
+    """
+    The words' character substitutions merged into a trie, node 0 is the root. Each edge is
+    the tuple of strings a character of a word can be written as.
+    """
+
+    def __init__(self, words, reverse=False):
+        """
+        Args:
+            words (list): `VaryingString` words.
+            reverse (bool): Build the trie of the reversed words.
+        """
+        children, self._terminal = build_trie(words, reverse)
+
+        # For each node: the first character of a substitution -> the (child, rest of the
+        # substitution) pairs it leads to, and the children behind empty substitutions
+        self._edges = []
+        self._empty_edges = []
+        self.alphabet = set()
+        for node_children in children:
+            edges = {}
+            empty_edges = []
+            for chars, child in node_children.items():
+                for option in chars:
+                    if option == "":
+                        empty_edges.append(child)
+                    else:
+                        edges.setdefault(option[0], []).append((child, option[1:]))
+                        self.alphabet.update(option)
+            self._edges.append(edges)
+            self._empty_edges.append(empty_edges)
+
+    def edges(self, node):
+        return self._edges[node]
+
+    def empty_edges(self, node):
+        return self._empty_edges[node]
+
+    def is_terminal(self, node):
+        return self._terminal[node]
+
+
+class WordMatcher:
+    """
+    Matches strings against a list of `VaryingString` words in a single pass over the string.
+
+    `text in matcher` gives the same answer as `text in words`, which compares the text with
+    every word in turn. The words' character substitutions are merged into a trie, and the
+    trie is walked as a DFA whose states are built the first time a string reaches them.
+    """
+
+    DEAD = -1
+
+    def __init__(self, words, reverse=False, trie=None, reversed_trie=None):
+        """
+        Args:
+            words (list): `VaryingString` words to match, usually `Profanity.CENSOR_WORDSET`.
+            reverse (bool): Match the reversed strings instead, used for suffix lookups.
+            trie: A prebuilt trie of `words` (reversed if `reverse`), like the compiled one.
+            reversed_trie: A prebuilt trie for the suffix lookups.
+        """
+        self.words = words
+        self.size = len(words)
+        self.reverse = reverse
+        self._reversed = None
+        self._reversed_trie = reversed_trie
+        self._trie = trie if trie is not None else WordTrie(words, reverse)
+        self._alphabet = self._trie.alphabet
+
+        # DFA states are sets of (node, rest of the substitution being read) pairs. They are
+        # added under a lock, the profanity filter is shared by many threads.
+        self._lock = threading.Lock()
+        self._states = []
+        self._state_ids = {}
+        self._transitions = []
+        self._accepting = []
+        self._start = self._get_state_id([(0, "")])
+
+    def matches_wordset(self, words):
+        """Return True if the matcher was built from the current contents of `words`."""
+        return words is self.words and len(words) == self.size
+
+    def in_alphabet(self, text):
+        """Return True if every character of `text` appears in some substitution."""
+        return all(char in self._alphabet for char in text)
+
+    def __contains__(self, text):
+        if not isinstance(text, str):
+            return False
+        if self.reverse:
+            text = text[::-1]
+        state = self._start
+        for char in text:
+            state = self._step(state, char)
+            if state == self.DEAD:
+                return False
+        return self._accepting[state]
+
+    def longest_prefix(self, text):
+        """Return the length of the longest prefix of `text` that is a word, or -1."""
+        longest = -1
+        state = self._start
+        if self._accepting[state]:
+            longest = 0
+        for index, char in enumerate(text):
+            state = self._step(state, char)
+            if state == self.DEAD:
+                break
+            if self._accepting[state]:
+                longest = index + 1
+        return longest
+
+    def longest_suffix(self, text):
+        """Return the length of the longest suffix of `text` that is a word, or -1."""
+        if self._reversed is None:
+            self._reversed = WordMatcher(
+                self.words, reverse=not self.reverse, trie=self._reversed_trie
+            )
+        return self._reversed.longest_prefix(text[::-1])
+
+    def _step(self, state, char):
+        transitions = self._transitions[state]
+        next_state = transitions.get(char)
+        if next_state is None:
+            if char not in self._alphabet:
+                # Only characters that appear in a substitution can continue a match, so
+                # the transitions for every other character don't need to be stored
+                return self.DEAD
+            with self._lock:
+                next_state = transitions[char] = self._get_next_state_id(state, char)
+        return next_state
+
+    def _get_next_state_id(self, state, char):
+        pairs = []
+        for node, rest in self._states[state]:
+            if rest != "":
+                if rest[0] == char:
+                    pairs.append((node, rest[1:]))
+                continue
+            for child, child_rest in self._trie.edges(node).get(char, ()):
+                pairs.append((child, child_rest))
+        if not pairs:
+            return self.DEAD
+        return self._get_state_id(pairs)
+
+    def _get_state_id(self, pairs):
+        # Follow the empty substitutions from every node that isn't in the middle of one
+        closure = set(pairs)
+        pending = list(closure)
+        while pending:
+            node, rest = pending.pop()
+            if rest != "":
+                continue
+            for child in self._trie.empty_edges(node):
+                if (child, "") not in closure:
+                    closure.add((child, ""))
+                    pending.append((child, ""))
+        key = frozenset(closure)
+        state = self._state_ids.get(key)
+        if state is None:
+            state = self._state_ids[key] = len(self._transitions)
+            self._states.append(key)
+            self._transitions.append({})
+            self._accepting.append(
+                any(rest == "" and self._trie.is_terminal(node) for node, rest in key)
+            )
+        return state
@@ -0,0 +1,205 @@
+import os
+import selectors
+import socket
+import struct
+import traceback
+import threading
+import codec
+from logger import logger, DEBUG, WARNING, ERROR
+
+"""
+
+CloudLink Bus Module
+
+This module links the CloudLink workers started in supervisor mode. The supervisor runs a
+BusHub on a Unix domain socket, each worker connects to it with a BusClient, and every message
+a worker publishes is relayed to all the other workers. Messages are dicts, sent as
+length-prefixed JSON.
+
+Messages with a "to" field go only to that worker. Each worker learns its own ID from the
+"welcome" message it gets on connecting.
+
+The hub also remembers which worker holds each username (from the "ulist_add" and
+"ulist_remove" messages going through it). A worker that connects is told who is already online
+elsewhere. When a worker goes away, its usernames are removed for everyone else.
+
+"""
+
+_header = struct.Struct(">I")
+
+def _pack(message): # Encodes a message as a 4-byte length followed by JSON
+    data = codec.dumps(message).encode("utf-8")
+    return _header.pack(len(data)) + data
+
+class _Reader: # Splits a byte stream back into messages
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= 4:
+            length = _header.unpack_from(self.buffer)[0]
+            if len(self.buffer) < 4 + length:
+                break
+            messages.append(codec.loads(self.buffer[4:4 + length]))
+            self.buffer = self.buffer[4 + length:]
+        return messages
+
+class BusHub:
+    def __init__(self, path, debug=False):
+        self.path = path
+        self.debug = debug
+        self.listener = None
+        self.selector = None
+        self.workers = {} # Socket -> (worker ID, _Reader)
+        self.usernames = {} # Username -> ID of the worker holding it
+        self.next_id = 1
+
+    def start(self): # Binds the socket, call before forking the workers
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(64)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+    def poll(self, timeout=None): # Accepts workers and relays their messages, runs on the supervisor's main thread
+        for key, events in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                self._accept()
+            else:
+                self._read(key.fileobj)
+
+    def _accept(self):
+        conn, address = self.listener.accept()
+        worker = self.next_id
+        self.next_id += 1
+        self.workers[conn] = (worker, _Reader())
+        self.selector.register(conn, selectors.EVENT_READ)
+        if self.debug:
+            logger.log(DEBUG, "Bus: worker {0} connected", worker)
+
+        # Tell the new worker its ID and who is online on the others
+        self._send(conn, _pack({"kind": "welcome", "worker": worker}))
+        for username, owner in self.usernames.items():
+            self._send(conn, _pack({"kind": "ulist_add", "username": username, "worker": owner}))
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(65536)
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(conn)
+            return
+        worker, reader = self.workers[conn]
+        try:
+            messages = reader.feed(data)
+        except codec.JSONDecodeError:
+            if self.debug:
+                logger.log(WARNING, "Bus: worker {0} sent invalid data, disconnecting", worker)
+            self._drop(conn)
+            return
+        for message in messages:
+            message["worker"] = worker
+            self._relay(conn, message)
+
+    def _relay(self, origin, message): # Forwards a message to its "to" worker, or else every worker except the one that sent it
+        if "to" in message:
+            for conn, (worker, reader) in list(self.workers.items()):
+                if worker == message["to"]:
+                    self._send(conn, _pack(message))
+            return
+        if message.get("kind") == "ulist_add":
+            self.usernames[message["username"]] = message["worker"]
+        elif message.get("kind") == "ulist_remove":
+            if self.usernames.get(message["username"]) == message["worker"]:
+                del self.usernames[message["username"]]
+
+        frame = _pack(message)
+        for conn in list(self.workers):
+            if not conn is origin:
+                self._send(conn, frame)
+
+    def _send(self, conn, frame):
+        try:
+            conn.sendall(frame)
+        except OSError as e:
+            # A dead worker is dropped once its socket reports EOF
+            if self.debug:
+                logger.log(WARNING, "Bus: failed to send to worker {0}: {1}", self.workers[conn][0], e)
+
+    def _drop(self, conn): # Forgets a worker and logs its users out everywhere else
+        worker = self.workers.pop(conn)[0]
+        self.selector.unregister(conn)
+        conn.close()
+        if self.debug:
+            logger.log(DEBUG, "Bus: worker {0} disconnected", worker)
+        for username in [username for username, owner in self.usernames.items() if owner == worker]:
+            self._relay(None, {"kind": "ulist_remove", "username": username, "worker": worker})
+
+    def detach(self): # Closes this process's copies of the sockets, for forked workers
+        for conn in list(self.workers):
+            conn.close()
+        self.workers = {}
+        if not self.listener == None:
+            self.listener.close()
+
+    def close(self):
+        self.detach()
+        if not self.selector == None:
+            self.selector.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class BusClient:
+    def __init__(self, path, handler, debug=False, on_lost=None):
+        self.path = path
+        self.handler = handler # Called with each message from the other workers, on the bus thread
+        self.on_lost = on_lost # Called if the supervisor goes away
+        self.debug = debug
+        self.closed = False
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.thread = threading.Thread(target=self._read_loop, daemon=True, name="cloudlink-bus")
+
+    def start(self):
+        self.thread.start()
+
+    def publish(self, message): # Sends a message to every other worker (thread-safe)
+        frame = _pack(message)
+        try:
+            with self.lock:
+                self.sock.sendall(frame)
+        except OSError as e:
+            if self.debug:
+                logger.log(ERROR, "Error on bus publish: {0}", e)
+
+    def _read_loop(self):
+        reader = _Reader()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                if (not self.closed) and (not self.on_lost == None):
+                    self.on_lost()
+                return
+            for message in reader.feed(data):
+                try:
+                    self.handler(message)
+                except Exception as e:
+                    if self.debug:
+                        logger.log(ERROR, "Error on bus message: {0}", traceback.format_exc().rstrip())
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
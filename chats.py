@@ -0,0 +1,83 @@
+import threading
+
+"""
+
+Meower Chats Module
+
+This module provides the online chat index, which maps each group chat to the members that are
+online on this server process, so chat posts and typing states can be delivered without loading
+the chat from the database.
+
+A user's chats are looked up once, when they log in, and kept up to date as they are added to,
+removed from or leave chats. Because the index only knows the chats of logged in users, it can
+answer "is this user in this chat?" only for them; is_member() returns None for everyone else,
+and the caller has to check the database instead.
+
+"""
+
+class OnlineChatIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chats = {} # Chat ID -> usernames of online members
+        self.users = {} # Username -> (session ID, chat IDs)
+
+    def add_user(self, username, session, chatids): # Starts tracking a logged in user and the chats they are in
+        with self.lock:
+            self._remove_user(username)
+            self.users[username] = (session, set(chatids))
+            for chatid in chatids:
+                if not chatid in self.chats:
+                    self.chats[chatid] = set()
+                self.chats[chatid].add(username)
+
+    def remove_user(self, username, session=None): # Stops tracking a user, unless they have since logged in again on another session
+        with self.lock:
+            if (username in self.users) and ((session == None) or (self.users[username][0] == session)):
+                self._remove_user(username)
+
+    def _remove_user(self, username):
+        if not username in self.users:
+            return
+        for chatid in self.users.pop(username)[1]:
+            members = self.chats.get(chatid)
+            if not members == None:
+                members.discard(username)
+                if len(members) == 0:
+                    del self.chats[chatid]
+
+    def add_member(self, chatid, username): # Records that a user joined a chat, ignored if they aren't online
+        with self.lock:
+            if username in self.users:
+                self.users[username][1].add(chatid)
+                if not chatid in self.chats:
+                    self.chats[chatid] = set()
+                self.chats[chatid].add(username)
+
+    def remove_member(self, chatid, username):
+        with self.lock:
+            if username in self.users:
+                self.users[username][1].discard(chatid)
+            members = self.chats.get(chatid)
+            if not members == None:
+                members.discard(username)
+                if len(members) == 0:
+                    del self.chats[chatid]
+
+    def remove_chat(self, chatid): # Forgets a deleted chat
+        with self.lock:
+            for username in self.chats.pop(chatid, ()):
+                self.users[username][1].discard(chatid)
+
+    def members(self, chatid): # Returns the online members of a chat
+        with self.lock:
+            return list(self.chats.get(chatid, ()))
+
+    def is_member(self, chatid, username): # Returns None if the user isn't tracked, so their chats aren't known
+        with self.lock:
+            if not username in self.users:
+                return None
+            return chatid in self.users[username][1]
+
+    def get_stats(self):
+        with self.lock:
+            return {"users": len(self.users), "chats": len(self.chats)}
@@ -10,10 +10,21 @@ CloudLink by MikeDEV
 Please see https://github.com/MikeDev101/cloudlink for more details.
 """
 
-import json
+import codec
+import socket
 import sys
 import threading
 from websocket_server import WebsocketServer as ws_server
+from websocket_asyncio import WebsocketServer as ws_server_asyncio
+from websocket_asyncio import PreparedMessage as ws_message
+from websocket_asyncio import OPCODE_BINARY as ws_binary
+from websocket_asyncio import OPCODE_PING as ws_opcode_ping
+from dispatcher import KeyedDispatcher
+import msgpack_codec
+from iptrie import IPTrie
+from bus import BusClient
+from presence import PresenceDirectory, PacketRouter
+from admission import AdmissionController
 import websocket as ws_client
 import time
 import traceback
@@ -46,16 +57,141 @@ def full_stack():
         stackstr += '  ' + traceback.format_exc().lstrip(trc)
     return stackstr
 
+_MISSING = object() # Marks packet fields the client did not send
+
+class Packet:
+    """
+    A parsed inbound packet. It is created once when a message arrives and then handed to the
+    trust checks, the built-in commands and the on_packet callback as-is. Besides the packet
+    fields it carries the sending client, its IP, the receive time and the message size. Keys
+    other than FIELDS are kept in extra, so custom packets routed with UPL keep them. It also supports
+    msg["cmd"], "val" in msg and msg.get(...), so code written for packet dicts keeps working.
+    """
+    __slots__ = ("cmd", "val", "id", "name", "origin", "listener", "extra", "client", "ip", "received", "size")
+    FIELDS = ("cmd", "val", "id", "name", "origin", "listener")
+
+    def __init__(self, cmd=_MISSING, val=_MISSING, id=_MISSING, listener=_MISSING, client=None, ip=None, received=None, size=0, extra=None):
+        self.cmd = cmd
+        self.val = val
+        self.id = id
+        self.name = _MISSING
+        self.origin = _MISSING
+        self.listener = listener
+        self.extra = extra # Dict of the other keys, None when there are none
+        self.client = client
+        self.ip = ip
+        if received == None:
+            received = time.time()
+        self.received = received
+        self.size = size # Length of the message it was parsed from
+
+    @classmethod
+    def from_dict(cls, data, client=None, ip=None, received=None, size=0):
+        packet = cls(client=client, ip=ip, received=received, size=size)
+        for key in data:
+            if key in cls.FIELDS:
+                setattr(packet, key, data[key])
+            else:
+                if packet.extra == None:
+                    packet.extra = {}
+                packet.extra[key] = data[key]
+        return packet
+
+    @property
+    def listener_detected(self): # CL Turbo listener IDs must be strings
+        return type(self.listener) == str
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return not getattr(self, key) is _MISSING
+        return (not self.extra == None) and (key in self.extra)
+
+    def __getitem__(self, key):
+        if not key in self.FIELDS:
+            if self.extra == None:
+                raise KeyError(key)
+            return self.extra[key]
+        value = getattr(self, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra == None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        self[key]
+        if key in self.FIELDS:
+            setattr(self, key, _MISSING)
+        else:
+            del self.extra[key]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def to_dict(self): # A plain dict of the packet, for sending it on as-is
+        packet = {key: getattr(self, key) for key in self.FIELDS if key in self}
+        if not self.extra == None:
+            packet.update(self.extra)
+        return packet
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
 class API:
-    def server(self, ip="127.0.0.1", port=3000, threaded=False): # Runs CloudLink in server mode.
+    def server(self, ip="127.0.0.1", port=3000, threaded=False, mode="threaded", workers=32, queue_depth=64, max_send_queue=256, slow_send_queue=32, compression=False, compression_level=6, compression_window_bits=15, compression_min_size=256, reuse_port=False, bus=None, presence=None): # Runs CloudLink in server mode.
         try:
             if self.state == 0:
                 
                 # Change the link state to 1 (Server mode)
                 self.state = 1
-                self.wss = ws_server(
-                    host=ip,
-                    port=port
+                if mode == "asyncio":
+                    # Single event loop for every socket
+                    self.wss = ws_server_asyncio(
+                        host=ip,
+                        port=port,
+                        reuse_port=reuse_port, # Lets several worker processes share the port
+                        max_queue=max_send_queue,
+                        slow_queue=slow_send_queue,
+                        compression=compression, # permessage-deflate, asyncio engine only
+                        compression_level=compression_level,
+                        compression_window_bits=compression_window_bits,
+                        compression_min_size=compression_min_size,
+                        admission=self.admission # Checked before the handshake
+                    )
+                else:
+                    # One thread per socket
+                    self.wss = ws_server(
+                        host=ip,
+                        port=port
+                    )
+                    if compression:
+                        self._print("Warning: permessage-deflate needs the asyncio engine, compression is disabled")
+                    if reuse_port:
+                        self._print("Warning: sharing the port needs the asyncio engine, reuse_port is disabled")
+                    # Sends are queued per client and written by a separate pool, so a client that stops reading only blocks its own queue
+                    self.outbox = KeyedDispatcher(
+                        workers=workers,
+                        queue_depth=max_send_queue,
+                        max_pending=None,
+                        name="cloudlink-send"
+                    )
+                self.mode = mode
+                self.max_send_queue = max_send_queue
+                self.slow_send_queue = slow_send_queue
+                
+                # Callbacks run on a fixed pool of workers, serially per client
+                self.dispatcher = KeyedDispatcher(
+                    workers=workers,
+                    queue_depth=queue_depth,
+                    name="cloudlink"
                 )
                 
                 # Set the server's callbacks to CloudLink's class functions
@@ -72,7 +208,7 @@ class API:
                     self.statedata["secure_enable"] = False
                     self.statedata["secure_keys"] = []
                 if not "ip_blocklist" in self.statedata:
-                    self.statedata["ip_blocklist"] = [""]
+                    self.statedata["ip_blocklist"] = set([""])
                 
                 self.statedata = {
                     "ulist": {
@@ -86,19 +222,39 @@ class API:
                     "motd": self.statedata["motd"], # MOTD text
                     "secure_enable": self.statedata["secure_enable"], # Trusted Access enabler
                     "secure_keys": self.statedata["secure_keys"], # Trusted Access keys
-                    "trusted": [], # Clients that are trusted with Secure Access, references memory objects only
+                    "trusted": set(), # IDs of clients that are trusted with Secure Access
                     "ip_blocklist": self.statedata["ip_blocklist"] # Blocks clients with certain IP addresses
                 }
+                self.ulist_names = {}
+                self.ulist_string = ""
+                if presence == None:
+                    presence = PresenceDirectory()
+                self.presence = presence
+                
+                if not mode == "asyncio":
+                    # websocket_server ignores pongs, count them as activity
+                    self.wss._pong_received_ = self._on_pong_server
+                
+                # Close connections that have gone silent
+                self.reaper_stop.clear()
+                self.reaper = threading.Thread(target=self._reaper_loop, daemon=True, name="cloudlink-reaper")
+                self.reaper.start()
+                
+                if not bus == None:
+                    # Supervisor mode, link up with the other workers
+                    self.bus = BusClient(bus, self._on_bus_message, self.debug, on_lost=self._on_bus_lost)
+                    self.router = PacketRouter(self.presence, self._send_batch)
+                    self.bus.start()
                 
                 # Run the server
-                print("Running server on ws://{0}:{1}/".format(ip, port))
+                self._print("Running server on ws://{0}:{1}/".format(ip, port))
                 self.wss.run_forever(threaded=threaded)
             else:
                 if self.debug:
-                    print("Error: Attempted to switch states!")
+                    self._print("Error: Attempted to switch states!")
         except Exception as e:
             if self.debug:
-                print("Error at client: {0}".format(e))
+                self._print("Error at client: {0}".format(e))
     
     def client(self, ip="ws://127.0.0.1:3000/"): # Runs CloudLink in client mode.
         try:
@@ -124,10 +280,10 @@ class API:
                 self.wss.run_forever()
             else:
                 if self.debug:
-                    print("Error: Attempted to switch states!")
+                    self._print("Error: Attempted to switch states!")
         except Exception as e:
             if self.debug:
-                print("Error at client: {0}".format(e))
+                self._print("Error at client: {0}".format(e))
     
     def stop(self, abrupt=False): # Stops CloudLink (not sure if working)
         try:
@@ -136,65 +292,73 @@ class API:
                     self.wss.shutdown_abruptly()
                 else:
                     self.wss.shutdown_gracefully()
+                if not self.dispatcher == None:
+                    self.dispatcher.shutdown()
+                if not self.outbox == None:
+                    self.outbox.shutdown()
+                self.reaper_stop.set()
+                if not self.router == None:
+                    self.router.stop()
+                    self.router = None
+                if not self.bus == None:
+                    self.bus.close()
+                    self.bus = None
                 self.state = 0
             elif self.state == 2:
                 self.wss.close()
             else:
                 if self.debug:
-                    print("Error: Attempted to stop in an invalid mode")
+                    self._print("Error: Attempted to stop in an invalid mode")
         except Exception as e:
             if self.debug:
-                print("Error at stop: {0}".format(e))
+                self._print("Error at stop: {0}".format(e))
     
     def callback(self, callback_id, function): # Add user-friendly callbacks for CloudLink to be useful as a module
         try:
             if callback_id in self.callback_function:
                 self.callback_function[callback_id] = function
                 if self.debug:
-                    print("Binded callback {0}.".format(callback_id))
+                    self._print("Binded callback {0}.".format(callback_id))
             else:
                 if self.debug:
-                    print("Error: Callback {0} is not a valid callback id!".format(callback_id))
+                    self._print("Error: Callback {0} is not a valid callback id!".format(callback_id))
         except Exception as e:
             if self.debug:
-                print("Error at callback: {0}".format(e))
+                self._print("Error at callback: {0}".format(e))
     
     def trustedAccess(self, enable, keys): # Enables secure access to the server.
         if type(enable) == bool:
             if type(keys) == list:
                 if enable:
                     if self.debug:
-                        print("Enabled Trusted Access.")
+                        self._print("Enabled Trusted Access.")
                 else:
                     if self.debug:
-                        print("Disabled Trusted Access.")
+                        self._print("Disabled Trusted Access.")
                 self.statedata["secure_enable"] = enable
                 self.statedata["secure_keys"] = keys
             else:
                 if self.debug:
-                    print('Error: Cannot set Trusted Access keys: expecting <class "list">, got {0}'.format(type(enable)))
+                    self._print('Error: Cannot set Trusted Access keys: expecting <class "list">, got {0}'.format(type(enable)))
         else:
             if self.debug:
-                print('Error: Cannot set Trusted Access enable: expecting <class "bool">, got {0}'.format(type(enable)))
+                self._print('Error: Cannot set Trusted Access enable: expecting <class "bool">, got {0}'.format(type(enable)))
     
-    def sendPacket(self, msg): # User-friendly message sender for both server and client.
+    def sendPacket(self, msg, droppable=False): # User-friendly message sender for both server and client, droppable packets may be skipped for slow clients.
         try:
             if self.state == 1:
                 if ("id" in msg) and (type(msg["id"]) == dict): # Server is probably passing along the memory object for reference
                     if self.debug:
-                        print("Info on sendPacket: Server passed along memory object:", msg["id"]["id"], "will try to send packet directly")
+                        self._print("Info on sendPacket: Server passed along memory object:", msg["id"]["id"], "will try to send packet directly")
                     try:
                         client = msg["id"]
                         del msg["id"]
                         if self.debug:
-                            print('Sending {0} to {1}'.format(msg, client["id"]))
-                        if self._get_client_type(client) == "scratch":
-                            if ("val" in msg) and (type(msg["val"]) == dict):
-                                msg["val"] = json.dumps(msg["val"])
-                        self.wss.send_message(client, json.dumps(msg))
+                            self._print('Sending {0} to {1}'.format(msg, client["id"]))
+                        self._send_message(client, msg, droppable)
                     except Exception as e:
                         if self.debug:
-                            print("Error on sendPacket (server): {0}".format(full_stack()))
+                            self._print("Error on sendPacket (server): {0}".format(full_stack()))
                     
                 elif ("id" in msg) and (type(msg["id"]) == str) and (msg["cmd"] not in ["gmsg", "gvar"]):
                     id = msg["id"]
@@ -203,70 +367,164 @@ class API:
                         try:
                             client = self.statedata["ulist"]["objs"][self.statedata["ulist"]["usernames"][id]]["object"]
                             if self.debug:
-                                print('Sending {0} to {1}'.format(msg, id))
-                            if self._get_client_type(client) == "scratch":
-                                if ("val" in msg) and (type(msg["val"]) == dict):
-                                    msg["val"] = json.dumps(msg["val"])
-                            self.wss.send_message(client, json.dumps(msg))
+                                self._print('Sending {0} to {1}'.format(msg, id))
+                            self._send_message(client, msg, droppable)
                         except Exception as e:
                             if self.debug:
-                                print("Error on sendPacket (server): {0}".format(e))
+                                self._print("Error on sendPacket (server): {0}".format(e))
+                    elif self._route(id, {"kind": "send", "username": id, "packet": msg, "droppable": droppable}):
+                        if self.debug:
+                            self._print('Forwarding {0} to {1} on node {2}'.format(msg, id, self.presence.lookup(id)))
                 else:
                     try:
                         if self.debug:
-                            print('Sending "{0}" to all clients'.format(json.dumps(msg)))
-                        self._send_to_all(msg)
+                            self._print('Sending "{0}" to all clients'.format(codec.dumps(msg)))
+                        self._send_to_all(msg, droppable)
                     except Exception as e:
                             if self.debug:
-                                print("Error on sendPacket (server): {0}".format(e))
+                                self._print("Error on sendPacket (server): {0}".format(e))
             elif self.state == 2:
                 try:
                     if self.debug:
-                        print('Sending {0}'.format(json.dumps(msg)))
-                    self.wss.send(json.dumps(msg))
+                        self._print('Sending {0}'.format(codec.dumps(msg)))
+                    self.wss.send(codec.dumps(msg))
                 except Exception as e:
                     if self.debug:
-                        print("Error on sendPacket (client): {0}".format(e))
+                        self._print("Error on sendPacket (client): {0}".format(e))
             else:
-                print("Error: Cannot use the packet sender in current state!")
+                self._print("Error: Cannot use the packet sender in current state!")
         except Exception as e:
-            print("Error at sendPacket: {0}".format(e))
+            self._print("Error at sendPacket: {0}".format(e))
     
     def setMOTD(self, motd, enable=True): # Sets the MOTD on the server-side.
         try:
             if type(enable) == bool:
                 if type(motd) == str:
                     if enable:
-                        print('Set MOTD to "{0}".'.format(motd))
+                        self._print('Set MOTD to "{0}".'.format(motd))
                         self.statedata["motd"] = str(motd)
                         self.statedata["motd_enable"] = True
                     else:
-                        print("Disabled MOTD.")
+                        self._print("Disabled MOTD.")
                         self.statedata["motd"] = None
                         self.statedata["motd_enable"] = False
                 else:
-                    print('Error: Cannot set MOTD text: expecting <class "str">, got {0}'.format(type(enable)))
+                    self._print('Error: Cannot set MOTD text: expecting <class "str">, got {0}'.format(type(enable)))
             else:
-                print('Error: Cannot set the enabler for MOTD: expecting <class "bool">, got {0}'.format(type(enable)))
+                self._print('Error: Cannot set the enabler for MOTD: expecting <class "bool">, got {0}'.format(type(enable)))
         except Exception as e:
             if self.debug:
-                print("Error at setMOTD: {0}".format(e))
+                self._print("Error at setMOTD: {0}".format(e))
 
-    def getUsernames(self): # Returns the username list.
+    def getUsernames(self): # Returns the username list, including users connected to other workers.
         if self.state == 1:
-            return list((self.statedata["ulist"]["usernames"]).keys())
+            usernames = list((self.statedata["ulist"]["usernames"]).keys())
+            usernames.extend([username for username in self.presence.remote_usernames() if not username in self.statedata["ulist"]["usernames"]])
+            return usernames
         elif self.state == 2:
             return self.statedata["ulist"]["usernames"]
         else:
             return None
     
+    def getBroadcastStats(self): # Returns broadcast timing metrics (times in milliseconds)
+        with self.broadcast_lock:
+            stats = self.broadcast_stats.copy()
+        if stats["count"] > 0:
+            stats["avg_time"] = stats["total_time"] / stats["count"]
+        else:
+            stats["avg_time"] = 0.0
+        for key in ["total_time", "last_time", "max_time", "avg_time"]:
+            stats[key] = round(stats[key] * 1000, 3)
+        return stats
+    
+    def sendCode(self, obj, code, listener_detected=False, listener_id=""): # Sends a status code from self.codes, uses either the memory object or the username
+        if self.state == 1:
+            if type(obj) == str:
+                if (not obj in self.statedata["ulist"]["usernames"]) and self._route(obj, {"kind": "code", "username": obj, "code": code, "listener_detected": listener_detected, "listener_id": listener_id}):
+                    return
+                obj = self._get_obj_of_username(obj)
+            if type(obj) == dict:
+                self._send_code(obj, code, listener_detected, listener_id)
+        else:
+            if self.debug:
+                self._print("Error: Cannot use the status code sender in current state!")
+    
+    def getQueueDepth(self, obj): # Returns the number of messages waiting to be sent to a client, uses either the memory object or the username
+        if self.state == 1:
+            if type(obj) == str:
+                obj = self._get_obj_of_username(obj)
+            if type(obj) == dict:
+                if self.mode == "asyncio":
+                    return obj["handler"].depth()
+                else:
+                    return self.outbox.depth(obj["id"])
+        return 0
+    
+    def getSendStats(self): # Returns outbound queue limits, counters and the depth of every non-empty queue
+        if self.mode == "asyncio":
+            stats = {"dropped": self.wss.dropped, "evicted": self.wss.evicted}
+        else:
+            with self.broadcast_lock:
+                stats = self.send_stats.copy()
+        stats["max_queue"] = self.max_send_queue
+        stats["slow_queue"] = self.slow_send_queue
+        stats["queues"] = {}
+        if self.state == 1:
+            for client in self.wss.clients:
+                depth = self.getQueueDepth(client)
+                if depth > 0:
+                    stats["queues"][client["id"]] = depth
+        return stats
+    
+    def setAdmission(self, max_connections=None, max_per_ip=None, accept_rate=None, accept_burst=None): # Sets connection limits, 0 disables a limit
+        if not max_connections == None:
+            self.admission.max_connections = max_connections
+        if not max_per_ip == None:
+            self.admission.max_per_ip = max_per_ip
+        if not accept_rate == None:
+            self.admission.set_rate(accept_rate, accept_burst)
+        if self.debug:
+            self._print("Admission: max {0} connections, {1} per IP, {2} per second".format(self.admission.max_connections, self.admission.max_per_ip, accept_rate))
+    
+    def getAdmissionStats(self): # Returns accepted/rejected connection counters and the current connection count
+        return self.admission.get_stats()
+    
+    def relay(self, message): # Sends a message to the on_relay callback of every other worker in supervisor mode, does nothing otherwise
+        self._publish({"kind": "relay", "message": message})
+    
+    def setHeartbeat(self, interval=None, timeouts=None, reap_interval=None, batch_size=None): # Configures the idle connection reaper, timeouts is {client type or "default": seconds}
+        if not interval == None:
+            self.heartbeat["interval"] = interval
+        if not timeouts == None:
+            self.heartbeat["timeouts"].update(timeouts)
+        if not reap_interval == None:
+            self.heartbeat["reap_interval"] = reap_interval
+        if not batch_size == None:
+            self.heartbeat["batch_size"] = batch_size
+    
+    def getHeartbeatStats(self): # Returns reaper run, ping and reaped connection counters
+        with self.reap_lock:
+            return self.reap_stats.copy()
+    
+    def handleRouted(self, messages): # Delivers a batch of username-addressed messages forwarded by another node's PacketRouter
+        for message in messages:
+            client = self._get_obj_of_username(message["username"])
+            if client == None:
+                continue # The user left while the batch was on its way
+            if message["kind"] == "send":
+                self._send_message(client, message["packet"], message["droppable"])
+            elif message["kind"] == "code":
+                self._send_code(client, message["code"], message["listener_detected"], message["listener_id"])
+            elif message["kind"] == "kick":
+                self._kick(client, message["status"])
+    
     def getIPofUsername(self, user): # Allows the server to track user IPs for Trusted Access, uses the username of a client.
         if self.state == 1:
             if not self._get_obj_of_username(user) == None:
                 return self._get_ip_of_obj(self._get_obj_of_username(user))
         else:
             if self.debug:
-                print("Error: Cannot use the IP getter in current state!")
+                self._print("Error: Cannot use the IP getter in current state!")
             return ""
     
     def getIPofObject(self, obj): # Allows the server to track user IPs for Trusted Access, but uses the memory object of a client instead.
@@ -274,59 +532,64 @@ class API:
             return self._get_ip_of_obj(obj)
         else:
             if self.debug:
-                print("Error: Cannot use the IP getter in current state!")
+                self._print("Error: Cannot use the IP getter in current state!")
             return ""
     
     def untrust(self, obj): # If a client has been trusted, the server can loose trust and refuse future packets.
         if self.state == 1:
             if self.statedata["secure_enable"]:
                 if type(obj) == dict:
-                    if obj in self.statedata["trusted"]:
-                        self.statedata["trusted"].remove(obj)
+                    if obj["id"] in self.statedata["trusted"]:
+                        self.statedata["trusted"].remove(obj["id"])
                         if self.debug:
-                            print("Untrusted ID {0}.".format(obj["id"]))
+                            self._print("Untrusted ID {0}.".format(obj["id"]))
                     else:   
                         if self.debug:
-                            print("Unable to untrust an ID that does not exist")
+                            self._print("Unable to untrust an ID that does not exist")
                 elif type(obj) == str:
                     obj = self._get_obj_of_username(obj)
                     if not obj == None:
-                        if obj in self.statedata["trusted"]:
-                            self.statedata["trusted"].remove(obj)
+                        if obj["id"] in self.statedata["trusted"]:
+                            self.statedata["trusted"].remove(obj["id"])
                             if self.debug:
-                                print("Untrusted ID {0}.".format(obj["id"]))
+                                self._print("Untrusted ID {0}.".format(obj["id"]))
                         else:   
                             if self.debug:
-                                print("Unable to untrust an ID that does not exist")
+                                self._print("Unable to untrust an ID that does not exist")
                     else:
                         if self.debug:
-                            print("Unable to untrust an ID that does not exist")
+                            self._print("Unable to untrust an ID that does not exist")
             else:
                 if self.debug:
-                    print("Error: Cannot use the untrust function: Trusted Access not enabled!")
+                    self._print("Error: Cannot use the untrust function: Trusted Access not enabled!")
         else:
             if self.debug:
-                print("Error: Cannot use the untrust function in current state!")
+                self._print("Error: Cannot use the untrust function in current state!")
     
     def loadIPBlocklist(self, blist): # Loads a list of IP addresses to block
-        if type(blist) == list:
-            if not '' in blist:
-                blist.append("")
+        if (type(blist) == list) or (type(blist) == set):
+            # Stored as a set so lookups don't scan the whole list, "" blocks clients without a known IP
+            blist = set(blist)
+            blist.add("")
             self.statedata["ip_blocklist"] = blist
+            self.ip_ranges.clear()
+            for ip in blist:
+                self.ip_ranges.add(ip)
             if self.debug:
-                print("Loaded {0} blocked IPs into the blocklist!".format(len(self.statedata["ip_blocklist"])-1))
+                self._print("Loaded {0} blocked IPs into the blocklist!".format(len(self.statedata["ip_blocklist"])-1))
     
     def blockIP(self, ip): # Blocks an IP address
         if self.state == 1:
             if self.statedata["secure_enable"]:
                 if type(ip) == str:
                     if not ip in self.statedata["ip_blocklist"]:
-                        self.statedata["ip_blocklist"].append(ip)
+                        self.statedata["ip_blocklist"].add(ip)
+                        self.ip_ranges.add(ip)
                         if self.debug:
-                            print("Blocked IP {0}!".format(ip))
+                            self._print("Blocked IP {0}!".format(ip))
         else:
             if self.debug:
-                print("Error: Cannot use the IP Block function in current state!")
+                self._print("Error: Cannot use the IP Block function in current state!")
     
     def unblockIP(self, ip): # Unblocks an IP address
         if self.state == 1:
@@ -334,55 +597,70 @@ class API:
                 if type(ip) == str:
                     if ip in self.statedata["ip_blocklist"]:
                         self.statedata["ip_blocklist"].remove(ip)
+                        self.ip_ranges.remove(ip)
                         if self.debug:
-                            print("Unblocked IP {0}!".format(ip))
+                            self._print("Unblocked IP {0}!".format(ip))
         else:
             if self.debug:
-                print("Error: Cannot use the IP Block function in current state!")
+                self._print("Error: Cannot use the IP Block function in current state!")
     
     def getIPBlocklist(self): # Returns the latest IP blocklist
         if self.state == 1:
             if self.statedata["secure_enable"]:
-                tmp = self.statedata["ip_blocklist"]
-                tmp.remove('')
-                return self.statedata["ip_blocklist"]
+                return [ip for ip in self.statedata["ip_blocklist"] if not ip == ""]
         else:
             if self.debug:
-                print("Error: Cannot use the IP Blocklist get function in current state!")
+                self._print("Error: Cannot use the IP Blocklist get function in current state!")
             return []
     
-    def kickClient(self, obj): # Terminates a client's connection (should only be used for specific purposes)
+    def isIPBlocked(self, ip): # Checks an IP address against the blocked IPs and CIDR/wildcard ranges
+        if self.state == 1:
+            if self.statedata["secure_enable"]:
+                if type(ip) == str:
+                    return self._is_ip_blocked(ip)
+        else:
+            if self.debug:
+                self._print("Error: Cannot use the IP Blocklist check function in current state!")
+        return False
+    
+    def kickClient(self, obj, status=None): # Terminates a client's connection (should only be used for specific purposes), status is a code sent before closing
         if self.state == 1:
             if self.statedata["secure_enable"]:
                 if type(obj) == dict:
                     if obj["id"] in self.statedata["ulist"]["objs"]:
-                        # Ask the WebsocketServer to terminate the connection
-                        obj["handler"].send_close(1000, bytes('', encoding='utf-8'))
-                        if self.debug:
-                            print("Kicked ID {0}.".format(obj["id"]))
+                        self._kick(obj, status)
                     else:
                         if self.debug:
-                            print("Unable to kick an ID that does not exist")
+                            self._print("Unable to kick an ID that does not exist")
                 elif type(obj) == str:
-                    obj = self._get_obj_of_username(obj)
+                    username = obj
+                    obj = self._get_obj_of_username(username)
                     if not obj == None:
                         if obj["id"] in self.statedata["ulist"]["objs"]:
-                            # Ask the WebsocketServer to terminate the connection
-                            obj["handler"].send_close(1000, bytes('', encoding='utf-8'))
-                            if self.debug:
-                                print("Kicked ID {0}.".format(obj["id"]))
+                            self._kick(obj, status)
                         else:   
                             if self.debug:
-                                print("Unable to kick an ID that does not exist")
+                                self._print("Unable to kick an ID that does not exist")
+                    elif self._route(username, {"kind": "kick", "username": username, "status": status}):
+                        if self.debug:
+                            self._print("Kicking {0} on node {1}.".format(username, self.presence.lookup(username)))
                     else:
                         if self.debug:
-                            print("Unable to kick an ID that does not exist")
+                            self._print("Unable to kick an ID that does not exist")
             else:
                 if self.debug:
-                    print("Error: Cannot use the kick function: Trusted Access not enabled!")
+                    self._print("Error: Cannot use the kick function: Trusted Access not enabled!")
         else:
             if self.debug:
-                print("Error: Cannot use the kick function in current state!")
+                self._print("Error: Cannot use the kick function in current state!")
+    
+    def _kick(self, obj, status=None):
+        if not status == None:
+            self._send_message(obj, {"cmd": "direct", "val": self.codes[status]})
+        # Ask the WebsocketServer to terminate the connection
+        self._send_close(obj)
+        if self.debug:
+            self._print("Kicked ID {0}.".format(obj["id"]))
 
 """
 class CLTLS: #Feature NOT YET IMPLEMENTED
@@ -391,18 +669,54 @@ class CLTLS: #Feature NOT YET IMPLEMENTED
 """
 
 class CloudLink(API):
-    def __init__(self, debug=False): # Initializes CloudLink
+    def __init__(self, debug=False, logger=None): # Initializes CloudLink
+        self.logger = logger # Optional logger (see logger.py) that gets CloudLink's output instead of stdout
         self.wss = None # Websocket Object
         self.state = 0 # Module state
+        self.mode = "threaded" # Server engine, "threaded" (websocket_server) or "asyncio" (websocket_asyncio)
+        self.dispatcher = None # Worker pool for server-side callbacks
+        self.outbox = None # Per-client outbound queues for the threaded engine (the asyncio engine has its own)
+        self.bus = None # Link to the other workers in supervisor mode
+        self.presence = PresenceDirectory() # Username -> node the user is connected to
+        self.router = None # Forwards username-addressed packets to other nodes (supervisor mode)
+        self.admission = AdmissionController(is_blocked=self._is_address_blocked) # Decides which new connections are accepted
+        self.heartbeat = { # Idle connection reaper settings, see setHeartbeat
+            "interval": 30, # Seconds of silence before a client is pinged, 0 disables pings
+            "reap_interval": 10, # Seconds between reaper runs
+            "batch_size": 100, # Dead connections closed at once
+            "timeouts": {"default": 90} # Seconds of silence before a client is considered dead, per client type, 0 never reaps
+        }
+        self.reaper = None
+        self.reaper_stop = threading.Event()
+        self.reap_stats = {"runs": 0, "pinged": 0, "reaped": 0}
+        self.reap_lock = threading.Lock() # Guards reap_stats
+        self.max_send_queue = 256 # Clients with more queued messages than this are disconnected
+        self.slow_send_queue = 32 # Droppable messages (e.g. typing states) are skipped past this many queued messages
+        self.send_stats = {"dropped": 0, "evicted": 0} # Outbound queue counters for the threaded engine
+        self.status_cache = {} # (code text, encoding) -> pre-encoded statuscode frame, (code text, encoding, "listener") -> packet prefix
         self.userlist = [] # Stores usernames set on link
         self.callback_function = { # For linking external code, use with functions
             "on_connect": None, # Handles new connections (server) or when connected to a server (client)
             "on_error": None, # Error reporter
             "on_packet": None, # Packet handler
-            "on_close": None # Runs code when disconnected (client) or server stops (server)
+            "on_close": None, # Runs code when disconnected (client) or server stops (server)
+            "on_relay": None, # Handles messages other workers sent with relay() (supervisor mode)
+            "on_sent": None # Called with the size of every message queued for a client (server), e.g. for metrics
         }
         self.debug = debug # Print back specific data
         self.statedata = {} # Place to store other garbage for modes
+        self.ip_ranges = IPTrie() # Addresses and CIDR/wildcard ranges from the IP blocklist
+        self.ulist_lock = threading.Lock()
+        self.ulist_names = {} # Listed usernames in join order (dict used as an ordered set)
+        self.ulist_string = "" # Cached "a;b;c;" ulist, None when it needs a rebuild
+        self.broadcast_lock = threading.Lock()
+        self.broadcast_stats = { # Cost of _send_to_all, times are in seconds
+            "count": 0,
+            "recipients": 0,
+            "total_time": 0.0,
+            "last_time": 0.0,
+            "max_time": 0.0
+        }
         self.codes = { # Current set of CloudLink status/error self.codes
             "Test": "I:000 | Test", # Test code
             "OK": "I:100 | OK", # OK code
@@ -430,20 +744,59 @@ class CloudLink(API):
             "Disabled": "E:122 | Command disabled by sysadmin",
         }
         
-        print("CloudLink v{0}".format(str(version))) # Report version number
+        self._print("CloudLink v{0}".format(str(version))) # Report version number
         if self.debug:
-            print("Debug enabled")
+            self._print("Debug enabled")
+    
+    def _load_packet(self, message): # Parses a packet, packets from _on_packet_server arrive already parsed
+        if (type(message) == Packet) or (type(message) == dict):
+            return message
+        return codec.loads(message)
+    
+    def _print(self, *args): # Prints, or hands the message to the logger if there is one
+        if self.logger == None:
+            print(*args)
+        else:
+            message = " ".join(str(arg) for arg in args)
+            if message.startswith("Error"):
+                self.logger.error(message)
+            elif message.startswith("Warning"):
+                self.logger.warning(message)
+            elif self.debug:
+                self.logger.debug(message)
+            else:
+                self.logger.info(message)
+    
+    def _get_listener(self, message): # Returns (listener_detected, listener_id) for a packet, CL Turbo listener IDs
+        if type(message) == Packet:
+            if message.listener_detected:
+                return True, message.listener
+        return False, ""
+    
+    def _inner_packet(self, msg, cmd, val, origin, client, listener_detected, listener_id): # Builds the Packet handed to on_packet for a direct command
+        if not listener_detected:
+            listener_id = _MISSING
+        received = None
+        size = 0
+        if type(msg) == Packet:
+            received = msg.received
+            size = msg.size
+        # The IP is read now rather than at receive time, an "ip" packet queued just before this one may have set it
+        return Packet(cmd, val, origin, listener_id, client, self._get_ip_of_obj(client), received, size)
     
     def _is_json(self, data): # Checks if something is JSON
         if type(data) == dict:
             return True
         else:
             try:
-                tmp = json.loads(data)
+                tmp = codec.loads(data)
                 return True
             except Exception as e:
                 return False
     
+    def _spawn(self, client, function): # Queues a server-side callback behind the client's earlier ones, returns False if the queue is full
+        return self.dispatcher.submit(client["id"], function)
+    
     def _get_client_type(self, client): # Gets client types to help prevent errors
         if client["id"] in self.statedata["ulist"]["objs"]:
             return self.statedata["ulist"]["objs"][client["id"]]["type"]
@@ -470,43 +823,156 @@ class CloudLink(API):
     
     def _is_obj_trusted(self, obj): # Checks if a client is trusted on the link
         if self.statedata["secure_enable"]:
-            return ((obj in self.statedata["trusted"]) and (not self._is_obj_blocked(obj)))
+            return ((obj["id"] in self.statedata["trusted"]) and (not self._is_obj_blocked(obj)))
         else:
             return False
     
     def _is_obj_blocked(self, obj): # Checks if a client is IP blocked
         if self.statedata["secure_enable"]:
-            return (self._get_ip_of_obj(obj) in self.statedata["ip_blocklist"])
+            return self._is_ip_blocked(self._get_ip_of_obj(obj))
         else:
             return False
     
-    def _send_to_all(self, payload): # "Better" (?) send to all function
-        tmp_payload = payload
-        for client in self.wss.clients:
-            #print("sending {0} to {1}".format(payload, client["id"]))
-            if self._get_client_type(client) == "scratch":
-                #print("sending to all, {0} is a scratcher".format(client["id"]))
-                if ("val" in payload) and (type(payload["val"]) == dict):
-                    #print("stringifying nested json")
-                    tmp_payload["val"] = json.dumps(payload["val"])
-                if not self.statedata["secure_enable"]:
-                    self.wss.send_message(client, json.dumps(tmp_payload))
+    def _is_address_blocked(self, ip): # Checks a connection's transport address against the blocklist, for admission control
+        return self.statedata.get("secure_enable", False) and self.ip_ranges.match(ip)
+    
+    def _is_ip_blocked(self, ip): # Checks an address against the blocked IPs and ranges
+        return ((ip in self.statedata["ip_blocklist"]) or self.ip_ranges.match(ip))
+    
+    def _frame(self, message): # Pre-encodes a message for the transport so the same bytes (compressed or not) can go to many clients
+        if self.mode == "asyncio":
+            if type(message) == bytes:
+                return ws_message(message, ws_binary)
+            return ws_message(message)
+        else:
+            return message
+    
+    def _encode(self, packet, encoding): # Serializes a packet for a wire encoding ("scratch", "json" or "msgpack")
+        if encoding == "msgpack":
+            return msgpack_codec.packb(packet)
+        if (encoding == "scratch") and ("val" in packet) and (type(packet["val"]) == dict):
+            # Scratch can't parse nested objects, so they are sent as JSON strings
+            tmp_packet = packet.copy()
+            tmp_packet["val"] = codec.dumps(packet["val"])
+            return codec.dumps(tmp_packet)
+        return codec.dumps(packet)
+    
+    def _get_client_encoding(self, client): # Returns "scratch", "json" or "msgpack"
+        obj = self.statedata["ulist"]["objs"].get(client["id"])
+        if obj == None:
+            return "json"
+        if obj["type"] == "scratch":
+            return "scratch"
+        return obj.get("encoding", "json")
+    
+    def _send_message(self, client, packet, droppable=False): # Serializes a packet for the client and queues it on its outbound queue
+        self._send_frame(client, self._frame(self._encode(packet, self._get_client_encoding(client))), droppable)
+    
+    def _send_code(self, client, code, listener_detected=False, listener_id=""): # Sends a statuscode packet built from cached pre-encoded pieces
+        encoding = self._get_client_encoding(client)
+        if encoding == "scratch":
+            encoding = "json" # Status codes are strings, Scratch clients get the same JSON
+        text = self.codes[code]
+        if listener_detected:
+            key = (text, encoding, "listener")
+            if not key in self.status_cache:
+                # Everything up to the listener value, so only the listener ID is encoded per packet
+                if encoding == "msgpack":
+                    self.status_cache[key] = msgpack_codec.packb({"cmd": "statuscode", "val": text, "listener": ""})[:-1]
                 else:
-                    if self._is_obj_trusted(client):
-                        self.wss.send_message(client, json.dumps(tmp_payload))
+                    self.status_cache[key] = codec.dumps({"cmd": "statuscode", "val": text, "listener": ""})[:-3]
+            if encoding == "msgpack":
+                message = self.status_cache[key] + msgpack_codec.packb(listener_id)
             else:
-                if not self.statedata["secure_enable"]:
-                    self.wss.send_message(client, json.dumps(payload))
-                else:
-                    if self._is_obj_trusted(client):
-                        self.wss.send_message(client, json.dumps(payload))
+                message = self.status_cache[key] + codec.dumps(listener_id) + "}"
+            self._send_frame(client, self._frame(message))
+        else:
+            key = (text, encoding)
+            if not key in self.status_cache:
+                self.status_cache[key] = self._frame(self._encode({"cmd": "statuscode", "val": text}, encoding))
+            self._send_frame(client, self.status_cache[key])
+    
+    def _send_frame(self, client, frame, droppable=False): # Queues a message encoded by _frame, droppable messages are skipped for slow clients
+        if not self.callback_function["on_sent"] == None:
+            if self.mode == "asyncio":
+                self.callback_function["on_sent"](len(frame.payload))
+            else:
+                self.callback_function["on_sent"](len(frame))
+        if self.mode == "asyncio":
+            client["handler"].send_prepared(frame, droppable)
+        else:
+            if droppable and (self.outbox.depth(client["id"]) >= self.slow_send_queue):
+                with self.broadcast_lock:
+                    self.send_stats["dropped"] += 1
+                return
+            def run():
+                try:
+                    self.wss.send_message(client, frame)
+                except Exception as e:
+                    if self.debug:
+                        self._print("Error sending to {0}: {1}".format(client["id"], e))
+            if not self.outbox.submit(client["id"], run):
+                self._evict(client)
+    
+    def _send_close(self, client, status=1000, reason=bytes('', encoding='utf-8')): # Closes a connection after the messages already queued for it
+        if self.mode == "asyncio":
+            client["handler"].send_close(status, reason)
+        else:
+            if not self.outbox.submit(client["id"], lambda: client["handler"].send_close(status, reason)):
+                self._evict(client)
+    
+    def _evict(self, client): # Disconnects a client that stopped reading (threaded engine)
+        with self.broadcast_lock:
+            self.send_stats["evicted"] += 1
+        if self.debug:
+            self._print("Client {0} is not keeping up with its outbound queue, disconnecting".format(client["id"]))
+        self._drop_connection(client)
+    
+    def _drop_connection(self, client): # Drops a socket without a closing handshake, the usual disconnect handling follows
+        try:
+            if self.mode == "asyncio":
+                client["handler"].abort()
+            else:
+                # Shutting the socket down also unblocks a worker stuck writing to it or waiting on a dead peer
+                client["handler"].keep_alive = False
+                client["handler"].request.shutdown(socket.SHUT_RDWR)
+        except Exception as e:
+            if self.debug:
+                self._print("Error on _drop_connection: {0}".format(e))
+    
+    def _send_to_all(self, payload, droppable=False, relay=True): # Serializes the payload once per client type, then sends the same frame to every trusted client
+        if relay:
+            self._publish({"kind": "broadcast", "packet": payload, "droppable": droppable})
+        start = time.perf_counter()
+        frames = {} # Encoding -> frame, Scratch clients get nested JSON stringified
+        recipients = 0
+        for client in self.wss.clients:
+            if self.statedata["secure_enable"] and (not self._is_obj_trusted(client)):
+                continue
+            encoding = self._get_client_encoding(client)
+            if not encoding in frames:
+                frames[encoding] = self._frame(self._encode(payload, encoding))
+            self._send_frame(client, frames[encoding], droppable)
+            recipients += 1
+        
+        self._record_broadcast(start, recipients)
+    
+    def _record_broadcast(self, start, recipients): # Broadcast cost metrics
+        elapsed = time.perf_counter() - start
+        with self.broadcast_lock:
+            self.broadcast_stats["count"] += 1
+            self.broadcast_stats["recipients"] += recipients
+            self.broadcast_stats["total_time"] += elapsed
+            self.broadcast_stats["last_time"] = elapsed
+            if elapsed > self.broadcast_stats["max_time"]:
+                self.broadcast_stats["max_time"] = elapsed
     
     def _server_packet_handler(self, client, server, message, listener_detected=False, listener_id=""): # The almighty packet handler, single-handedly responsible for over hundreds of lines of code
         if not type(client) == type(None):
             if not len(str(message)) == 0:
                 try:
                     # Parse the JSON into a dict
-                    msg = json.loads(message)
+                    msg = self._load_packet(message)
 
                     if ("id" in msg):
                         if type(msg["id"]) != str:
@@ -514,11 +980,8 @@ class CloudLink(API):
                                 msg["id"] = str(msg["id"])
                             else:
                                 if self.debug:
-                                    print('Error: Packet "id" datatype invalid: expecting <class "str">, got {0}'.format(type(msg["cmd"])))
-                                if listener_detected:
-                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"], "listener": listener_id}))
-                                else:
-                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"]}))
+                                    self._print('Error: Packet "id" datatype invalid: expecting <class "str">, got {0}'.format(type(msg["cmd"])))
+                                self._send_code(client, "Datatype", listener_detected, listener_id)
                                 return
                     
                     # Handle the packet
@@ -530,39 +993,30 @@ class CloudLink(API):
                                         if "val" in msg: # Verify that the packet contains the required parameters.
                                             if self._get_client_type(client) == "scratch":
                                                 if self._is_json(msg["val"]):
-                                                    msg["val"] = json.loads(msg["val"])
+                                                    msg["val"] = codec.loads(msg["val"])
                                             if not len(str(msg["val"])) > 1000:
                                                 if self.debug:
-                                                    print("message is {0} bytes".format(len(str(msg["val"]))))
+                                                    self._print("message is {0} bytes".format(len(str(msg["val"]))))
                                                 self.statedata["gmsg"] = msg["val"]
                                                 # Send the packet to all clients.
                                                 self._send_to_all({"cmd": "gmsg", "val": msg["val"]})
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                self._send_code(client, "OK", listener_detected, listener_id)
                                             else:
                                                 if self.debug:
-                                                    print('Error: Packet too large')
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"]}))
+                                                    self._print('Error: Packet too large')
+                                                self._send_code(client, "TooLarge", listener_detected, listener_id)
                                         else:
                                             if self.debug:
-                                                print('Error: Packet missing parameters')
-                                            if listener_detected:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                            else:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                                self._print('Error: Packet missing parameters')
+                                            self._send_code(client, "Syntax", listener_detected, listener_id)
                                     else:
-                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Disabled"]}))
+                                        self._send_code(client, "Disabled")
 
                                 if msg["cmd"] == "pmsg": # Handles private messages.
                                     if ("val" in msg) and ("id" in msg): # Verify that the packet contains the required parameters.
                                         if self._get_client_type(client) == "scratch":
                                             if self._is_json(msg["val"]):
-                                                msg["val"] = json.loads(msg["val"])
+                                                msg["val"] = codec.loads(msg["val"])
                                         if msg["id"] in self.statedata["ulist"]["usernames"]:
                                             if not len(str(msg["val"])) > 1000:
                                                 if not client == self._get_obj_of_username(msg["id"]):
@@ -571,58 +1025,37 @@ class CloudLink(API):
                                                         if not len(self._get_username_of_obj(client)) == 0:
                                                             msg["origin"] = self._get_username_of_obj(client)
                                                             if (self._get_client_type(otherclient) == "scratch") and (self._is_json(msg["val"])):
-                                                                tmp_val = json.dumps(msg["val"])
+                                                                tmp_val = codec.dumps(msg["val"])
                                                             else:
                                                                 tmp_val = msg["val"]
 
                                                             if self.debug:
-                                                                print('Sending {0} to {1}'.format(msg, msg["id"]))
+                                                                self._print('Sending {0} to {1}'.format(msg, msg["id"]))
                                                             del msg["id"]
-                                                            self.wss.send_message(otherclient, json.dumps({"cmd": "pmsg", "val": tmp_val, "origin": msg["origin"]}))
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                            self._send_message(otherclient, {"cmd": "pmsg", "val": tmp_val, "origin": msg["origin"]})
+                                                            self._send_code(client, "OK", listener_detected, listener_id)
                                                         else:
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDRequired"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDRequired"]}))
+                                                            self._send_code(client, "IDRequired", listener_detected, listener_id)
                                                     except Exception as e:
                                                         if self.debug:
-                                                            print("Error on _server_packet_handler: {0}".format(e))
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
+                                                            self._print("Error on _server_packet_handler: {0}".format(e))
+                                                            self._send_code(client, "InternalServerError", listener_detected, listener_id)
                                                 else:
                                                     if self.debug:
-                                                        print('Error: Potential packet loop detected, aborting')
-                                                    if listener_detected:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Loop"], "listener": listener_id}))
-                                                    else:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Loop"]}))
+                                                        self._print('Error: Potential packet loop detected, aborting')
+                                                    self._send_code(client, "Loop", listener_detected, listener_id)
                                             else:
                                                 if self.debug:
-                                                    print('Error: Packet too large')
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"]}))
+                                                    self._print('Error: Packet too large')
+                                                self._send_code(client, "TooLarge", listener_detected, listener_id)
                                         else:
                                             if self.debug:
-                                                print('Error: ID Not found')
-                                            if listener_detected:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDNotFound"], "listener": listener_id}))
-                                            else:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDNotFound"]}))
+                                                self._print('Error: ID Not found')
+                                            self._send_code(client, "IDNotFound", listener_detected, listener_id)
                                     else:
                                         if self.debug:
-                                            print('Error: Packet missing parameters')
-                                        if listener_detected:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                        else:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                            self._print('Error: Packet missing parameters')
+                                        self._send_code(client, "Syntax", listener_detected, listener_id)
 
                                 if msg["cmd"] == "setid": # Sets the username of the client.
                                     if False:
@@ -632,70 +1065,51 @@ class CloudLink(API):
                                                     if type(msg["val"]) == str:
                                                         if self.statedata["ulist"]["objs"][client['id']]["username"] == "":
                                                             if not msg["val"] in self.statedata["ulist"]["usernames"]:
-                                                                # Add the username to the list
-                                                                self.statedata["ulist"]["usernames"][msg["val"]] = client["id"]
                                                                 # Set the object's username info
                                                                 self.statedata["ulist"]["objs"][client['id']]["username"] = msg["val"]
+                                                                # Add the username to the list
+                                                                self._add_username(msg["val"], client)
                                                                 
-                                                                if listener_detected:
-                                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"], "listener": listener_id}))
-                                                                else:
-                                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
-                                                                self._send_to_all({"cmd": "ulist", "val": self._get_ulist()})
+                                                                self._send_code(client, "OK", listener_detected, listener_id)
                                                                 if self.debug:
-                                                                    print("User {0} set username: {1}".format(client["id"], msg["val"]))
+                                                                    self._print("User {0} set username: {1}".format(client["id"], msg["val"]))
                                                             else:
                                                                 if self.debug:
-                                                                    print('Error: Refusing to set username because it would cause a conflict')
-                                                                if listener_detected:
-                                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDConflict"], "listener": listener_id}))
-                                                                else:
-                                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDConflict"]}))
+                                                                    self._print('Error: Refusing to set username because it would cause a conflict')
+                                                                self._send_code(client, "IDConflict", listener_detected, listener_id)
                                                         else:
                                                             if self.debug:
-                                                                print('Error: Refusing to set username because username has already been set')
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDSet"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDSet"]}))
+                                                                self._print('Error: Refusing to set username because username has already been set')
+                                                            self._send_code(client, "IDSet", listener_detected, listener_id)
                                                     else:
                                                         if self.debug:
-                                                            print('Error: Packet "val" datatype invalid: expecting <class "str">, got {0}'.format(type(msg["cmd"])))
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"], "listener": listener_id}))
-                                                        else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"]}))
+                                                            self._print('Error: Packet "val" datatype invalid: expecting <class "str">, got {0}'.format(type(msg["cmd"])))
+                                                        self._send_code(client, "Datatype", listener_detected, listener_id)
                                                 else:
                                                     if self.debug:
-                                                        print('Error: Packet too large')
-                                                    if listener_detected:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"], "listener": listener_id}))
-                                                    else:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"]}))
+                                                        self._print('Error: Packet too large')
+                                                    self._send_code(client, "TooLarge", listener_detected, listener_id)
                                             else:
                                                 if self.debug:
-                                                    print("Error: Packet is empty")
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["EmptyPacket"]}))
+                                                    self._print("Error: Packet is empty")
+                                                self._send_code(client, "EmptyPacket")
                                         else:
                                             if self.debug:
-                                                print('Error: Packet missing parameters')
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                                self._print('Error: Packet missing parameters')
+                                            self._send_code(client, "Syntax")
                                     else:
-                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Disabled"]}))
+                                        self._send_code(client, "Disabled")
 
                                 if msg["cmd"] == "direct": # Direct packet handler for server.
                                     if self._get_client_type(client) == "scratch":
                                         if ("val" in msg):
                                             if (self._is_json(msg["val"])) and (type(msg["val"]) == str):
                                                 try:
-                                                    msg["val"] = json.loads(msg["val"])
-                                                except json.decoder.JSONDecodeError:
+                                                    msg["val"] = codec.loads(msg["val"])
+                                                except codec.JSONDecodeError:
                                                     if self.debug:
-                                                        print("Failed to decode JSON of direct's nested data")
-                                                    if listener_detected:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                                    else:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                                        self._print("Failed to decode JSON of direct's nested data")
+                                                    self._send_code(client, "Syntax", listener_detected, listener_id)
                                                     return
                                     
                                     if ("val" in msg):
@@ -707,122 +1121,117 @@ class CloudLink(API):
                                                             self.statedata["ulist"]["objs"][client["id"]]["type"] = msg["val"]["val"] # Set the client type
                                                             if self.debug:
                                                                 if msg["val"]["val"] == "scratch":
-                                                                    print("Client {0} is scratch type".format(client["id"]))
+                                                                    self._print("Client {0} is scratch type".format(client["id"]))
                                                                 elif msg["val"]["val"] == "py":
-                                                                    print("Client {0} is python type".format(client["id"]))
+                                                                    self._print("Client {0} is python type".format(client["id"]))
                                                                 elif msg["val"]["val"] == "js":
-                                                                    print("Client {0} is js type".format(client["id"]))
+                                                                    self._print("Client {0} is js type".format(client["id"]))
                                                                 else:
-                                                                    print("Client {0} is of unknown client type, claims it's {1}".format(client["id"], (msg["val"]["val"])))
-                                                            #self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                                    self._print("Client {0} is of unknown client type, claims it's {1}".format(client["id"], (msg["val"]["val"])))
+                                                            #self._send_code(client, "OK")
+                                                    else:
+                                                        if self.debug:
+                                                            self._print('Error: Packet missing parameters')
+                                                        self._send_code(client, "Syntax", listener_detected, listener_id)
+                                                elif msg["val"]["cmd"] == "ulist_mode":
+                                                    if "val" in msg["val"]:
+                                                        # Clients that send "delta" get ulist_add/ulist_remove instead of the full ulist on every change
+                                                        self.statedata["ulist"]["objs"][client["id"]]["ulist_delta"] = (msg["val"]["val"] == "delta")
+                                                        if self.debug:
+                                                            self._print("Client {0} ulist mode: {1}".format(client["id"], msg["val"]["val"]))
                                                     else:
                                                         if self.debug:
-                                                            print('Error: Packet missing parameters')
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
+                                                            self._print('Error: Packet missing parameters')
+                                                        self._send_code(client, "Syntax", listener_detected, listener_id)
+                                                elif msg["val"]["cmd"] == "encoding":
+                                                    if ("val" in msg["val"]) and (msg["val"]["val"] in ["json", "msgpack"]):
+                                                        if (msg["val"]["val"] == "msgpack") and ((not self.mode == "asyncio") or (self._get_client_type(client) in [None, "scratch"])):
+                                                            # Binary frames need the asyncio engine, and Scratch clients can only read JSON
+                                                            self._send_code(client, "Refused", listener_detected, listener_id)
                                                         else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                                            # The reply is the last packet in the old encoding
+                                                            self._send_code(client, "OK", listener_detected, listener_id)
+                                                            self.statedata["ulist"]["objs"][client["id"]]["encoding"] = msg["val"]["val"]
+                                                            if self.debug:
+                                                                self._print("Client {0} encoding: {1}".format(client["id"], msg["val"]["val"]))
+                                                    else:
+                                                        if self.debug:
+                                                            self._print('Error: Packet missing parameters')
+                                                        self._send_code(client, "Syntax", listener_detected, listener_id)
                                                 elif msg["val"]["cmd"] == "ip":
                                                     try:
                                                         if "val" in msg["val"]:
                                                             if self.statedata["ulist"]["objs"][client["id"]]["ip"] == None: # Prevent the client from changing IP
                                                                 self.statedata["ulist"]["objs"][client["id"]]["ip"] = msg["val"]["val"] # Set the client's IP
                                                                 if self.debug:
-                                                                    print("Client {0} reports IP {1}".format(client["id"], self.statedata["ulist"]["objs"][client["id"]]["ip"]))
-                                                                #self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                                    self._print("Client {0} reports IP {1}".format(client["id"], self.statedata["ulist"]["objs"][client["id"]]["ip"]))
+                                                                #self._send_code(client, "OK")
                                                         else:
                                                             if self.debug:
-                                                                print('Error: Packet missing parameters')
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                                                self._print('Error: Packet missing parameters')
+                                                            self._send_code(client, "Syntax", listener_detected, listener_id)
                                                     except Exception as e:
                                                         if self.debug:
-                                                            print('Error: Failed to set client IP')
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"], "listener": listener_id}))
-                                                        else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
+                                                            self._print('Error: Failed to set client IP')
+                                                        self._send_code(client, "InternalServerError", listener_detected, listener_id)
                                                 else:
                                                     if "val" in msg["val"]:
                                                         if len(self._get_username_of_obj(client)) == 0:
                                                             origin = client
                                                             if self.debug:
-                                                                print("Handling direct custom command from {0}".format(origin['id']))
+                                                                self._print("Handling direct custom command from {0}".format(origin['id']))
                                                         else:
                                                             origin = self._get_username_of_obj(client)
                                                             if self.debug:
-                                                                print("Handling direct custom command from {0}".format(origin))
+                                                                self._print("Handling direct custom command from {0}".format(origin))
                                                         
-                                                        if listener_detected:
-                                                            self.callback_function["on_packet"]({"cmd": msg["val"]["cmd"], "val": msg["val"]["val"], "id": origin, "listener": listener_id})
-                                                        else:
-                                                            self.callback_function["on_packet"]({"cmd": msg["val"]["cmd"], "val": msg["val"]["val"], "id": origin})
+                                                        self.callback_function["on_packet"](self._inner_packet(msg, msg["val"]["cmd"], msg["val"]["val"], origin, client, listener_detected, listener_id))
                                                     else:
                                                         if self.debug:
-                                                            print('Error: Packet missing parameters')
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                                        else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                                            self._print('Error: Packet missing parameters')
+                                                        self._send_code(client, "Syntax", listener_detected, listener_id)
                                             else:
                                                 if len(self._get_username_of_obj(client)) == 0:
                                                     origin = client
                                                     if self.debug:
-                                                        print("Handling direct command from {0}".format(origin['id']))
+                                                        self._print("Handling direct command from {0}".format(origin['id']))
                                                 else:
                                                     origin = self._get_username_of_obj(client)
                                                     if self.debug:
-                                                        print("Handling direct command from {0}".format(origin))
-                                                if listener_detected:
-                                                    self.callback_function["on_packet"]({"val": msg["val"], "id": origin, "listener": listener_id})
-                                                else:
-                                                    self.callback_function["on_packet"]({"val": msg["val"], "id": origin})
+                                                        self._print("Handling direct command from {0}".format(origin))
+                                                self.callback_function["on_packet"](self._inner_packet(msg, _MISSING, msg["val"], origin, client, listener_detected, listener_id))
                                     else:
                                         if self.debug:
-                                            print('Error: Packet missing parameters')
-                                        if listener_detected:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                        else:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                            self._print('Error: Packet missing parameters')
+                                        self._send_code(client, "Syntax", listener_detected, listener_id)
 
                                 if msg["cmd"] == "gvar": # Handles global variables.
                                     if False:
                                         if ("val" in msg) and ("name" in msg): # Verify that the packet contains the required parameters.
                                             if self._get_client_type(client) == "scratch":
                                                 if self._is_json(msg["val"]):
-                                                    msg["val"] = json.loads(msg["val"])
+                                                    msg["val"] = codec.loads(msg["val"])
                                             if (not len(str(msg["val"])) > 1000) and (not len(str(msg["name"])) > 100):
                                                 # Send the packet to all clients.
                                                 self._send_to_all({"cmd": "gvar", "val": msg["val"], "name": msg["name"]})
                                                 
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                self._send_code(client, "OK", listener_detected, listener_id)
                                             else:
                                                 if self.debug:
-                                                    print('Error: Packet too large')
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"]}))
+                                                    self._print('Error: Packet too large')
+                                                self._send_code(client, "TooLarge", listener_detected, listener_id)
                                         else:
                                             if self.debug:
-                                                print('Error: Packet missing parameters')
-                                            if listener_detected:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                            else:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                                self._print('Error: Packet missing parameters')
+                                            self._send_code(client, "Syntax", listener_detected, listener_id)
                                     else:
-                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Disabled"]}))
+                                        self._send_code(client, "Disabled")
                                 
                                 if msg["cmd"] == "pvar": # Handles private variables.
                                     if ("val" in msg) and ("id" in msg) and ("name" in msg): # Verify that the packet contains the required parameters.
                                         if self._get_client_type(client) == "scratch":
                                             if self._is_json(msg["val"]):
-                                                msg["val"] = json.loads(msg["val"])
+                                                msg["val"] = codec.loads(msg["val"])
                                         if msg["id"] in self.statedata["ulist"]["usernames"]:
                                             if (not len(str(msg["val"])) > 1000) and (not len(str(msg["name"])) > 1000):
                                                 if not client == self._get_obj_of_username(msg["id"]):
@@ -831,71 +1240,50 @@ class CloudLink(API):
                                                         if not len(self._get_username_of_obj(client)) == 0:
                                                             msg["origin"] = self._get_username_of_obj(client)
                                                             if (self._get_client_type(otherclient) == "scratch") and ((self._is_json(msg["val"])) or (type(msg["val"]) == dict)):
-                                                                tmp_val = json.dumps(msg["val"])
+                                                                tmp_val = codec.dumps(msg["val"])
                                                             else:
                                                                 tmp_val = msg["val"]
                                                             if self.debug:
-                                                                print('Sending {0} to {1}'.format(msg, msg["id"]))
+                                                                self._print('Sending {0} to {1}'.format(msg, msg["id"]))
                                                             del msg["id"]
-                                                            self.wss.send_message(otherclient, json.dumps({"cmd": "pvar", "val": tmp_val, "name": msg["name"], "origin": msg["origin"]}))
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                            self._send_message(otherclient, {"cmd": "pvar", "val": tmp_val, "name": msg["name"], "origin": msg["origin"]})
+                                                            self._send_code(client, "OK", listener_detected, listener_id)
                                                         else:
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDRequired"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDRequired"]}))
+                                                            self._send_code(client, "IDRequired", listener_detected, listener_id)
                                                     except Exception as e:
                                                         if self.debug:
-                                                            print("Error on _server_packet_handler: {0}".format(e))
-                                                            if listener_detected:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"], "listener": listener_id}))
-                                                            else:
-                                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
+                                                            self._print("Error on _server_packet_handler: {0}".format(e))
+                                                            self._send_code(client, "InternalServerError", listener_detected, listener_id)
                                                 else:
                                                     if self.debug:
-                                                        print('Error: Potential packet loop detected, aborting')
-                                                    if listener_detected:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Loop"], "listener": listener_id}))
-                                                    else:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Loop"]}))
+                                                        self._print('Error: Potential packet loop detected, aborting')
+                                                    self._send_code(client, "Loop", listener_detected, listener_id)
                                             else:
                                                 if self.debug:
-                                                    print('Error: Packet too large')
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"]}))
+                                                    self._print('Error: Packet too large')
+                                                self._send_code(client, "TooLarge", listener_detected, listener_id)
                                         else:
                                             if self.debug:
-                                                print('Error: ID Not found')
-                                            if listener_detected:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDNotFound"], "listener": listener_id}))
-                                            else:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDNotFound"]}))
+                                                self._print('Error: ID Not found')
+                                            self._send_code(client, "IDNotFound", listener_detected, listener_id)
                                     else:
                                         if self.debug:
-                                            print('Error: Packet missing parameters')
-                                        if listener_detected:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                        else:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                            self._print('Error: Packet missing parameters')
+                                        self._send_code(client, "Syntax", listener_detected, listener_id)
                                 
                                 if msg["cmd"] == "ping":
                                     if self.debug:
-                                        print("Ping from client {0}".format(client["id"]))
+                                        self._print("Ping from client {0}".format(client["id"]))
                                     if listener_detected:
-                                        self.wss.send_message(client, json.dumps({"cmd": "ping", "val": self.codes["OK"], "listener": listener_id}))
+                                        self._send_message(client, {"cmd": "ping", "val": self.codes["OK"], "listener": listener_id})
                                     else:
-                                        self.wss.send_message(client, json.dumps({"cmd": "ping", "val": self.codes["OK"]}))
+                                        self._send_message(client, {"cmd": "ping", "val": self.codes["OK"]})
                                 
                             else: # Route the packet using UPL.
                                 if ("val" in msg) and ("id" in msg): # Verify that the packet contains the required parameters.
                                     if self._get_client_type(client) == "scratch":
                                         if self._is_json(msg["val"]):
-                                            msg["val"] = json.loads(msg["val"])
+                                            msg["val"] = codec.loads(msg["val"])
                                     if msg["id"] in self.statedata["ulist"]["usernames"]:
                                         if not len(str(msg["val"])) > 1000:
                                             if not client == self._get_obj_of_username(msg["id"]):
@@ -904,131 +1292,293 @@ class CloudLink(API):
                                                     if not len(self._get_username_of_obj(client)) == 0:
                                                         msg["origin"] = self._get_username_of_obj(client)
                                                         if (self._get_client_type(otherclient) == "scratch") and ((self._is_json(msg["val"])) or (type(msg["val"]) == dict)):
-                                                            tmp_val = json.dumps(msg["val"])
+                                                            tmp_val = codec.dumps(msg["val"])
                                                         else:
                                                             tmp_val = msg["val"]
 
                                                         if self.debug:
-                                                            print('Routing {0} to {1}'.format(msg, msg["id"]))
+                                                            self._print('Routing {0} to {1}'.format(msg, msg["id"]))
+                                                        if type(msg) == Packet:
+                                                            msg = msg.to_dict() # Sent on with any custom keys the client added
                                                         del msg["id"]
-                                                        self.wss.send_message(otherclient, json.dumps(msg))
+                                                        self._send_message(otherclient, msg)
                                                         
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"], "listener": listener_id}))
-                                                        else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                        self._send_code(client, "OK", listener_detected, listener_id)
                                                     else:
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDRequired"], "listener": listener_id}))
-                                                        else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDRequired"]}))
+                                                        self._send_code(client, "IDRequired", listener_detected, listener_id)
                                                 except Exception as e:
                                                     if self.debug:
-                                                        print("Error on _server_packet_handler: {0}".format(e))
-                                                    if listener_detected:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"], "listener": listener_id}))
-                                                    else:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
+                                                        self._print("Error on _server_packet_handler: {0}".format(e))
+                                                    self._send_code(client, "InternalServerError", listener_detected, listener_id)
                                             else:
                                                 if self.debug:
-                                                    print('Error: Potential packet loop detected, aborting')
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Loop"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Loop"]}))
+                                                    self._print('Error: Potential packet loop detected, aborting')
+                                                self._send_code(client, "Loop", listener_detected, listener_id)
                                         else:
                                             if self.debug:
-                                                print('Error: Packet too large')
-                                            if listener_detected:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"], "listener": listener_id}))
-                                            else:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TooLarge"]}))
+                                                self._print('Error: Packet too large')
+                                            self._send_code(client, "TooLarge", listener_detected, listener_id)
                                     else:
                                         if self.debug:
-                                            print('Error: ID Not found')
-                                        if listener_detected:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDNotFound"], "listener": listener_id}))
-                                        else:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IDNotFound"]}))
+                                            self._print('Error: ID Not found')
+                                        self._send_code(client, "IDNotFound", listener_detected, listener_id)
                                 else:
                                     if self.debug:
-                                        print('Error: Packet missing parameters')
-                                    if listener_detected:
-                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                                    else:
-                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                        self._print('Error: Packet missing parameters')
+                                    self._send_code(client, "Syntax", listener_detected, listener_id)
                         else:
                             if self.debug:
-                                print('Error: Packet "cmd" datatype invalid: expecting <class "bool">, got {0}'.format(type(msg["cmd"])))
-                            if listener_detected:
-                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"], "listener": listener_id}))
-                            else:
-                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"]}))
+                                self._print('Error: Packet "cmd" datatype invalid: expecting <class "bool">, got {0}'.format(type(msg["cmd"])))
+                            self._send_code(client, "Datatype", listener_detected, listener_id)
                     else:
                         if self.debug:
-                            print('Error: Packet missing "cmd" parameter')
-                        if listener_detected:
-                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                        else:
-                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
-                except json.decoder.JSONDecodeError:
+                            self._print('Error: Packet missing "cmd" parameter')
+                        self._send_code(client, "Syntax", listener_detected, listener_id)
+                except codec.JSONDecodeError:
                     if self.debug:
-                        print("Error: Failed to parse JSON")
-                    if listener_detected:
-                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"], "listener": listener_id}))
-                    else:
-                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                        self._print("Error: Failed to parse JSON")
+                    self._send_code(client, "Syntax", listener_detected, listener_id)
                 except Exception as e:
                     if self.debug:
-                        print("Error on _server_packet_handler: {0}".format(full_stack()))
-                    if listener_detected:
-                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"], "listener": listener_id}))
-                    else:
-                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
+                        self._print("Error on _server_packet_handler: {0}".format(full_stack()))
+                    self._send_code(client, "InternalServerError", listener_detected, listener_id)
             else:
                 if self.debug:
-                    print("Error: Packet is empty")
-                if listener_detected:
-                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["EmptyPacket"], "listener": listener_id}))
+                    self._print("Error: Packet is empty")
+                self._send_code(client, "EmptyPacket", listener_detected, listener_id)
+    
+    def _get_ulist(self): # Returns the cached username list, rebuilding it only after a user left
+        with self.ulist_lock:
+            if self.ulist_string == None:
+                self.ulist_string = "".join([(username + ";") for username in self.ulist_names])
+            return self.ulist_string
+    
+    def _is_listed_username(self, username): # Usernames wrapped in % are hidden from the ulist
+        return not ((len(username) > 0) and (username[0] == "%") and (username[len(username)-1] == "%"))
+    
+    def _add_username(self, username, client): # Maps a username to a client and updates the ulist
+        with self.ulist_lock:
+            self.statedata["ulist"]["usernames"][username] = client["id"]
+            added = (self._is_listed_username(username) and (not username in self.ulist_names))
+            if added:
+                self.ulist_names[username] = None
+                if not self.ulist_string == None:
+                    self.ulist_string += username + ";"
+        self.presence.register(username)
+        self._publish({"kind": "ulist_add", "username": username})
+        if added:
+            self._send_ulist(added=username)
+    
+    def _remove_username(self, username, client): # Unmaps a client's username and updates the ulist
+        if self._unmap_username(username, client):
+            self._send_ulist(removed=username)
+    
+    def _unmap_username(self, username, client): # Unmaps a client's username, returns True if the ulist changed
+        with self.ulist_lock:
+            # Another client may have taken the username since (autoID kicks the old session)
+            unmapped = ((username in self.statedata["ulist"]["usernames"]) and (self.statedata["ulist"]["usernames"][username] == client["id"]))
+            removed = False
+            if unmapped:
+                del self.statedata["ulist"]["usernames"][username]
+                self.presence.unregister(username)
+                if (username in self.ulist_names) and (not self.presence.is_remote(username)):
+                    del self.ulist_names[username]
+                    self.ulist_string = None
+                    removed = True
+        if unmapped:
+            self._publish({"kind": "ulist_remove", "username": username})
+        return removed
+    
+    def _add_remote_username(self, username, worker): # A user logged in on another worker
+        with self.ulist_lock:
+            self.presence.register(username, worker)
+            added = (self._is_listed_username(username) and (not username in self.ulist_names))
+            if added:
+                self.ulist_names[username] = None
+                if not self.ulist_string == None:
+                    self.ulist_string += username + ";"
+        if added:
+            self._send_ulist(added=username)
+    
+    def _remove_remote_username(self, username, worker): # A user left another worker
+        with self.ulist_lock:
+            # Ignore stale removals for a username that has since logged in on a different worker
+            removed = self.presence.unregister(username, worker)
+            if removed:
+                if (username in self.ulist_names) and (not username in self.statedata["ulist"]["usernames"]):
+                    del self.ulist_names[username]
+                    self.ulist_string = None
+                else:
+                    removed = False
+        if removed:
+            self._send_ulist(removed=username)
+    
+    def _route(self, username, message): # Queues a message for a user on another node, returns False if they aren't on one
+        if self.router == None:
+            return False
+        return self.router.route(username, message)
+    
+    def _send_batch(self, node, messages): # PacketRouter transport over the bus
+        self._publish({"kind": "batch", "to": node, "messages": messages})
+    
+    def _publish(self, message): # Sends a message to the other workers in supervisor mode
+        if not self.bus == None:
+            self.bus.publish(message)
+    
+    def _on_bus_lost(self): # The supervisor is gone, so nothing would restart or link this worker anymore
+        self._print("Lost connection to the CloudLink bus, stopping")
+        self.stop()
+    
+    def _on_bus_message(self, message): # Handles a message from another worker
+        kind = message["kind"]
+        if kind == "batch":
+            self.handleRouted(message["messages"])
+        elif kind == "welcome":
+            with self.ulist_lock:
+                self.presence.set_node(message["worker"], list(self.statedata["ulist"]["usernames"]))
+        elif kind == "broadcast":
+            if message["packet"].get("cmd") == "gmsg":
+                self.statedata["gmsg"] = message["packet"]["val"]
+            self._send_to_all(message["packet"], message["droppable"], relay=False)
+        elif kind == "ulist_add":
+            self._add_remote_username(message["username"], message["worker"])
+        elif kind == "ulist_remove":
+            self._remove_remote_username(message["username"], message["worker"])
+        elif kind == "relay":
+            if not self.callback_function["on_relay"] == None:
+                self.callback_function["on_relay"](message["message"])
+    
+    def _send_ulist(self, added=None, removed=None): # Sends ulist_add/ulist_remove to clients that opted in, the full ulist to everyone else (and to everyone without a delta)
+        start = time.perf_counter()
+        frames = {} # (delta, encoding) -> frame
+        recipients = 0
+        for client in self.wss.clients:
+            if self.statedata["secure_enable"] and (not self._is_obj_trusted(client)):
+                continue
+            obj = self.statedata["ulist"]["objs"].get(client["id"])
+            delta = ((not obj == None) and obj.get("ulist_delta", False))
+            encoding = self._get_client_encoding(client)
+            if not (delta, encoding) in frames:
+                if (not delta) or ((added == None) and (removed == None)):
+                    packet = {"cmd": "ulist", "val": self._get_ulist()}
+                elif not added == None:
+                    packet = {"cmd": "ulist_add", "val": added}
                 else:
-                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["EmptyPacket"]}))
+                    packet = {"cmd": "ulist_remove", "val": removed}
+                frames[(delta, encoding)] = self._frame(self._encode(packet, encoding))
+            self._send_frame(client, frames[(delta, encoding)])
+            recipients += 1
+        self._record_broadcast(start, recipients)
     
-    def _get_ulist(self): # Generates username list
-        tmp_ulist = list((self.statedata["ulist"]["usernames"]).keys())
-        for item in tmp_ulist:
-            if item[0] == "%" and item[len(item)-1] == "%":
-                tmp_ulist.pop(tmp_ulist.index(item))
+    def _on_pong_server(self, handler, msg): # Threaded engine pong handler
+        client = self.wss.handler_to_client(handler)
+        if (not client == None) and (client["id"] in self.statedata["ulist"]["objs"]):
+            self.statedata["ulist"]["objs"][client["id"]]["last_active"] = time.monotonic()
+    
+    def _get_last_active(self, client, obj): # When a client last sent anything (monotonic clock)
+        if self.mode == "asyncio":
+            return max(obj["last_active"], client["handler"].last_seen)
+        return obj["last_active"]
+    
+    def _send_ping(self, client):
+        if self.mode == "asyncio":
+            client["handler"].send_ping()
+        else:
+            # Through the outbound queue, so it doesn't interleave with a message being written
+            self.outbox.submit(client["id"], lambda: client["handler"].send_text("cl", ws_opcode_ping))
+    
+    def _reaper_loop(self):
+        while not self.reaper_stop.wait(self.heartbeat["reap_interval"]):
+            try:
+                self._reap()
+            except Exception as e:
+                if self.debug:
+                    self._print("Error on _reap: {0}".format(full_stack()))
+    
+    def _reap(self): # Pings quiet clients and closes the ones that stopped answering
+        now = time.monotonic()
+        interval = self.heartbeat["interval"]
+        timeouts = self.heartbeat["timeouts"]
+        dead = []
+        pinged = 0
+        # A copy, the threaded engine's handler threads add and remove clients meanwhile
+        for client in list(self.wss.clients):
+            obj = self.statedata["ulist"]["objs"].get(client["id"])
+            if obj == None:
+                continue
+            idle = now - self._get_last_active(client, obj)
+            timeout = timeouts["default"]
+            if (type(obj["type"]) == str) and (obj["type"] in timeouts):
+                timeout = timeouts[obj["type"]]
+            if (timeout > 0) and (idle >= timeout):
+                dead.append(client)
+            elif (interval > 0) and (idle >= interval) and (now - obj["last_ping"] >= interval):
+                obj["last_ping"] = now
+                self._send_ping(client)
+                pinged += 1
+        with self.reap_lock:
+            self.reap_stats["runs"] += 1
+            self.reap_stats["pinged"] += pinged
+        if len(dead) == 0:
+            return
+        
+        if self.debug:
+            self._print("Reaping {0} idle connections".format(len(dead)))
+        # Take them all off the ulist first, so everyone gets one ulist update instead of one per user
+        changed = False
+        for client in dead:
+            if self._unmap_username(self._get_username_of_obj(client), client):
+                changed = True
+        if changed:
+            self._send_ulist()
         
-        output = ""
-        for item in tmp_ulist:
-            output = output + item + ";"
-        return output
+        # Then drop the sockets a batch at a time, the usual disconnect handling runs for each
+        batch_size = max(1, self.heartbeat["batch_size"])
+        for i in range(0, len(dead), batch_size):
+            if i > 0:
+                time.sleep(0.01)
+            for client in dead[i:i + batch_size]:
+                self._drop_connection(client)
+        with self.reap_lock:
+            self.reap_stats["reaped"] += len(dead)
     
     def _on_connection_server(self, client, server): # Server-side new connection handler
         if not type(client) == type(None):
             try:
                 if self.debug:
-                    print("New connection: {0}".format(str(client['id'])))
+                    self._print("New connection: {0}".format(str(client['id'])))
 
                 # Add the client to the ulist object in memory.
-                self.statedata["ulist"]["objs"][client["id"]] = {"object": client, "username": "", "ip": None, "type": None}
+                self.statedata["ulist"]["objs"][client["id"]] = {"object": client, "username": "", "ip": None, "type": None, "ulist_delta": False, "encoding": "json", "admitted": False, "last_active": time.monotonic(), "last_ping": 0}
+
+                # Admission control before doing anything else (the asyncio engine already did it before the handshake).
+                if (not self.mode == "asyncio") and (type(client["address"]) == tuple):
+                    reason = self.admission.admit(client["address"][0])
+                    if not reason == None:
+                        if self.debug:
+                            self._print("Connection {0} from {1} refused: {2}".format(client["id"], client["address"][0], reason))
+                        if reason == "blocked":
+                            self._send_code(client, "Blocked")
+                        self._send_close(client)
+                        return
+                    self.statedata["ulist"]["objs"][client["id"]]["admitted"] = True
 
                 # Send the MOTD if enabled.
                 if self.statedata["motd_enable"]:
-                    self.wss.send_message(client, json.dumps({"cmd": "direct", "val": {"cmd": "motd", "val": str(self.statedata["motd"])}}))
+                    self._send_message(client, {"cmd": "direct", "val": {"cmd": "motd", "val": str(self.statedata["motd"])}})
 
                 # Send server version.
-                self.wss.send_message(client, json.dumps({"cmd": "direct", "val": {"cmd": "vers", "val": str(version)}}))
+                self._send_message(client, {"cmd": "direct", "val": {"cmd": "vers", "val": str(version)}})
 
                 if not self.statedata["secure_enable"]:
                     # Send the current username list.
-                    self.wss.send_message(client, json.dumps({"cmd": "ulist", "val": self._get_ulist()}))
+                    self._send_message(client, {"cmd": "ulist", "val": self._get_ulist()})
 
                     # Send the current global data stream value.
-                    self.wss.send_message(client, json.dumps({"cmd": "gmsg", "val": str(self.statedata["gmsg"])}))
+                    self._send_message(client, {"cmd": "gmsg", "val": str(self.statedata["gmsg"])})
                 else:
                     # Tell the client that the server is expecting a Trusted Access key.
-                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TAEnabled"]}))
+                    self._send_code(client, "TAEnabled")
 
                 if not self.callback_function["on_connect"] == None:
                     def run(*args):
@@ -1036,209 +1586,192 @@ class CloudLink(API):
                             self.callback_function["on_connect"](client)
                         except Exception as e:
                             if self.debug:
-                                print("Error on _on_connection_server: {0}".format(e))
-                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
-                    threading.Thread(target=run).start()
+                                self._print("Error on _on_connection_server: {0}".format(e))
+                            self._send_code(client, "InternalServerError")
+                    self._spawn(client, run)
             except Exception as e:
                 if self.debug:
-                    print("Error on _on_connection_server: {0}".format(e))
-                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
+                    self._print("Error on _on_connection_server: {0}".format(e))
+                self._send_code(client, "InternalServerError")
     
     def _closed_connection_server(self, client, server): # Server-side client closed connection handler
         if not type(client) == type(None):
             try:
                 if self.debug:
                     if self.statedata["ulist"]["objs"][client['id']]["username"] == "":
-                        print("Connection closed: {0}".format(str(client['id'])))
+                        self._print("Connection closed: {0}".format(str(client['id'])))
                     else:
-                        print("Connection closed: {0} ({1})".format(str(client['id']), str(self.statedata["ulist"]["objs"][client['id']]["username"])))
+                        self._print("Connection closed: {0} ({1})".format(str(client['id']), str(self.statedata["ulist"]["objs"][client['id']]["username"])))
                 
                 if not self.callback_function["on_close"] == None:
                     try:
                         self.callback_function["on_close"](client)
                     except Exception as e:
                         if self.debug:
-                            print("Error on _closed_connection_server: {0}".format(e))
+                            self._print("Error on _closed_connection_server: {0}".format(e))
                 
                 # Remove entries from username list and userlist objects
-                if self.statedata["ulist"]["objs"][client['id']]["username"] in self.statedata["ulist"]["usernames"]:
-                    del self.statedata["ulist"]["usernames"][self.statedata["ulist"]["objs"][client['id']]["username"]]
+                username = self.statedata["ulist"]["objs"][client['id']]["username"]
+                if self.statedata["ulist"]["objs"][client['id']]["admitted"]:
+                    self.admission.release(client["address"][0])
                 del self.statedata["ulist"]["objs"][client['id']]
 
                 if self.statedata["secure_enable"]:
-                    if client in self.statedata["trusted"]:
-                        self.statedata["trusted"].remove(client)
+                    if client["id"] in self.statedata["trusted"]:
+                        self.statedata["trusted"].remove(client["id"])
 
-                self._send_to_all({"cmd": "ulist", "val": self._get_ulist()})
+                self._remove_username(username, client)
             except Exception as e:
                 if self.debug:
-                    print("Error on _closed_connection_server: {0}".format(e))
+                    self._print("Error on _closed_connection_server: {0}".format(e))
     
     def _on_packet_server(self, client, server, message): # Server-side new packet handler (Gives it's powers to _server_packet_handler)
         if not type(client) == type(None):
             try:
                 if self.debug:
-                    print("New packet from {0}: {1} bytes".format(str(client['id']), str(len(message))))
+                    self._print("New packet from {0}: {1} bytes".format(str(client['id']), str(len(message))))
+                obj = self.statedata["ulist"]["objs"].get(client["id"])
+                if not obj == None:
+                    obj["last_active"] = time.monotonic()
+                size = len(message)
+                if type(message) == bytes:
+                    # Binary frames carry MessagePack and are only accepted from clients that negotiated it
+                    if not self._get_client_encoding(client) == "msgpack":
+                        if self.debug:
+                            self._print("Ignoring binary packet from {0}".format(client['id']))
+                        return
+                    try:
+                        message = msgpack_codec.unpackb(message)
+                    except msgpack_codec.PackError:
+                        message = None
+                    if not type(message) == dict:
+                        if self.debug:
+                            self._print("Error on _on_packet_server: Failed to parse MessagePack")
+                        self._send_code(client, "Syntax")
+                        return
+                    message = Packet.from_dict(message, client, self._get_ip_of_obj(client), size=size)
+                else:
+                    # Parse once here, everything below takes the Packet as-is (invalid JSON is left for them to report)
+                    try:
+                        packet = codec.loads(message)
+                        if type(packet) == dict:
+                            message = Packet.from_dict(packet, client, self._get_ip_of_obj(client), size=size)
+                    except codec.JSONDecodeError:
+                        pass
                 if self.statedata["secure_enable"]:
                     if not self._is_obj_trusted(client):
                         try:
-                            msg = json.loads(message)
-                            listener_detected = (("listener" in msg) and (type(msg["listener"]) == str))
-                            listener_id = ""
-                            # Support listener IDs feature from CL Turbo
-                            if listener_detected: 
-                                listener_id = msg["listener"]
+                            msg = self._load_packet(message)
+                            listener_detected, listener_id = self._get_listener(msg)
                             
                             if ("cmd" in msg) and ("val" in msg):
-                                if (msg["cmd"] == "direct") and (type(msg["val"]) == dict) and (msg["val"]["cmd"] in ["ip", "type"]):
+                                if (msg["cmd"] == "direct") and (type(msg["val"]) == dict) and (msg["val"]["cmd"] in ["ip", "type", "ulist_mode", "encoding"]):
                                     if self._is_obj_blocked(client):
                                         if self.debug:
-                                            print("User {0} is IP blocked, not trusting".format(client["id"]))
+                                            self._print("User {0} is IP blocked, not trusting".format(client["id"]))
                                         # Tell the client it is IP blocked
-                                        if listener_detected:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Blocked"], "listener": listener_id}))
-                                        else:
-                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Blocked"]}))
+                                        self._send_code(client, "Blocked", listener_detected, listener_id)
                                     else:
                                         self._server_packet_handler(client, server, message, listener_detected, listener_id)
                                 else:
                                     if (msg["cmd"] == "direct") or (msg["cmd"] == "gmsg"):
                                         if self._is_obj_blocked(client):
                                             if self.debug:
-                                                print("User {0} is IP blocked, not trusting".format(client["id"]))
+                                                self._print("User {0} is IP blocked, not trusting".format(client["id"]))
                                             # Tell the client it is IP blocked
-                                            if listener_detected:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Blocked"], "listener": listener_id}))
-                                            else:
-                                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Blocked"]}))
+                                            self._send_code(client, "Blocked", listener_detected, listener_id)
                                         else:
                                             if type(msg["val"]) == str:
                                                 if msg["val"] in self.statedata["secure_keys"]:
                                                     if self._get_ip_of_obj(client) == None:
                                                         if self.debug:
-                                                            print("User {0} has not set their IP address, not trusting".format(client["id"]))
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IPRequred"], "listener": listener_id}))
-                                                        else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["IPRequred"]}))
+                                                            self._print("User {0} has not set their IP address, not trusting".format(client["id"]))
+                                                        self._send_code(client, "IPRequred", listener_detected, listener_id)
                                                     else:
-                                                        self.statedata["trusted"].append(client)
+                                                        self.statedata["trusted"].add(client["id"])
                                                         if self.debug:
-                                                            print("Trusting user {0}".format(client["id"]))
+                                                            self._print("Trusting user {0}".format(client["id"]))
 
                                                         # Send the current username list.
-                                                        self.wss.send_message(client, json.dumps({"cmd": "ulist", "val": self._get_ulist()}))
+                                                        self._send_message(client, {"cmd": "ulist", "val": self._get_ulist()})
 
                                                         # Send the current global data stream value.
-                                                        self.wss.send_message(client, json.dumps({"cmd": "gmsg", "val": str(self.statedata["gmsg"])}))
+                                                        self._send_message(client, {"cmd": "gmsg", "val": str(self.statedata["gmsg"])})
 
                                                         # Tell the client it has been trusted
-                                                        if listener_detected:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"], "listener": listener_id}))
-                                                        else:
-                                                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["OK"]}))
+                                                        self._send_code(client, "OK", listener_detected, listener_id)
                                                 else:
-                                                    if listener_detected:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TAInvalid"], "listener": listener_id}))
-                                                    else:
-                                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["TAInvalid"]}))
+                                                    self._send_code(client, "TAInvalid", listener_detected, listener_id)
                                             else:
-                                                if listener_detected:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"], "listener": listener_id}))
-                                                else:
-                                                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Datatype"]}))
+                                                self._send_code(client, "Datatype", listener_detected, listener_id)
                                     else:
-                                        self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Refused"]}))
+                                        self._send_code(client, "Refused")
                             else:
-                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
-                        except json.decoder.JSONDecodeError:
+                                self._send_code(client, "Syntax")
+                        except codec.JSONDecodeError:
                             if self.debug:
-                                print("Error on _on_packet_server: Failed to parse JSON")
-                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["Syntax"]}))
+                                self._print("Error on _on_packet_server: Failed to parse JSON")
+                            self._send_code(client, "Syntax")
                     else:
-                        try:
-                            msg = json.loads(message)
-                            listener_detected = (("listener" in msg) and (type(msg["listener"]) == str))
-                            listener_id = ""
-                            # Support listener IDs feature from CL Turbo
-                            if listener_detected: 
-                                listener_id = msg["listener"]
-                        except:
-                            listener_detected = False
-                            listener_id = ""
+                        listener_detected, listener_id = self._get_listener(message)
                         def run(*args):
                             try:
                                 self._server_packet_handler(client, server, message, listener_detected, listener_id)
                             except Exception as e:
                                 if self.debug:
-                                    print("Error on _on_packet_server: {0}".format(e))
-                                self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
-                        threading.Thread(target=run).start()
+                                    self._print("Error on _on_packet_server: {0}".format(e))
+                                self._send_code(client, "InternalServerError")
+                        if not self._spawn(client, run):
+                            if self.debug:
+                                self._print("Client {0} packet queue is full, dropping packet".format(client["id"]))
+                            self._send_code(client, "RateLimit", listener_detected, listener_id)
                 else:
                     def run(*args):
-                        try:
-                            msg = json.loads(message)
-                            listener_detected = (("listener" in msg) and (type(msg["listener"]) == str))
-                            listener_id = ""
-                            # Support listener IDs feature from CL Turbo
-                            if listener_detected: 
-                                listener_id = msg["listener"]
-                        except:
-                            listener_detected = False
-                            listener_id = ""
+                        listener_detected, listener_id = self._get_listener(message)
                         try:
                             self._server_packet_handler(client, server, message, listener_detected, listener_id)
                         except Exception as e:
                             if self.debug:
-                                print("Error on _on_packet_server: {0}".format(e))
-                            self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
-                    threading.Thread(target=run).start()
+                                self._print("Error on _on_packet_server: {0}".format(e))
+                            self._send_code(client, "InternalServerError")
+                    if not self._spawn(client, run):
+                        if self.debug:
+                            self._print("Client {0} packet queue is full, dropping packet".format(client["id"]))
+                        self._send_code(client, "RateLimit")
             except Exception as e:
-                try:
-                    msg = json.loads(message)
-                    listener_detected = (("listener" in msg) and (type(msg["listener"]) == str))
-                    listener_id = ""
-                    # Support listener IDs feature from CL Turbo
-                    if listener_detected: 
-                        listener_id = msg["listener"]
-                except:
-                    listener_detected = False
-                    listener_id = ""
+                listener_detected, listener_id = self._get_listener(message)
                 if self.debug:
-                    print("Error on _on_packet_server: {0}".format(e))
-                if listener_detected:
-                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"], "listener": listener_id}))
-                else:
-                    self.wss.send_message(client, json.dumps({"cmd": "statuscode", "val": self.codes["InternalServerError"]}))
+                    self._print("Error on _on_packet_server: {0}".format(e))
+                self._send_code(client, "InternalServerError", listener_detected, listener_id)
     
     def _on_connection_client(self, ws): # Client-side connection handler
         try:
             if self.debug:
-                print("Connected")
-            self.wss.send(json.dumps({"cmd": "direct", "val": {"cmd": "type", "val": "py"}})) # Specify to the server that the client is based on Python
+                self._print("Connected")
+            self.wss.send(codec.dumps({"cmd": "direct", "val": {"cmd": "type", "val": "py"}})) # Specify to the server that the client is based on Python
             if not self.callback_function["on_connect"] == None:
                 def run(*args):
                     try:
                         self.callback_function["on_connect"]()
                     except Exception as e:
                         if self.debug:
-                            print("Error on _on_connection_client: {0}".format(e))
+                            self._print("Error on _on_connection_client: {0}".format(e))
                 threading.Thread(target=run).start()
         except Exception as e:
             if self.debug:
-                print("Error on _on_connection_client: {0}".format(e))
+                self._print("Error on _on_connection_client: {0}".format(e))
     
     def _on_packet_client(self, ws, message): # Client-side packet handler
         try:
             if self.debug:
-                print("New packet: {0}".format(message))
+                self._print("New packet: {0}".format(message))
             
-            tmp = json.loads(message)
+            tmp = codec.loads(message)
             if (("cmd" in tmp) and (tmp["cmd"] == "ulist")) and ("val" in tmp):
                 self.statedata["ulist"]["usernames"] = str(tmp["val"]).split(";")
                 del self.statedata["ulist"]["usernames"][len(self.statedata["ulist"]["usernames"])-1]
                 if self.debug:
-                    print("Username list:", str(self.statedata["ulist"]["usernames"]))
+                    self._print("Username list:", str(self.statedata["ulist"]["usernames"]))
             
             if not self.callback_function["on_packet"] == None:
                 def run(*args):
@@ -1246,40 +1779,40 @@ class CloudLink(API):
                         self.callback_function["on_packet"](message)
                     except Exception as e:
                         if self.debug:
-                            print("Error on _on_packet_client: {0}".format(e))
+                            self._print("Error on _on_packet_client: {0}".format(e))
                 threading.Thread(target=run).start()
         except Exception as e:
             if self.debug:
-                print("Error on _on_packet_client: {0}".format(e))
+                self._print("Error on _on_packet_client: {0}".format(e))
     
     def _on_error_client(self, ws, error): # Client-side error handler
         try:
             if self.debug:
-                print("Error: {0}".format(str(error)))
+                self._print("Error: {0}".format(str(error)))
             if not self.callback_function["on_error"] == None:
                 def run(*args):
                     try:
                         self.callback_function["on_error"](error)
                     except Exception as e:
                         if self.debug:
-                            print("Error on _on_error_client: {0}".format(e))
+                            self._print("Error on _on_error_client: {0}".format(e))
                 threading.Thread(target=run).start()
         except Exception as e:
             if self.debug:
-                print("Error on _on_error_client: {0}".format(e))
+                self._print("Error on _on_error_client: {0}".format(e))
     
     def _closed_connection_client(self, ws, close_status_code, close_msg): #Client-side closed connection handler
         try:
             if self.debug:
-                print("Closed, status: {0} with code {1}".format(str(close_status_code), str(close_msg)))
+                self._print("Closed, status: {0} with code {1}".format(str(close_status_code), str(close_msg)))
             if not self.callback_function["on_close"] == None:
                 def run(*args):
                     try:
                         self.callback_function["on_close"]()
                     except Exception as e:
                         if self.debug:
-                            print("Error on _closed_connection_client: {0}".format(e))
+                            self._print("Error on _closed_connection_client: {0}".format(e))
                 threading.Thread(target=run).start()
         except Exception as e:
             if self.debug:
-                print("Error on _closed_connection_client: {0}".format(e))
+                self._print("Error on _closed_connection_client: {0}".format(e))
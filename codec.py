@@ -0,0 +1,61 @@
+import json
+import os
+
+"""
+
+CloudLink Codec Module
+
+This module provides the JSON encoder/decoder used by CloudLink, Meower and the REST API. It
+uses the fastest installed backend (orjson, then ujson) and falls back to the standard json
+module, both when nothing faster is installed and when a backend rejects an object (e.g.
+orjson with non-string dict keys). Set CLOUDLINK_JSON=json|orjson|ujson to pick one.
+
+dumps() always returns a str. Every backend raises a ValueError subclass on bad input, so
+callers can catch codec.JSONDecodeError whichever backend is in use.
+
+"""
+
+JSONDecodeError = ValueError
+
+def _json_dumps(obj, default=None):
+    return json.dumps(obj, default=default)
+
+BACKENDS = { # Name -> (dumps, loads), in order of preference
+}
+
+try:
+    import orjson
+
+    def _orjson_dumps(obj, default=None):
+        return orjson.dumps(obj, default=default).decode("utf-8")
+
+    BACKENDS["orjson"] = (_orjson_dumps, orjson.loads)
+except ImportError:
+    pass
+
+try:
+    import ujson
+
+    def _ujson_dumps(obj, default=None):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=default)
+
+    BACKENDS["ujson"] = (_ujson_dumps, ujson.loads)
+except ImportError:
+    pass
+
+BACKENDS["json"] = (_json_dumps, json.loads)
+
+backend = os.environ.get("CLOUDLINK_JSON", "")
+if not backend in BACKENDS:
+    backend = list(BACKENDS)[0]
+_dumps, _loads = BACKENDS[backend]
+
+def dumps(obj, default=None): # Serializes an object to a JSON string
+    try:
+        return _dumps(obj, default)
+    except (TypeError, OverflowError):
+        # Things the fast backends refuse (non-string keys, huge ints), the json module may still handle
+        return json.dumps(obj, default=default)
+
+def loads(data): # Parses a JSON string or bytes
+    return _loads(data)
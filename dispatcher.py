@@ -0,0 +1,94 @@
+import threading
+import traceback
+from collections import deque
+from queue import SimpleQueue
+from logger import logger, ERROR
+
+"""
+
+CloudLink Dispatch Module
+
+This module provides a fixed-size worker pool that runs tasks grouped by a key (the client ID).
+Tasks that share a key run one at a time in submission order, tasks with different keys run in
+parallel. Each key has a bounded queue so one flooding client can't grow memory without limit.
+
+"""
+
+_STOP = object()
+
+class KeyedDispatcher:
+    def __init__(self, workers=16, queue_depth=64, max_pending=10000, name="dispatch"):
+        self.workers = workers # Number of worker threads
+        self.queue_depth = queue_depth # Max pending tasks per key
+        self.max_pending = max_pending # Max pending tasks across all keys, None for no limit
+        self.pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._queues = {} # Key -> deque of tasks, present while the key is scheduled or running
+        self._ready = SimpleQueue() # Keys with work waiting for a worker
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name="{0}-{1}".format(name, i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, function): # Returns False if the task was rejected because a queue is full
+        with self._lock:
+            if key in self._queues:
+                tasks = self._queues[key]
+                schedule = False
+            else:
+                tasks = deque()
+                self._queues[key] = tasks
+                schedule = True
+            if (len(tasks) >= self.queue_depth) or ((not self.max_pending == None) and (self.pending >= self.max_pending)):
+                if schedule:
+                    del self._queues[key]
+                self.rejected += 1
+                return False
+            tasks.append(function)
+            self.pending += 1
+        if schedule:
+            self._ready.put(key)
+        return True
+
+    def depth(self, key): # Number of tasks waiting for a key
+        with self._lock:
+            if key in self._queues:
+                return len(self._queues[key])
+            return 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "active_keys": len(self._queues),
+                "rejected": self.rejected
+            }
+
+    def shutdown(self):
+        for thread in self._threads:
+            self._ready.put(_STOP)
+
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+            if key is _STOP:
+                return
+            with self._lock:
+                function = self._queues[key].popleft()
+            try:
+                function()
+            except Exception:
+                logger.log(ERROR, "Error in a dispatched task: {0}", traceback.format_exc().rstrip())
+            with self._lock:
+                self.pending -= 1
+                if len(self._queues[key]) == 0:
+                    del self._queues[key]
+                    reschedule = False
+                else:
+                    reschedule = True
+            if reschedule:
+                # Go to the back of the line so busy clients can't starve the others
+                self._ready.put(key)
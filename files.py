@@ -1,6 +1,7 @@
 from pymongo import MongoClient
 import time
 from uuid import uuid4
+from logger import DEBUG
 
 from requests import delete
 
@@ -14,13 +15,17 @@ This file should be modified/refactored to interact with a JSON-friendly databas
 """
 
 class Files:
-    def __init__(self, logger, errorhandler):
+    def __init__(self, logger, errorhandler, db=None):
         self.log = logger
         self.errorhandler = errorhandler
 
-        mongo_ip = "mongodb://localhost:27017"
-        self.log("Connecting to database '{0}'\n(If it seems like the server is stuck or the server randomly crashes, it probably means it couldn't connect to the database)".format(mongo_ip))
-        self.db = MongoClient(mongo_ip)["meowerserver"]
+        if db == None:
+            mongo_ip = "mongodb://localhost:27017"
+            self.log("Connecting to database '{0}'\n(If it seems like the server is stuck or the server randomly crashes, it probably means it couldn't connect to the database)", mongo_ip)
+            self.db = MongoClient(mongo_ip)["meowerserver"]
+        else:
+            # A database object that works like pymongo's (e.g. the in-memory one the benchmarks use)
+            self.db = db
 
         # Check connection status
         if self.db.client.get_database("meowerserver") == None:
@@ -31,7 +36,7 @@ class Files:
         # Create database collections
         for item in ["config", "usersv0", "usersv1", "netlog", "posts", "chats", "reports"]:
             if not item in self.db.list_collection_names():
-                self.log("Creating collection {0}".format(item))
+                self.log("Creating collection {0}", item)
                 self.db.create_collection(name=item)
         
         # Create collection indexes
@@ -117,10 +122,10 @@ class Files:
                 self.db[collection].insert_one(data)
                 return True
             else:
-                self.log("{0} already exists in {1}".format(id, collection))
+                self.log("{0} already exists in {1}", id, collection, level=DEBUG)
                 return False
         else:
-            self.log("{0} collection doesn't exist".format(collection))
+            self.log("{0} collection doesn't exist", collection)
             return False
 
     def update_item(self, collection, id, data):
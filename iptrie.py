@@ -0,0 +1,126 @@
+import ipaddress
+
+"""
+
+CloudLink IP Range Module
+
+This module provides a binary prefix trie for IPv4 and IPv6 blocklists. Rules can be single
+addresses, CIDR ranges ("10.0.0.0/8", "2001:db8::/32") or IPv4 wildcards ("192.168.1.*").
+A lookup walks at most 32 (IPv4) or 128 (IPv6) nodes, no matter how many rules are loaded.
+
+"""
+
+def parse_rule(rule): # Returns an ip_network for a rule, or None if the rule is not an address or range
+    if not type(rule) == str:
+        return None
+    rule = rule.strip()
+    if "*" in rule:
+        # IPv4 wildcards, "1.2.*" and "1.2.*.*" both mean 1.2.0.0/16
+        octets = rule.split(".")
+        fixed = []
+        for octet in octets:
+            if octet == "*":
+                break
+            fixed.append(octet)
+        if (len(fixed) == 0) or (len(octets) > 4) or (not all(octet == "*" for octet in octets[len(fixed):])):
+            return None
+        rule = "{0}/{1}".format(".".join(fixed + (["0"] * (4 - len(fixed)))), len(fixed) * 8)
+    try:
+        return ipaddress.ip_network(rule, strict=False)
+    except ValueError:
+        return None
+
+class IPTrie:
+    def __init__(self):
+        # Nodes are [zero child, one child, rule], one root per address family
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self._rules = {} # Rule string -> ip_network
+        self._networks = {} # ip_network -> number of rule strings mapped to it
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __contains__(self, ip):
+        return self.match(ip)
+
+    def rules(self):
+        return list(self._rules)
+
+    def add(self, rule): # Returns False if the rule could not be parsed
+        network = parse_rule(rule)
+        if network == None:
+            return False
+        if rule in self._rules:
+            return True
+        self._rules[rule] = network
+        if network in self._networks:
+            self._networks[network] += 1
+            return True
+        self._networks[network] = 1
+
+        node = self._roots[network.version]
+        value = int(network.network_address)
+        width = network.max_prefixlen
+        for i in range(network.prefixlen):
+            bit = (value >> (width - 1 - i)) & 1
+            if node[bit] == None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = network
+        return True
+
+    def remove(self, rule): # Returns False if the rule was not in the trie
+        if not rule in self._rules:
+            return False
+        network = self._rules.pop(rule)
+        self._networks[network] -= 1
+        if self._networks[network] > 0:
+            return True
+        del self._networks[network]
+
+        # Walk down remembering the path so empty branches can be pruned
+        node = self._roots[network.version]
+        value = int(network.network_address)
+        width = network.max_prefixlen
+        path = []
+        for i in range(network.prefixlen):
+            bit = (value >> (width - 1 - i)) & 1
+            path.append((node, bit))
+            node = node[bit]
+        node[2] = None
+        for parent, bit in reversed(path):
+            child = parent[bit]
+            if (child[0] == None) and (child[1] == None) and (child[2] == None):
+                parent[bit] = None
+            else:
+                break
+        return True
+
+    def clear(self):
+        self.__init__()
+
+    def lookup(self, ip): # Returns the widest network covering the address, or None
+        if (not type(ip) == str) or (len(self._networks) == 0):
+            return None
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if (address.version == 6) and (not address.ipv4_mapped == None):
+            address = address.ipv4_mapped
+
+        node = self._roots[address.version]
+        value = int(address)
+        width = address.max_prefixlen
+        if not node[2] == None:
+            return node[2]
+        for i in range(width):
+            node = node[(value >> (width - 1 - i)) & 1]
+            if node == None:
+                return None
+            if not node[2] == None:
+                return node[2]
+        return None
+
+    def match(self, ip): # Checks if an address is covered by any rule
+        return not self.lookup(ip) == None
@@ -0,0 +1,149 @@
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+
+"""
+
+Meower Logger Module
+
+This module provides the server's log pipeline. Logging a message only puts it on a queue; a
+background thread formats the messages and writes them out in batches, so packet handlers never
+wait on stdout. Messages below the logger's level are dropped before anything is formatted, and
+arguments are formatted lazily (log("Loaded {0}", payload) only turns payload into a string if
+the message is written). Hot messages can be sampled: log(..., sample=100) writes one in every
+100 calls of that message. If the queue fills up, new messages are dropped and counted instead of
+blocking.
+
+Use the module-level `logger` object, Supporter.log writes to it. It is flushed when the
+interpreter exits; processes that leave with os._exit have to call logger.flush() first.
+
+"""
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+class Logger:
+    def __init__(self, level=INFO, stream=None, max_queue=10000, batch_size=256):
+        self.level = level # Messages below this level are dropped
+        self.stream = stream # Where messages are written, sys.stdout (at write time) by default
+        self.max_queue = max_queue
+        self.batch_size = batch_size # Most messages written per flush of the stream
+        self.samples = {} # Message -> times it was logged, for sampled messages
+        self.dropped = 0 # Messages dropped because the queue was full, since the last report
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.thread = None
+        self.last_second = None
+        self.last_timestamp = ""
+
+    def set_level(self, level):
+        self.level = level
+
+    def is_enabled(self, level): # Lets callers skip building expensive messages
+        return level >= self.level
+
+    def log(self, level, message, *args, sample=None):
+        if level < self.level:
+            return
+        if not sample == None:
+            count = self.samples.get(message, 0)
+            self.samples[message] = count + 1
+            if not count % sample == 0:
+                return
+        self._start()
+        try:
+            self.queue.put_nowait((time.time(), level, message, args, sample))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, message, *args, sample=None):
+        self.log(DEBUG, message, *args, sample=sample)
+
+    def info(self, message, *args, sample=None):
+        self.log(INFO, message, *args, sample=sample)
+
+    def warning(self, message, *args, sample=None):
+        self.log(WARNING, message, *args, sample=sample)
+
+    def error(self, message, *args, sample=None):
+        self.log(ERROR, message, *args, sample=sample)
+
+    def flush(self, timeout=5): # Waits until everything logged so far is written
+        if (self.queue == None) or (not self.pid == os.getpid()):
+            return
+        deadline = time.time() + timeout
+        while (self.queue.unfinished_tasks > 0) and (time.time() < deadline):
+            time.sleep(0.01)
+
+    def _start(self): # Starts the writer thread, again in a forked child (which only inherits the thread that forked)
+        if (not self.thread == None) and (self.pid == os.getpid()):
+            return
+        with self.lock:
+            if (self.thread == None) or (not self.pid == os.getpid()):
+                self.pid = os.getpid()
+                self.queue = queue.Queue(self.max_queue)
+                self.dropped = 0
+                self.thread = threading.Thread(target=self._writer_loop, args=(self.queue,), daemon=True, name="meower-logger")
+                self.thread.start()
+
+    def _timestamp(self, when): # Formatted once per second
+        second = int(when)
+        if not second == self.last_second:
+            self.last_second = second
+            self.last_timestamp = time.strftime("%m/%d/%Y %H:%M.%S", time.localtime(second))
+        return self.last_timestamp
+
+    def _format(self, record):
+        when, level, message, args, sample = record
+        if len(args) > 0:
+            try:
+                message = message.format(*args)
+            except Exception:
+                # Not repr(args), the arguments may be what failed
+                message = "{0} (arguments could not be formatted)".format(message)
+        if not sample == None:
+            message = "{0} (1 in {1} logged)".format(message, sample)
+        if level == INFO:
+            return "{0}: {1}\n".format(self._timestamp(when), message)
+        return "{0}: {1}: {2}\n".format(self._timestamp(when), LEVEL_NAMES.get(level, level), message)
+
+    def _writer_loop(self, records):
+        while True:
+            batch = [records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            if self.dropped > 0:
+                dropped = self.dropped
+                self.dropped = 0
+                lines.append("{0}: WARNING: {1} log messages were dropped, the log queue was full\n".format(self._timestamp(time.time()), dropped))
+            for record in batch:
+                try:
+                    lines.append(self._format(record))
+                except Exception:
+                    # A line for every record, an exception here would stop the writer for good
+                    lines.append("{0}: ERROR: a log message could not be formatted\n".format(self._timestamp(time.time())))
+            try:
+                stream = self.stream
+                if stream == None:
+                    stream = sys.stdout
+                stream.write("".join(lines))
+                stream.flush()
+            except Exception:
+                pass
+            for record in batch:
+                records.task_done()
+
+logger = Logger()
+atexit.register(logger.flush) # The writer is a daemon thread, so write out what is still queued
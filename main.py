@@ -3,7 +3,9 @@ from supporter import Supporter
 from security import Security
 from files import Files
 from meower import Meower
-from rest_api import app as rest_api_app
+from supervisor import Supervisor
+from metrics import metrics
+from logger import logger, DEBUG, INFO, WARNING, ERROR
 from threading import Thread
 
 """
@@ -23,17 +25,87 @@ Dependencies:
 
 """
 
+# Commands handled by Meower, anything else gets the Invalid code
+COMMANDS = frozenset([
+    "ping",
+    "version_chk",
+    "get_ulist",
+    "authpswd",
+    "gen_account",
+    "get_profile",
+    "update_config",
+    "change_pswd",
+    "del_tokens",
+    "del_account",
+    "get_home",
+    "get_inbox",
+    "post_home",
+    "get_post",
+    "get_peak_users",
+    "search_user_posts",
+    "report",
+    "close_report",
+    "clear_home",
+    "clear_user_posts",
+    "alert",
+    "announce",
+    "block",
+    "unblock",
+    "kick",
+    "get_user_ip",
+    "get_ip_data",
+    "get_user_data",
+    "ban",
+    "pardon",
+    "terminate",
+    "impersonate",
+    "repair_mode",
+    "get_metrics",
+    "reload_filter",
+    "delete_post",
+    "post_chat",
+    "set_chat_state",
+    "create_chat",
+    "leave_chat",
+    "get_chat_list",
+    "get_chat_data",
+    "get_chat_posts",
+    "add_to_chat",
+    "remove_from_chat"
+])
+
 class Main:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, mode="threaded", processes=1, port=3000, db=None, rest_api=True):
+        # Set before forking, so the supervisor and the workers log at the same level
+        logger.set_level(DEBUG if debug else INFO)
+        if processes > 1:
+            # Supervisor mode: the workers share the websocket port, this process runs the bus and the REST API
+            if not mode == "asyncio":
+                logger.log(WARNING, "Supervisor mode needs the asyncio engine, using it")
+            self.supervisor = Supervisor(processes=processes, debug=debug)
+            self.supervisor.run(
+                worker = lambda index, bus: self.start(debug=debug, mode="asyncio", bus=bus, port=port, db=db, rest_api=False),
+                on_started = (self.run_rest_api if rest_api else None)
+            )
+        else:
+            self.start(debug=debug, mode=mode, port=port, db=db, rest_api=rest_api)
+    
+    def run_rest_api(self):
+        # Imported here, the REST API connects to the database as soon as it is loaded
+        from rest_api import app as rest_api_app
+        Thread(target=rest_api_app.run, kwargs={"host": "0.0.0.0", "port": 3001, "debug": False, "use_reloader": False}).start()
+    
+    def start(self, debug=False, mode="threaded", bus=None, port=3000, db=None, rest_api=True):
         # Initalize libraries
-        self.cl = CloudLink(debug=debug) # CloudLink Server
+        self.cl = CloudLink(debug=debug, logger=logger) # CloudLink Server
         self.supporter = Supporter( # Support functionality
             cl = self.cl,
             packet_callback = self.handle_packet
         )
         self.filesystem = Files( # Filesystem/Database I/O
             logger = self.supporter.log,
-            errorhandler = self.supporter.full_stack
+            errorhandler = self.supporter.full_stack,
+            db = db
         )
         self.accounts = Security( # Security and account management
             files = self.filesystem,
@@ -61,77 +133,54 @@ class Main:
         ips = []
         for netlog in self.filesystem.db["netlog"].find({"blocked": True}):
             ips.append(netlog["_id"])
+        result, payload = self.filesystem.load_item("config", "IPBanlist")
+        if result:
+            # Wildcard entries can be single addresses or CIDR ranges
+            ips.extend(payload["wildcard"])
         self.cl.loadIPBlocklist(ips)
         
+        # Count the bytes each command sends
+        self.cl.callback("on_sent", metrics.add_bytes_out)
+        
         # Set server MOTD
         self.cl.setMOTD("Meower Social Media Platform Server", True)
         
-        # Run REST API
-        Thread(target=rest_api_app.run, kwargs={"host": "0.0.0.0", "port": 3001, "debug": False, "use_reloader": False}).start()
+        # Run REST API (the supervisor runs it in supervisor mode)
+        if rest_api:
+            self.run_rest_api()
 
         # Run CloudLink server
-        self.cl.server(port=3000, ip="0.0.0.0")
+        self.cl.server(port=port, ip="0.0.0.0", mode=mode, reuse_port=(not bus == None), bus=bus)
     
     def returnCode(self, client, code, listener_detected, listener_id):
-        self.supporter.sendPacket({"cmd": "statuscode", "val": self.cl.codes[str(code)], "id": client}, listener_detected = listener_detected, listener_id = listener_id)
+        self.cl.sendCode(client, str(code), listener_detected, listener_id)
     
-    def handle_packet(self, cmd, ip, val, listener_detected, listener_id, client, clienttype):
+    def handle_packet(self, packet):
+        # CL Turbo Support
+        listener_detected = packet.listener_detected
+        listener_id = None
+        if listener_detected:
+            listener_id = packet.listener
+        client = packet.id
+        cmd = packet.get("cmd")
+        if not cmd in COMMANDS:
+            cmd = "(invalid)" # Not one metric per made-up command name
+        start = metrics.start(cmd)
+        error = False
         try:
-            commands = set([
-                "ping",
-                "version_chk", 
-                "get_ulist", 
-                "authpswd", 
-                "gen_account", 
-                "get_profile", 
-                "update_config",
-                "change_pswd", 
-                "del_tokens",
-                "del_account",
-                "get_home", 
-                "get_inbox", 
-                "post_home",
-                "get_post", 
-                "get_peak_users", 
-                "search_user_posts",
-                "report",
-                "close_report",
-                "clear_home",
-                "clear_user_posts",
-                "alert",
-                "announce",
-                "block",
-                "unblock",
-                "kick",
-                "get_user_ip",
-                "get_ip_data",
-                "get_user_data",
-                "ban",
-                "pardon",
-                "terminate",
-                "impersonate",
-                "repair_mode",
-                "delete_post",
-                "post_chat",
-                "set_chat_state",
-                "create_chat",
-                "leave_chat",
-                "get_chat_list",
-                "get_chat_data",
-                "get_chat_posts",
-                "add_to_chat",
-                "remove_from_chat"
-            ])
-            if cmd in commands:
-                getattr(self.meower, cmd)(client, val, listener_detected, listener_id)
+            if not cmd == "(invalid)":
+                getattr(self.meower, cmd)(client, packet.val, listener_detected, listener_id)
             else:
                 # Catch-all error code
                 self.returnCode(code = "Invalid", client = client, listener_detected = listener_detected, listener_id = listener_id)
         except Exception:
-            self.supporter.log("{0}".format(self.supporter.full_stack()))
+            error = True
+            self.supporter.log(self.supporter.full_stack(), level=ERROR)
 
             # Catch-all error code
             self.returnCode(code = "InternalServerError", client = client, listener_detected = listener_detected, listener_id = listener_id)
+        finally:
+            metrics.finish(cmd, start, error, packet.size)
 
 if __name__ == "__main__":
     Main(debug=True)
\ No newline at end of file
@@ -5,6 +5,8 @@ import pymongo
 import os
 from dotenv import load_dotenv
 import requests
+from metrics import metrics
+from logger import DEBUG
 
 load_dotenv()  # take environment variables from .env.
 
@@ -17,9 +19,10 @@ class Meower:
         self.accounts = accounts
         self.filesystem = files
         self.sendPacket = self.supporter.sendPacket
-        result, self.supporter.filter = self.filesystem.load_item("config", "filter")
-        if not result:
-            self.log("Failed to load profanity filter, default will be used as fallback!")
+        self.chats = self.supporter.chats # Online members of group chats
+        if not self.cl == None:
+            self.cl.callback("on_relay", self.on_relay)
+        self.loadFilter(relay=False)
         result, self.supporter.status = self.filesystem.load_item("config", "status")
         if not result:
             self.log("Failed to load status, server will enable repair mode!")
@@ -28,6 +31,67 @@ class Meower:
     
     # Some Meower-library specific utilities needed
     
+    def loadFilter(self, relay=True): # Loads config.filter from the database and swaps in the compiled filter, on every worker
+        result, filter = self.filesystem.load_item("config", "filter")
+        if not result:
+            self.log("Failed to load profanity filter, default will be used as fallback!")
+            filter = None
+        version = self.supporter.set_filter(filter)
+        if relay and (not self.cl == None):
+            self.cl.relay({"mode": "filter"})
+        return version
+    
+    def setStatus(self, status, relay=True): # Sets the server status (repair mode), on every worker
+        self.supporter.status = status
+        if relay and (not self.cl == None):
+            self.cl.relay({"mode": "status", "val": status})
+    
+    def trackChats(self, client, username): # Loads the chats of a user that just logged in into the online chat index
+        chatids = [chat["_id"] for chat in self.filesystem.db["chats"].find({"members": username}, {"_id": 1})]
+        self.chats.add_user(username, client["id"], chatids)
+    
+    def updateChatIndex(self, action, chatid, username=None, relay=True): # Applies a chat membership change ("add", "remove" or "delete") to the online chat index of every worker
+        if action == "add":
+            self.chats.add_member(chatid, username)
+        elif action == "remove":
+            self.chats.remove_member(chatid, username)
+        elif action == "delete":
+            self.chats.remove_chat(chatid)
+        if relay:
+            self.cl.relay({"mode": "chat_index", "action": action, "chatid": chatid, "username": username})
+    
+    def updateIPBlocklist(self, action, ip, relay=True): # Blocks ("block") or unblocks ("unblock") an IP address or range, on every worker
+        if action == "block":
+            self.cl.blockIP(ip)
+
+            # Kick all clients in the blocked address or range, each worker kicks its own users
+            for user, client_id in list(self.cl.statedata["ulist"]["usernames"].items()):
+                obj = self.cl.statedata["ulist"]["objs"].get(client_id)
+                if (not obj == None) and self.cl.isIPBlocked(obj["ip"]):
+                    self.supporter.kickUser(user, "Blocked")
+        elif action == "unblock":
+            self.cl.unblockIP(ip)
+        if relay:
+            self.cl.relay({"mode": "blocklist", "action": action, "ip": ip})
+    
+    def sendToChat(self, chatid, payload, droppable=False, relay=True): # Sends a direct packet to the online members of a group chat, on every worker
+        for member in self.chats.members(chatid):
+            self.sendPacket({"cmd": "direct", "val": payload, "id": member}, droppable = droppable)
+        if relay:
+            self.cl.relay({"mode": "chat", "chatid": chatid, "val": payload, "droppable": droppable})
+    
+    def on_relay(self, message): # Handles chat messages, chat membership changes, blocklist changes, status changes and filter reloads from the other workers
+        if message["mode"] == "chat":
+            self.sendToChat(message["chatid"], message["val"], message["droppable"], relay=False)
+        elif message["mode"] == "chat_index":
+            self.updateChatIndex(message["action"], message["chatid"], message["username"], relay=False)
+        elif message["mode"] == "blocklist":
+            self.updateIPBlocklist(message["action"], message["ip"], relay=False)
+        elif message["mode"] == "status":
+            self.setStatus(message["val"], relay=False)
+        elif message["mode"] == "filter":
+            self.loadFilter(relay=False)
+    
     def checkForInt(self, data):
         try:
             int(data)
@@ -135,7 +199,10 @@ class Meower:
             self.cl.sendPacket({"cmd": "direct", "val": payload})
             return True
         else:
-            result, chat_data = self.filesystem.load_item("chats", post_origin)
+            # The chat only has to be looked up if the index doesn't know the user is in it
+            result = self.chats.is_member(post_origin, user)
+            if not result:
+                result = self.filesystem.does_item_exist("chats", post_origin)
             if result:
                 post_data = {
                     "type": 1,
@@ -154,9 +221,7 @@ class Meower:
                     payload = post_data
                     payload["state"] = 2
 
-                    for member in chat_data["members"]:
-                        if member in self.cl.getUsernames():
-                            self.cl.sendPacket({"cmd": "direct", "val": payload, "id": member})
+                    self.sendToChat(post_origin, payload)
                     return True
                 else:
                     return False
@@ -178,7 +243,7 @@ class Meower:
                 self.filesystem.delete_item("reports", _id)
 
     def returnCode(self, client, code, listener_detected, listener_id):
-        self.sendPacket({"cmd": "statuscode", "val": self.cl.codes[str(code)], "id": client}, listener_detected = listener_detected, listener_id = listener_id)
+        self.cl.sendCode(client, str(code), listener_detected, listener_id)
     
     # Networking/client utilities
     
@@ -238,6 +303,7 @@ class Meower:
                                                 self.accounts.update_setting(username, {"last_ip": str(self.cl.statedata["ulist"]["objs"][client["id"]]["ip"]), "tokens": accountData["tokens"]}, forceUpdate=True)
                                                 self.supporter.autoID(client, username) # Give the client an AutoID
                                                 self.supporter.setAuthenticatedState(client, True) # Make the server know that the client is authed
+                                                self.trackChats(client, username)
                                                 # Return info to sender
                                                 payload = {
                                                     "mode": "auth",
@@ -314,7 +380,7 @@ class Meower:
                                         ip_info = requests.get("http://v2.api.iphub.info/ip/{0}".format(ip), headers={"X-Key": iphub_key})
                                         if ip_info.status_code == 200:
                                             if ip_info.json()["block"] == 1:
-                                                self.log("{0} was detected as a VPN/proxy".format(ip))
+                                                self.log("{0} was detected as a VPN/proxy", ip)
                                                 self.supporter.known_vpns.append(ip)
                                                 return self.returnCode(client = client, code = "Blocked", listener_detected = listener_detected, listener_id = listener_id)
                                             else:
@@ -323,7 +389,7 @@ class Meower:
                                             self.log("{0} was detected using an invalid IP")
                                             return self.returnCode(client = client, code = "InternalServerError", listener_detected = listener_detected, listener_id = listener_id)
                                     else:
-                                        self.log("No IPHub API key detected, skipping VPN/proxy check for {0}".format(ip))
+                                        self.log("No IPHub API key detected, skipping VPN/proxy check for {0}", ip)
 
                                 if not self.supporter.check_for_spam("signup", ip, burst=2, seconds=120):
                                     FileCheck, FileWrite = self.accounts.create_account(username, password)
@@ -342,6 +408,7 @@ class Meower:
                                             self.accounts.update_setting(username, {"last_ip": str(self.cl.statedata["ulist"]["objs"][client["id"]]["ip"]), "tokens": accountData["tokens"]}, forceUpdate=True)
                                             self.supporter.autoID(client, username) # If the client is JS-based then give them an AutoID
                                             self.supporter.setAuthenticatedState(client, True) # Make the server know that the client is authed
+                                            self.chats.add_user(username, client["id"], []) # New accounts aren't in any chats
                                             
                                             # Return info to sender
                                             payload = {
@@ -406,7 +473,7 @@ class Meower:
                         "user_id": val
                     }
                     
-                    self.log("{0} fetching profile {1}".format(client, val))
+                    self.log("{0} fetching profile {1}", client, val, level=DEBUG)
                     self.sendPacket({"cmd": "direct", "val": payload, "id": client}, listener_detected = listener_detected, listener_id = listener_id)
                     
                     # Return to the client it's data
@@ -431,7 +498,7 @@ class Meower:
             if type(val) == dict:
                 FileCheck, FileRead, Payload = self.accounts.get_account(client, True, True)
                 if FileCheck and FileRead:
-                    self.log("{0} updating config".format(client))
+                    self.log("{0} updating config", client, level=DEBUG)
                     FileCheck, FileRead, FileWrite = self.accounts.update_setting(client, val)
                     if FileCheck and FileRead and FileWrite:
                         # OK
@@ -484,7 +551,7 @@ class Meower:
                         # Create post
                         result = self.createPost(post_origin="home", user=client, content=val)
                         if result:
-                            self.log("{0} posting home message".format(client))
+                            self.log("{0} posting home message", client)
                             # Tell client message was sent
                             self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
                             self.supporter.ratelimit(client)
@@ -538,7 +605,7 @@ class Meower:
                                         "payload": payload
                                     }
 
-                                self.log("{0} getting post {1}".format(client, val))
+                                self.log("{0} getting post {1}", client, val, level=DEBUG)
 
                                 # Relay post to client
                                 self.sendPacket({"cmd": "direct", "val": payload, "id": client})
@@ -836,16 +903,9 @@ class Meower:
                         result, payload = self.filesystem.load_item("config", "IPBanlist")
                         if result:
                             if val not in payload["wildcard"]:
-                                self.log("Wildcard unblocking IP address {0}".format(val))
+                                self.log("Wildcard unblocking IP address {0}", val)
                                 payload["wildcard"].append(val)
-                                self.cl.blockIP(val)
-
-                                # Kick all clients
-                                FileRead, netlog = self.filesystem.load_item("netlog", val)
-                                if FileRead:
-                                    for user in netlog["users"]:
-                                        if user in self.cl.getUsernames() and (self.cl.statedata["ulist"]["objs"][self.cl.statedata["ulist"]["usernames"][user]]["ip"] == val):
-                                            self.supporter.kickUser(user, "Blocked")
+                                self.updateIPBlocklist("block", val)
                                 
                             result = self.filesystem.write_item("config", "IPBanlist", payload)
                             if result:
@@ -883,9 +943,9 @@ class Meower:
                         result, payload = self.filesystem.load_item("config", "IPBanlist")
                         if result:
                             if val in payload["wildcard"]:
-                                self.log("Wildcard unblocking IP address {0}".format(val))
+                                self.log("Wildcard unblocking IP address {0}", val)
                                 payload["wildcard"].remove(val)
-                                self.cl.unblockIP(val)
+                                self.updateIPBlocklist("unblock", val)
                                 
                             result = self.filesystem.write_item("config", "IPBanlist", payload)
                             if result:
@@ -1002,7 +1062,7 @@ class Meower:
                             if result:
                                 result, banlist = self.filesystem.load_item("config", "IPBanlist")
                                 if result:
-                                    netdata["banned"] = (str(val) in banlist["wildcard"])
+                                    netdata["banned"] = ((str(val) in banlist["wildcard"]) or self.cl.isIPBlocked(str(val)))
                                     netdata["ip"] = str(val)
                                     payload = {
                                         "mode": "ip_data",
@@ -1089,7 +1149,7 @@ class Meower:
                             FileCheck, FileRead, FileWrite = self.accounts.update_setting(val, {"banned": True}, forceUpdate=True)
                             if FileCheck and FileRead and FileWrite:
                                 self.createPost(post_origin="inbox", user=val, content="Your account has been banned due to recent activity. If you think this is a mistake, please report this message and we will look further into it.")
-                                self.log("Banning {0}".format(val))
+                                self.log("Banning {0}", val)
                                 # Kick client
                                 self.supporter.kickUser(val, status="Banned")
                                 
@@ -1132,7 +1192,7 @@ class Meower:
                             FileCheck, FileRead, FileWrite = self.accounts.update_setting(val, {"banned": False}, forceUpdate=True)
                             if FileCheck and FileRead and FileWrite:
                                 self.createPost(post_origin="inbox", user=val, content="Your account has been unbanned. Welcome back! Please make sure to follow the Meower community guidelines in the future, otherwise you may receive a more severe punishment.")
-                                self.log("Pardoning {0}".format(val))
+                                self.log("Pardoning {0}", val)
                                 # Tell client it pardoned the user
                                 self.sendPacket({"cmd": "direct", "val": "", "id": client}, listener_detected = listener_detected, listener_id = listener_id)
                                 self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
@@ -1176,7 +1236,7 @@ class Meower:
                                     self.sendPacket({"cmd": "direct", "val": {"mode": "delete", "id": post["_id"]}})
                             FileCheck, FileRead, FileWrite = self.accounts.update_setting(val, {"banned": True}, forceUpdate=True)
                             if FileCheck and FileRead and FileWrite:
-                                self.log("Terminating {0}".format(val))
+                                self.log("Terminating {0}", val)
                                 # Kick the user
                                 self.cl.kickClient(val, status="Banned")
 
@@ -1207,6 +1267,54 @@ class Meower:
             # Not authenticated
             self.returnCode(client = client, code = "Refused", listener_detected = listener_detected, listener_id = listener_id)
     
+    def get_metrics(self, client, val, listener_detected, listener_id):
+        # Check if the client is authenticated
+        if self.supporter.isAuthenticated(client):
+            FileCheck, FileRead, accountData = self.accounts.get_account(client, True, True)
+            if FileCheck and FileRead:
+                if accountData["lvl"] >= 3:
+                    payload = {
+                        "mode": "metrics",
+                        "payload": metrics.snapshot()
+                    }
+                    payload["payload"]["wordfilter"] = self.supporter.get_wordfilter_stats()
+                    self.sendPacket({"cmd": "direct", "val": payload, "id": client}, listener_detected = listener_detected, listener_id = listener_id)
+                    self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
+                else:
+                    self.returnCode(client = client, code = "MissingPermissions", listener_detected = listener_detected, listener_id = listener_id)
+            else:
+                if ((not FileCheck) and FileRead):
+                    # Account not found
+                    self.returnCode(client = client, code = "IDNotFound", listener_detected = listener_detected, listener_id = listener_id)
+                else:
+                    # Some other error, raise an internal error.
+                    self.returnCode(client = client, code = "InternalServerError", listener_detected = listener_detected, listener_id = listener_id)
+        else:
+            # Not authenticated
+            self.returnCode(client = client, code = "Refused", listener_detected = listener_detected, listener_id = listener_id)
+    
+    def reload_filter(self, client, val, listener_detected, listener_id):
+        # Check if the client is authenticated
+        if self.supporter.isAuthenticated(client):
+            FileCheck, FileRead, accountData = self.accounts.get_account(client, True, True)
+            if FileCheck and FileRead:
+                if accountData["lvl"] >= 3:
+                    version = self.loadFilter()
+                    self.log("{0} reloaded the profanity filter, now on version {1}", client, version)
+                    self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
+                else:
+                    self.returnCode(client = client, code = "MissingPermissions", listener_detected = listener_detected, listener_id = listener_id)
+            else:
+                if ((not FileCheck) and FileRead):
+                    # Account not found
+                    self.returnCode(client = client, code = "IDNotFound", listener_detected = listener_detected, listener_id = listener_id)
+                else:
+                    # Some other error, raise an internal error.
+                    self.returnCode(client = client, code = "InternalServerError", listener_detected = listener_detected, listener_id = listener_id)
+        else:
+            # Not authenticated
+            self.returnCode(client = client, code = "Refused", listener_detected = listener_detected, listener_id = listener_id)
+    
     def repair_mode(self, client, val, listener_detected, listener_id):
         # Check if the client is authenticated
         if self.supporter.isAuthenticated(client):
@@ -1216,7 +1324,7 @@ class Meower:
                     self.log("Enabling repair mode")
                     # Save repair mode status to database and memory
                     self.filesystem.write_item("config", "status", {"repair_mode": True, "is_deprecated": False})
-                    self.supporter.status = {"repair_mode": True, "is_deprecated": False}
+                    self.setStatus({"repair_mode": True, "is_deprecated": False})
                     # Tell client it enabled repair mode
                     self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
                     # Kick all online users
@@ -1251,7 +1359,7 @@ class Meower:
                         payload["isDeleted"] = True
                         result = self.filesystem.write_item("posts", val, payload)
                         if result:
-                            self.log("{0} deleting post {1}".format(client, val))
+                            self.log("{0} deleting post {1}", client, val)
 
                             # Relay post deletion to clients
                             self.sendPacket({"cmd": "direct", "val": {"mode": "delete", "id": val}})
@@ -1268,7 +1376,7 @@ class Meower:
                                     payload["isDeleted"] = True
                                     result = self.filesystem.write_item("posts", val, payload)
                                     if result:
-                                        self.log("{0} deleting post {1}".format(client, val))
+                                        self.log("{0} deleting post {1}", client, val)
 
                                         # Relay post deletion to clients
                                         self.sendPacket({"cmd": "direct", "val": {"mode": "delete", "id": val}})
@@ -1315,8 +1423,10 @@ class Meower:
                 if not len(val) > 20:
                     val = self.supporter.wordfilter(val)
                     if not self.filesystem.does_item_exist("chats", val):
-                        result = self.filesystem.create_item("chats", str(uuid.uuid4()), {"nickname": val, "owner": client, "members": [client]})
+                        chatid = str(uuid.uuid4())
+                        result = self.filesystem.create_item("chats", chatid, {"nickname": val, "owner": client, "members": [client]})
                         if result:
+                            self.chats.add_member(chatid, client)
                             self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
                         else:
                             # Some other error, raise an internal error.
@@ -1344,9 +1454,8 @@ class Meower:
                             if client in payload["members"]:
                                 if payload["owner"] == client:
                                     result = self.filesystem.delete_item("chats", val)
-                                    for member in payload["members"]:
-                                        if member in self.cl.getUsernames():
-                                            self.sendPacket({"cmd": "direct", "val": {"mode": "delete", "id": payload["_id"]}, "id": member})
+                                    self.sendToChat(val, {"mode": "delete", "id": payload["_id"]})
+                                    self.updateChatIndex("delete", val)
                                     if result:
                                         self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
                                     else:
@@ -1355,6 +1464,7 @@ class Meower:
                                     payload["members"].remove(client)
                                     result = self.filesystem.write_item("chats", val, payload)
                                     if result:
+                                        self.updateChatIndex("remove", val, client)
                                         self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
                                     else:
                                         self.returnCode(client = client, code = "InternalServerError", listener_detected = listener_detected, listener_id = listener_id)
@@ -1483,8 +1593,8 @@ class Meower:
         state = int(val["state"])
         chatid = val["chatid"]
 
-        # Some messy permission checking
-        if chatid == "livechat":
+        # Some messy permission checking (the chat is only loaded if the index doesn't know the user is in it)
+        if (chatid == "livechat") or self.chats.is_member(chatid, client):
             pass
         else:
             FileRead, chatdata = self.filesystem.load_item("chats", chatid)
@@ -1505,13 +1615,13 @@ class Meower:
         post_w_metadata["u"] = str(client)
         post_w_metadata["chatid"] = str(chatid)
         
-        self.log("{0} modifying {1} state to {2}".format(client, chatid, state))
+        self.log("{0} modifying {1} state to {2}", client, chatid, state, level=DEBUG)
 
+        # Chat states are cosmetic, so they are the first thing skipped for clients that are falling behind
         if chatid == "livechat":
-            self.sendPacket({"cmd": "direct", "val": post_w_metadata})
+            self.sendPacket({"cmd": "direct", "val": post_w_metadata}, droppable = True)
         else:
-            for member in chatdata["members"]:
-                self.sendPacket({"cmd": "direct", "val": post_w_metadata, "id": member})
+            self.sendToChat(chatid, post_w_metadata, droppable = True)
         
         # Tell client message was sent
         self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
@@ -1535,9 +1645,13 @@ class Meower:
                             else:
                                 self.returnCode(client = client, code = "InternalServerError", listener_detected = listener_detected, listener_id = listener_id)
                         else:
-                            result, chat_data = self.filesystem.load_item("chats", chatid)
+                            # The chat is only loaded if the index doesn't know the user is in it
+                            result = member = self.chats.is_member(chatid, client)
+                            if not member:
+                                result, chat_data = self.filesystem.load_item("chats", chatid)
+                                member = result and (client in chat_data["members"])
                             if result:
-                                if client in chat_data["members"]:
+                                if member:
                                     result = self.createPost(post_origin=chatid, user=client, content=post)
                                     if result:
                                         self.returnCode(client = client, code = "OK", listener_detected = listener_detected, listener_id = listener_id)
@@ -1580,6 +1694,8 @@ class Meower:
                                 FileWrite = self.filesystem.write_item("chats", chatid, chatdata)
 
                                 if FileWrite:
+                                    self.updateChatIndex("add", chatid, username)
+
                                     # Inbox message to say the user was added to the group chat
                                     self.createPost("inbox", username, "You have been added to the group chat '{0}' by @{1}!".format(chatdata["nickname"], client))
 
@@ -1623,6 +1739,8 @@ class Meower:
                                 result = self.filesystem.write_item("chats", chatid, chatdata)
 
                                 if result:
+                                    self.updateChatIndex("remove", chatid, username)
+
                                     # Inbox message to say the user was removed from the group chat
                                     self.createPost("inbox", username, "You have been removed from the group chat '{0}' by @{1}!".format(chatdata["nickname"], client))
 
@@ -1728,12 +1846,12 @@ class Meower:
                     for chat in chat_index:
                         if chat["owner"] == client:
                             self.filesystem.delete_item("chats", chat["_id"])
-                            for member in chat["members"]:
-                                if member in self.cl.getUsernames():
-                                    self.sendPacket({"cmd": "direct", "val": {"mode": "delete", "id": chat["_id"]}, "id": member})
+                            self.sendToChat(chat["_id"], {"mode": "delete", "id": chat["_id"]})
+                            self.updateChatIndex("delete", chat["_id"])
                         else:
                             chat["members"].remove(client)
                             self.filesystem.write_item("chats", chat["_id"], chat)
+                            self.updateChatIndex("remove", chat["_id"], client)
                     netlog_index = self.getIndex(location="netlog", query={"users": {"$all": [client]}}, truncate=False)["index"]
                     for ip in netlog_index:
                         ip["users"].remove(client)
@@ -0,0 +1,114 @@
+import threading
+import time
+
+"""
+
+Meower Metrics Module
+
+This module provides per-command telemetry for the packet handlers: how often each command ran,
+how often it raised, a latency histogram, and the bytes it received and sent. Main.handle_packet
+wraps every dispatched command with start()/finish(), and CloudLink reports the size of every
+message it queues through add_bytes_out(), which is counted against the command running on that
+thread. Use the module-level `metrics` object.
+
+Recording a command costs two perf_counter() calls and one short lock.
+
+"""
+
+# Histogram bucket upper bounds in seconds, the last bucket takes everything slower
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+class CommandMetrics:
+    __slots__ = ("count", "errors", "total_time", "max_time", "bytes_in", "bytes_out", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0
+        self.max_time = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def percentile(self, fraction): # Estimated from the histogram, returns the upper bound of the bucket (in seconds)
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if (seen >= rank) and (count > 0):
+                if i < len(BUCKETS):
+                    return BUCKETS[i]
+                return self.max_time
+        return 0
+
+    def to_dict(self):
+        histogram = {}
+        for i, count in enumerate(self.buckets):
+            if i < len(BUCKETS):
+                histogram["<={0}ms".format(BUCKETS[i] * 1000)] = count
+            else:
+                histogram[">{0}ms".format(BUCKETS[-1] * 1000)] = count
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": (self.total_time / self.count) * 1000 if self.count > 0 else 0,
+            "max_ms": self.max_time * 1000,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p90_ms": self.percentile(0.9) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "histogram": histogram
+        }
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {} # Command -> CommandMetrics
+        self.local = threading.local() # The command running on each thread, and the bytes it has sent
+        self.started = time.time()
+
+    def start(self, command): # Marks a command as running on this thread, returns the start time for finish()
+        self.local.command = command
+        self.local.bytes_out = 0
+        return time.perf_counter()
+
+    def add_bytes_out(self, size): # Counts an outgoing message against the command running on this thread, if any
+        if not getattr(self.local, "command", None) == None:
+            self.local.bytes_out += size
+
+    def finish(self, command, start, error=False, bytes_in=0):
+        elapsed = time.perf_counter() - start
+        bytes_out = getattr(self.local, "bytes_out", 0)
+        self.local.command = None
+        bucket = 0
+        while (bucket < len(BUCKETS)) and (elapsed > BUCKETS[bucket]):
+            bucket += 1
+        with self.lock:
+            stats = self.commands.get(command)
+            if stats == None:
+                stats = self.commands[command] = CommandMetrics()
+            stats.count += 1
+            if error:
+                stats.errors += 1
+            stats.total_time += elapsed
+            if elapsed > stats.max_time:
+                stats.max_time = elapsed
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.buckets[bucket] += 1
+
+    def snapshot(self): # Returns every command's metrics as plain data, busiest (by total time) first
+        with self.lock:
+            commands = sorted(self.commands.items(), key=lambda item: item[1].total_time, reverse=True)
+            return {
+                "uptime": time.time() - self.started,
+                "commands": {command: stats.to_dict() for command, stats in commands}
+            }
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+            self.started = time.time()
+
+metrics = Metrics()
@@ -0,0 +1,228 @@
+import struct
+
+try:
+    import msgpack as _msgpack # Optional C implementation, much faster than the pure Python one below
+except ImportError:
+    _msgpack = None
+
+"""
+
+CloudLink MessagePack Module
+
+This module provides a small MessagePack (https://msgpack.org/) encoder and decoder for the
+types CloudLink packets use: None, bool, int, float, str, bytes, list/tuple and dict. Clients
+that negotiate the "msgpack" encoding get binary frames in this format instead of JSON text.
+If the msgpack package is installed it is used instead, producing the same bytes.
+
+"""
+
+class PackError(ValueError):
+    pass
+
+_pack_double = struct.Struct(">Bd").pack
+_unpack_from = struct.unpack_from
+
+def packb(obj): # Encodes an object into MessagePack bytes
+    if not _msgpack == None:
+        try:
+            return _msgpack.packb(obj, use_bin_type=True)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise PackError(str(e))
+    out = []
+    _pack(obj, out.append)
+    return b"".join(out)
+
+def _pack(obj, write):
+    t = type(obj)
+    if t == str:
+        data = obj.encode("utf-8")
+        length = len(data)
+        if length < 32:
+            write(bytes((0xa0 | length,)))
+        elif length < 0x100:
+            write(bytes((0xd9, length)))
+        elif length < 0x10000:
+            write(struct.pack(">BH", 0xda, length))
+        else:
+            write(struct.pack(">BI", 0xdb, length))
+        write(data)
+    elif t == dict:
+        length = len(obj)
+        if length < 16:
+            write(bytes((0x80 | length,)))
+        elif length < 0x10000:
+            write(struct.pack(">BH", 0xde, length))
+        else:
+            write(struct.pack(">BI", 0xdf, length))
+        for key, value in obj.items():
+            _pack(key, write)
+            _pack(value, write)
+    elif (t == list) or (t == tuple):
+        length = len(obj)
+        if length < 16:
+            write(bytes((0x90 | length,)))
+        elif length < 0x10000:
+            write(struct.pack(">BH", 0xdc, length))
+        else:
+            write(struct.pack(">BI", 0xdd, length))
+        for value in obj:
+            _pack(value, write)
+    elif obj == None:
+        write(b"\xc0")
+    elif t == bool:
+        write(b"\xc3" if obj else b"\xc2")
+    elif t == int:
+        if 0 <= obj < 0x80:
+            write(bytes((obj,)))
+        elif -32 <= obj < 0:
+            write(bytes((obj & 0xff,)))
+        elif 0 <= obj < 0x100:
+            write(bytes((0xcc, obj)))
+        elif 0 <= obj < 0x10000:
+            write(struct.pack(">BH", 0xcd, obj))
+        elif 0 <= obj < 0x100000000:
+            write(struct.pack(">BI", 0xce, obj))
+        elif 0 <= obj < 0x10000000000000000:
+            write(struct.pack(">BQ", 0xcf, obj))
+        elif -0x80 <= obj < 0:
+            write(struct.pack(">Bb", 0xd0, obj))
+        elif -0x8000 <= obj < 0:
+            write(struct.pack(">Bh", 0xd1, obj))
+        elif -0x80000000 <= obj < 0:
+            write(struct.pack(">Bi", 0xd2, obj))
+        elif -0x8000000000000000 <= obj < 0:
+            write(struct.pack(">Bq", 0xd3, obj))
+        else:
+            raise PackError("Integer out of range: {0}".format(obj))
+    elif t == float:
+        write(_pack_double(0xcb, obj))
+    elif (t == bytes) or (t == bytearray):
+        length = len(obj)
+        if length < 0x100:
+            write(bytes((0xc4, length)))
+        elif length < 0x10000:
+            write(struct.pack(">BH", 0xc5, length))
+        else:
+            write(struct.pack(">BI", 0xc6, length))
+        write(bytes(obj))
+    else:
+        raise PackError("Can't encode type {0}".format(t))
+
+def unpackb(data): # Decodes MessagePack bytes, raises PackError on malformed or trailing data
+    if not _msgpack == None:
+        try:
+            return _msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except Exception as e:
+            raise PackError(str(e))
+    try:
+        obj, offset = _unpack(data, 0)
+    except (IndexError, struct.error, UnicodeDecodeError, TypeError, RecursionError):
+        raise PackError("Malformed MessagePack data")
+    if not offset == len(data):
+        raise PackError("Trailing data after MessagePack object")
+    return obj
+
+def _unpack(data, offset): # Returns (object, offset of the next byte)
+    b = data[offset]
+    offset += 1
+    if b <= 0x7f:
+        return b, offset
+    elif 0xa0 <= b <= 0xbf:
+        end = offset + (b & 0x1f)
+        return _str(data, offset, end), end
+    elif 0x80 <= b <= 0x8f:
+        return _map(data, offset, b & 0x0f)
+    elif 0x90 <= b <= 0x9f:
+        return _array(data, offset, b & 0x0f)
+    elif b >= 0xe0:
+        return b - 0x100, offset
+    elif b == 0xc0:
+        return None, offset
+    elif b == 0xc2:
+        return False, offset
+    elif b == 0xc3:
+        return True, offset
+    elif b == 0xcc:
+        return data[offset], offset + 1
+    elif b == 0xcd:
+        return _unpack_from(">H", data, offset)[0], offset + 2
+    elif b == 0xce:
+        return _unpack_from(">I", data, offset)[0], offset + 4
+    elif b == 0xcf:
+        return _unpack_from(">Q", data, offset)[0], offset + 8
+    elif b == 0xd0:
+        return _unpack_from(">b", data, offset)[0], offset + 1
+    elif b == 0xd1:
+        return _unpack_from(">h", data, offset)[0], offset + 2
+    elif b == 0xd2:
+        return _unpack_from(">i", data, offset)[0], offset + 4
+    elif b == 0xd3:
+        return _unpack_from(">q", data, offset)[0], offset + 8
+    elif b == 0xca:
+        return _unpack_from(">f", data, offset)[0], offset + 4
+    elif b == 0xcb:
+        return _unpack_from(">d", data, offset)[0], offset + 8
+    elif b == 0xd9:
+        start = offset + 1
+        end = start + data[offset]
+        return _str(data, start, end), end
+    elif b == 0xda:
+        start = offset + 2
+        end = start + _unpack_from(">H", data, offset)[0]
+        return _str(data, start, end), end
+    elif b == 0xdb:
+        start = offset + 4
+        end = start + _unpack_from(">I", data, offset)[0]
+        return _str(data, start, end), end
+    elif b == 0xc4:
+        start = offset + 1
+        end = start + data[offset]
+        return _bin(data, start, end), end
+    elif b == 0xc5:
+        start = offset + 2
+        end = start + _unpack_from(">H", data, offset)[0]
+        return _bin(data, start, end), end
+    elif b == 0xc6:
+        start = offset + 4
+        end = start + _unpack_from(">I", data, offset)[0]
+        return _bin(data, start, end), end
+    elif b == 0xdc:
+        return _array(data, offset + 2, _unpack_from(">H", data, offset)[0])
+    elif b == 0xdd:
+        return _array(data, offset + 4, _unpack_from(">I", data, offset)[0])
+    elif b == 0xde:
+        return _map(data, offset + 2, _unpack_from(">H", data, offset)[0])
+    elif b == 0xdf:
+        return _map(data, offset + 4, _unpack_from(">I", data, offset)[0])
+    else:
+        # Extension types (0xc7-0xc9, 0xd4-0xd8) and the unused 0xc1
+        raise PackError("Unsupported MessagePack type 0x{0:02x}".format(b))
+
+def _str(data, start, end):
+    if end > len(data):
+        raise IndexError()
+    return str(data[start:end], "utf-8")
+
+def _bin(data, start, end):
+    if end > len(data):
+        raise IndexError()
+    return bytes(data[start:end])
+
+def _array(data, offset, length):
+    if length > len(data) - offset:
+        raise IndexError() # Every element takes at least one byte
+    items = []
+    for i in range(length):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+def _map(data, offset, length):
+    if length * 2 > len(data) - offset:
+        raise IndexError()
+    items = {}
+    for i in range(length):
+        key, offset = _unpack(data, offset)
+        value, offset = _unpack(data, offset)
+        items[key] = value
+    return items, offset
@@ -0,0 +1,162 @@
+import threading
+import time
+
+"""
+
+CloudLink Presence Module
+
+This module provides the presence directory, which maps each online username to the node (server
+process) its connection lives on, and the packet router, which uses it to forward
+username-addressed packets to other nodes in batches.
+
+The directory stores its entries in a backend. MemoryBackend keeps them in this process, which is
+all a single node needs. In supervisor mode it also serves as each worker's view of the other
+workers, which the bus keeps up to date. SharedBackend is the interface for a store shared by
+every node (e.g. a Redis hash), so nodes on different hosts can find each other's users.
+LocalSharedBackend is a stand-in for one: instances created with the same namespace share their
+entries within a process.
+
+"""
+
+class MemoryBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {} # Username -> node
+
+    def get(self, username):
+        return self.entries.get(username)
+
+    def set(self, username, node):
+        with self.lock:
+            self.entries[username] = node
+
+    def delete(self, username, node): # Removes the entry only if it still points at the node, returns True if it did
+        with self.lock:
+            if (username in self.entries) and (self.entries[username] == node):
+                del self.entries[username]
+                return True
+            return False
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+class SharedBackend(MemoryBackend):
+    """
+    Interface for a presence store shared by every node: get(username), set(username, node),
+    delete(username, node) (only if the entry still points at the node, atomically) and items().
+    Subclasses replace all four; the inherited in-memory versions are not shared.
+    """
+    shared = True
+
+class LocalSharedBackend(SharedBackend): # Stand-in for a shared store, shared by instances with the same namespace in this process
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, namespace="cloudlink"):
+        with LocalSharedBackend._stores_lock:
+            if not namespace in LocalSharedBackend._stores:
+                LocalSharedBackend._stores[namespace] = (threading.Lock(), {})
+            self.lock, self.entries = LocalSharedBackend._stores[namespace]
+
+class PresenceDirectory:
+    def __init__(self, node="local", backend=None):
+        if backend == None:
+            backend = MemoryBackend()
+        self.node = node # This node's ID
+        self.backend = backend
+
+    def register(self, username, node=None): # Records that a user is connected to a node (this one by default)
+        if node == None:
+            node = self.node
+        self.backend.set(username, node)
+
+    def unregister(self, username, node=None): # Returns False if the user has since moved to another node
+        if node == None:
+            node = self.node
+        return self.backend.delete(username, node)
+
+    def lookup(self, username): # Returns the node a user is connected to, or None if they are offline
+        if not type(username) == str:
+            return None
+        return self.backend.get(username)
+
+    def is_remote(self, username): # Checks if a user is online on another node
+        node = self.backend.get(username)
+        return (not node == None) and (not node == self.node)
+
+    def remote_usernames(self):
+        return [username for username, node in self.backend.items() if not node == self.node]
+
+    def set_node(self, node, local_usernames=()): # Changes this node's ID, moving the given users to it
+        old = self.node
+        self.node = node
+        for username in local_usernames:
+            self.backend.delete(username, old)
+            self.backend.set(username, node)
+
+class PacketRouter:
+    def __init__(self, directory, transport, batch_size=64, flush_interval=0.002):
+        self.directory = directory
+        self.transport = transport # transport(node, messages), sends a batch to another node
+        self.batch_size = batch_size # A batch this big is sent right away
+        self.flush_interval = flush_interval # Seconds a smaller batch waits for more messages
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock() # Held from taking a batch until it is sent, so batches for a node go out in order
+        self.batches = {} # Node -> messages waiting to be sent
+        self.wakeup = threading.Event()
+        self.running = True
+        self.stats = {"messages": 0, "batches": 0}
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True, name="cloudlink-router")
+        self.thread.start()
+
+    def route(self, username, message): # Queues a message for the node the user is on, returns False if they aren't on another node
+        node = self.directory.lookup(username)
+        if (node == None) or (node == self.directory.node):
+            return False
+        with self.lock:
+            if not node in self.batches:
+                self.batches[node] = []
+            self.batches[node].append(message)
+            full = (len(self.batches[node]) >= self.batch_size)
+        if full:
+            self._flush_node(node)
+        else:
+            self.wakeup.set()
+        return True
+
+    def flush(self): # Sends every waiting batch
+        with self.send_lock:
+            with self.lock:
+                batches = self.batches
+                self.batches = {}
+            for node, messages in batches.items():
+                self._send(node, messages)
+
+    def _flush_node(self, node):
+        with self.send_lock:
+            with self.lock:
+                messages = self.batches.pop(node, [])
+            if len(messages) > 0:
+                self._send(node, messages)
+
+    def _send(self, node, messages):
+        with self.lock:
+            self.stats["messages"] += len(messages)
+            self.stats["batches"] += 1
+        self.transport(node, messages)
+
+    def _flush_loop(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if not self.running:
+                return
+            # Give the batch a moment to fill up
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        self.flush()
@@ -1,11 +1,23 @@
 from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from security import Security
 from supporter import Supporter
 from meower import Meower
 from files import Files
+from metrics import metrics
+from logger import DEBUG
+import codec
+
+class CodecJSONProvider(DefaultJSONProvider): # Serializes responses with the same JSON backend as CloudLink
+    def dumps(self, obj, **kwargs):
+        return codec.dumps(obj, default=self.default)
+
+    def loads(self, s, **kwargs):
+        return codec.loads(s)
 
 app = Flask(__name__, static_folder="static")
+app.json = CodecJSONProvider(app)
 cors = CORS(app, resources=r'*')
 
 # Init libraries
@@ -132,7 +144,7 @@ def get_mychat_posts(chatid):
         payload["error"] = False
         return payload, 200
     else:
-        supporter.log("Loaded index, data {0}".format(payload))
+        supporter.log("Loaded index, data {0}", payload, level=DEBUG)
         try:
             tmp_payload = {"error": False, "autoget": [], "page#": payload["page#"], "pages": payload["pages"]}
             tmp_payload["autoget"] = payload["index"]
@@ -154,7 +166,7 @@ def get_home():
             if (page > 1) and (request.user is None):
                 return {"error": True, "type": "Unauthorized"}, 401
             else:
-                supporter.log("{0} requested to get page {1} of home".format(request.user, page))
+                supporter.log("{0} requested to get page {1} of home", request.user, page, level=DEBUG)
         except:
             return {"error": True, "type": "Datatype"}, 500
 
@@ -183,7 +195,7 @@ def get_reports():
         return {"error": True, "type": "Unauthorized"}, 401
 
     payload = meower.getIndex(location="reports", query={}, truncate=True, page=page)
-    supporter.log("Loaded index, data {0}".format(payload))
+    supporter.log("Loaded index, data {0}", payload, level=DEBUG)
     try:
         tmp_payload = {"error": False, "autoget": [], "page#": payload["page#"], "pages": payload["pages"]}
         for item in payload["index"]:
@@ -232,7 +244,7 @@ def get_inbox():
         payload["error"] = False
         return payload, 200
     else:
-        supporter.log("Loaded index, data {0}".format(payload))
+        supporter.log("Loaded index, data {0}", payload, level=DEBUG)
         try:
             tmp_payload = {"error": False, "autoget": [], "page#": payload["page#"], "pages": payload["pages"]}
             tmp_payload["autoget"] = payload["index"]
@@ -272,7 +284,7 @@ def search_home():
         payload["error"] = False
         return payload, 200
     else:
-        supporter.log("Loaded index, data {0}".format(payload))
+        supporter.log("Loaded index, data {0}", payload, level=DEBUG)
         try:
             tmp_payload = {"error": False, "autoget": [], "page#": payload["page#"], "pages": payload["pages"]}
             tmp_payload["autoget"] = payload["index"]
@@ -312,7 +324,7 @@ def search_users():
         payload["error"] = False
         return payload, 200
     else:
-        supporter.log("Loaded index, data {0}".format(payload))
+        supporter.log("Loaded index, data {0}", payload, level=DEBUG)
         try:
             tmp_payload = {"error": False, "autoget": [], "page#": payload["page#"], "pages": payload["pages"]}
             for user in payload["index"]:
@@ -358,7 +370,7 @@ def get_user_posts(username):
         payload["error"] = False
         return payload, 200
     else:
-        supporter.log("Loaded index, data {0}".format(payload))
+        supporter.log("Loaded index, data {0}", payload, level=DEBUG)
         try:
             tmp_payload = {"error": False, "autoget": [], "page#": payload["page#"], "pages": payload["pages"]}
             tmp_payload["autoget"] = payload["index"]
@@ -385,6 +397,14 @@ def get_status():
     else:
         return {"error": True, "type": "Internal"}, 500
 
+@app.route('/metrics', methods=["GET"])
+def get_metrics():
+    if (request.user == None) or (request.lvl < 3):
+        return {"error": True, "type": "Unauthorized"}, 401
+    payload = metrics.snapshot()
+    payload["error"] = False
+    return payload, 200
+
 @app.errorhandler(405) # Method not allowed
 def not_allowed(e):
 	return {"error": True, "type": "methodNotAllowed"}, 405
@@ -1,6 +1,7 @@
 import bcrypt
 import time
 from uuid import uuid4
+from logger import DEBUG, ERROR
 
 """
 Meower Security Module
@@ -31,7 +32,7 @@ class Security:
         
         if (type(password) == str) and (type(username) == str):
             if not self.account_exists(str(username), ignore_case=True):
-                self.log("Creating account: {0}".format(username))
+                self.log("Creating account: {0}", username)
                 pswd_bytes = bytes(password, "utf-8") # Convert password to bytes
                 hashed_pw = self.bc.hashpw(pswd_bytes, self.bc.gensalt(strength)) # Hash and salt the password
                 result = self.files.create_item("usersv0", str(username), { # Default account data
@@ -58,10 +59,10 @@ class Security:
                 )
                 return True, result
             else:
-                self.log("Not creating account {0}: Account already exists".format(username))
+                self.log("Not creating account {0}: Account already exists", username)
                 return False, True
         else:
-            self.log("Error on generate_account: Expected str for username and password, got {0} for username and {1} for password".format(type(username), type(password)))
+            self.log("Error on generate_account: Expected str for username and password, got {0} for username and {1} for password", type(username), type(password), level=ERROR)
             return False, False
     
     def get_account(self, username, omitSensitive=False, isClient=False):
@@ -78,7 +79,7 @@ class Security:
         
         if type(username) == str:
             if self.files.does_item_exist("usersv0", str(username)):
-                self.log("Reading account: {0}".format(username))
+                self.log("Reading account: {0}", username, level=DEBUG)
                 result, accountData = self.files.load_item("usersv0", str(username))
                 
                 if omitSensitive: # Purge sensitive data and remove user settings
@@ -111,7 +112,7 @@ class Security:
             else:
                 return False, True, None
         else:
-            self.log("Error on get_account: Expected str for username, got {0}".format(type(username)))
+            self.log("Error on get_account: Expected str for username, got {0}", type(username), level=ERROR)
             return False, False, None
     
     def authenticate(self, username, password): 
@@ -129,14 +130,14 @@ class Security:
         
         if type(username) == str:
             if self.files.does_item_exist("usersv0", str(username)):
-                self.log("Authenticating account: {0}".format(username))
+                self.log("Authenticating account: {0}", username, level=DEBUG)
                 FileRead, accountData = self.files.load_item("usersv0", str(username))
                 if FileRead:
                     if type(accountData) == dict:
                         if accountData["banned"] == True:
                             return True, True, False, True
                         if password in accountData["tokens"]:
-                            self.log("Authenticating {0}: True".format(username))
+                            self.log("Authenticating {0}: True", username, level=DEBUG)
                             accountData["tokens"].remove(password)
                             self.update_setting(username, {"tokens": accountData["tokens"]}, forceUpdate=True)
                             return True, True, True, False
@@ -146,20 +147,20 @@ class Security:
                             hashed_pw_bytes = bytes(hashed_pw, "utf-8")
                             try:
                                 result = self.bc.checkpw(pswd_bytes, hashed_pw_bytes)
-                                self.log("Authenticating {0}: {1}".format(username, result))
+                                self.log("Authenticating {0}: {1}", username, result, level=DEBUG)
                                 return True, True, result, False
                             except Exception as e:
-                                self.log("Error on authenticate: {0}".format(e))
+                                self.log("Error on authenticate: {0}", e, level=ERROR)
                                 return True, True, False, False
                     else:
-                        self.log("Error on get_account: Expected str for username, got {0}".format(type(username)))
+                        self.log("Error on get_account: Expected str for username, got {0}", type(username), level=ERROR)
                         return False, False, False, False
                 else:
                     return True, False, False, False
             else:
                 return False, True, False, False
         else:
-            self.log("Error on get_account: Expected str for username, got {0}".format(type(username)))
+            self.log("Error on get_account: Expected str for username, got {0}", type(username), level=ERROR)
             return False, False, False, False
     
     def change_password(self, username, newpassword, strength=12):
@@ -176,7 +177,7 @@ class Security:
         
         if (type(username) == str) and (type(newpassword) == str):
             if self.files.does_item_exist("usersv0", str(username)):
-                self.log("Changing {0} password".format(username))
+                self.log("Changing {0} password", username)
                 result, accountData = self.files.load_item("usersv0", str(username))
                 if result:
                     try:
@@ -186,17 +187,17 @@ class Security:
                         accountData["pswd"] = hashed_pw.decode()
                         
                         result = self.files.write_item("usersv0", str(username), accountData)
-                        self.log("Change {0} password: {1}".format(username, result))
+                        self.log("Change {0} password: {1}", username, result)
                         return True, True, result
                     except Exception as e:
-                        self.log("Error on authenticate: {0}".format(e))
+                        self.log("Error on authenticate: {0}", e, level=ERROR)
                         return True, True, False
                 else:
                     return True, False, False
             else:
                 return False, True, False
         else:
-            self.log("Error on get_account: Expected str for username, oldpassword and newpassword, got {0} for username and {1} for newpassword".format(type(username), type(newpassword)))
+            self.log("Error on get_account: Expected str for username, oldpassword and newpassword, got {0} for username and {1} for newpassword", type(username), type(newpassword), level=ERROR)
             return False, False, False
     
     def account_exists(self, username, ignore_case=False):
@@ -210,7 +211,7 @@ class Security:
             else:
                 return self.files.does_item_exist("usersv0", str(username))
         else:
-            self.log("Error on account_exists: Expected str for username, got {0}".format(type(username)))
+            self.log("Error on account_exists: Expected str for username, got {0}", type(username), level=ERROR)
             return False
     
     def is_account_banned(self, username):
@@ -228,13 +229,13 @@ class Security:
         
         if type(username) == str:
             if self.files.does_item_exist("usersv0", str(username)):
-                self.log("Reading account: {0}".format(username))
+                self.log("Reading account: {0}", username, level=DEBUG)
                 result, accountData = self.files.load_item("usersv0", str(username))
                 return True, result, accountData["banned"]
             else:
                 return False, True, None
         else:
-            self.log("Error on get_account: Expected str for username, got {0}".format(type(username)))
+            self.log("Error on get_account: Expected str for username, got {0}", type(username), level=ERROR)
             return False, False, None
     
     def update_setting(self, username, newdata, forceUpdate=False):
@@ -252,7 +253,7 @@ class Security:
         
         if (type(username) == str) and (type(newdata) == dict):
             if self.files.does_item_exist("usersv0", str(username)):
-                self.log("Updating account settings: {0}".format(username))
+                self.log("Updating account settings: {0}", username, level=DEBUG)
                 result, accountData = self.files.load_item("usersv0", str(username))
                 if result:
                     for key, value in newdata.items():
@@ -268,17 +269,17 @@ class Security:
                                             else:
                                                 accountData[key] = value
                                 else:
-                                    self.log("Blocking attempt to modify secure key {0}".format(key))
+                                    self.log("Blocking attempt to modify secure key {0}", key)
                     
                     result = self.files.write_item("usersv0", str(username), accountData)
-                    self.log("Updating {0} account settings: {1}".format(username, result))
+                    self.log("Updating {0} account settings: {1}", username, result, level=DEBUG)
                     return True, True, result
                 else:
                     return True, False, False
             else:
                 return False, True, False
         else:
-            self.log("Error on get_account: Expected str for username and dict for newdata, got {0} for username and {1} for newdata".format(type(username), type(newdata)))
+            self.log("Error on get_account: Expected str for username and dict for newdata, got {0} for username and {1} for newdata", type(username), type(newdata), level=ERROR)
             return False, False, False
 
     def delete_account(self, username):
@@ -295,7 +296,7 @@ class Security:
 
         if type(username) == str:
             if self.files.does_item_exist("usersv0", str(username)):
-                self.log("Deleting account: {0}".format(username))
+                self.log("Deleting account: {0}", username)
                 # Delete userdata
                 self.files.delete_item("usersv0", str(username))
                 # Delete group chats
@@ -320,5 +321,5 @@ class Security:
             else:
                 return False, False
         else:
-            self.log("Error on delete_account: Expected str for username, got {0} for username".format(type(username)))
+            self.log("Error on delete_account: Expected str for username, got {0} for username", type(username), level=ERROR)
             return False, False
@@ -0,0 +1,101 @@
+import os
+import signal
+import tempfile
+import time
+import traceback
+from bus import BusHub
+from logger import logger, DEBUG, INFO, WARNING, ERROR
+
+"""
+
+CloudLink Supervisor Module
+
+This module provides the supervisor mode: the supervisor forks a number of worker processes
+that each run a CloudLink server on the same port (SO_REUSEPORT, so the kernel spreads new
+connections between them), and runs the bus that links them. Workers that exit are started
+again. The supervisor process itself does not accept websocket connections, so it is free to
+run other things (Meower runs the REST API there).
+
+Forking needs a Unix-like OS, and sharing the port needs the asyncio engine.
+
+"""
+
+class Supervisor:
+    def __init__(self, processes=2, bus_path=None, restart_delay=1, debug=False):
+        if bus_path == None:
+            bus_path = os.path.join(tempfile.gettempdir(), "cloudlink-bus-{0}.sock".format(os.getpid()))
+        self.processes = processes
+        self.restart_delay = restart_delay # Seconds to wait before restarting a worker that exited
+        self.debug = debug
+        self.hub = BusHub(bus_path, debug=debug)
+        self.children = {} # PID -> worker index
+        self.running = False
+
+    def run(self, worker, on_started=None): # Runs until SIGINT/SIGTERM, worker(index, bus_path) runs in each worker process
+        self.running = True
+        self.hub.start()
+        signal.signal(signal.SIGTERM, self._on_signal)
+        try:
+            for index in range(self.processes):
+                self._fork(worker, index)
+            logger.log(INFO, "Supervisor started {0} workers", self.processes)
+            if not on_started == None:
+                on_started()
+            while self.running:
+                self.hub.poll(0.5)
+                self._reap(worker)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _on_signal(self, signum, frame):
+        self.running = False
+
+    def _fork(self, worker, index):
+        pid = os.fork()
+        if pid == 0:
+            # Worker process, never returns into the supervisor's code
+            status = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self.hub.detach()
+                worker(index, self.hub.path)
+            except BaseException:
+                logger.log(ERROR, "Worker {0} crashed: {1}", index, traceback.format_exc().rstrip())
+                status = 1
+            finally:
+                logger.flush() # os._exit skips atexit, so the worker's queued log messages are written here
+                os._exit(status)
+        self.children[pid] = index
+        if self.debug:
+            logger.log(DEBUG, "Started worker {0} (PID {1})", index, pid)
+
+    def _reap(self, worker): # Restarts workers that exited
+        while len(self.children) > 0:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            if index == None:
+                continue
+            logger.log(INFO if status == 0 else WARNING, "Worker {0} (PID {1}) exited with status {2}", index, pid, status)
+            if self.running:
+                time.sleep(self.restart_delay)
+                self._fork(worker, index)
+
+    def stop(self): # Stops the workers and closes the bus
+        self.running = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children = {}
+        self.hub.close()
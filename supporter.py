@@ -1,10 +1,14 @@
+from collections import OrderedDict
 from datetime import datetime
-from better_profanity import profanity
+from better_profanity import Profanity
 import time
 import traceback
 import sys
 import string
-from threading import Thread
+from threading import Thread, Lock
+from cloudlink import Packet
+from chats import OnlineChatIndex
+from logger import logger, DEBUG, INFO, ERROR
 
 """
 
@@ -15,9 +19,53 @@ This keeps the main.py clean and more understandable.
 
 """
 
+class WordFilter:
+    # A profanity filter compiled from one version of the config.filter whitelist and blacklist.
+    # It is never changed after it's built, so every handler thread can censor with it at once;
+    # Supporter.set_filter swaps in a new one instead.
+    def __init__(self, filter=None, version=0):
+        self.filter = filter
+        self.version = version
+        if filter == None:
+            self.passes = [self._compile()]
+        else:
+            # Same two passes as before: the default word list without the whitelisted words,
+            # then the blacklist without them (the default word list again if the blacklist is empty)
+            whitelist = list(filter["whitelist"]) # Copied, Profanity lowercases it in place
+            self.passes = [
+                self._compile(whitelist_words=whitelist),
+                self._compile(custom_words=filter["blacklist"], whitelist_words=whitelist)
+            ]
+    
+    def _compile(self, **kwargs):
+        words = Profanity()
+        if len(kwargs) > 0:
+            words.load_censor_words(**kwargs)
+        if not words.CENSOR_WORDSET:
+            # Profanity.censor would load the default word list into an empty filter on first use
+            words.load_censor_words()
+        return words
+    
+    def censor(self, message):
+        for words in self.passes:
+            message = words.censor(message)
+        return message
+    
+    def censor_many(self, messages):
+        for words in self.passes:
+            messages = words.censor_many(messages)
+        return messages
+
 class Supporter:
     def __init__(self, cl=None, packet_callback=None):
         self.filter = None
+        self.filter_lock = Lock()
+        self.word_filter = WordFilter() # The default filter, until Meower loads the one in the config
+        self.wordfilter_cache = OrderedDict() # (Filter version, message) -> censored message, least recently used first
+        self.wordfilter_cache_size = 4096 # Most messages kept in the cache, 0 disables it
+        self.wordfilter_cache_lock = Lock()
+        self.wordfilter_hits = 0
+        self.wordfilter_misses = 0
         self.last_packet = {}
         self.burst_amount = {}
         self.ratelimits = {}
@@ -25,10 +73,8 @@ class Supporter:
         self.known_vpns = []
         self.status = {"repair_mode": True, "is_deprecated": False}
         self.cl = cl
-        self.profanity = profanity
         self.packet_handler = packet_callback
-        self.listener_detected = False
-        self.listener_id = None
+        self.chats = OnlineChatIndex() # Group chats -> members online here
         
         if not self.cl == None:
             # Add custom status codes to CloudLink
@@ -79,6 +125,9 @@ class Supporter:
             self.cl.callback("on_packet", self.on_packet)
             self.cl.callback("on_close", self.on_close)
             self.cl.callback("on_connect", self.on_connect)
+            
+            # Refuse connections during repair mode before CloudLink does any work for them
+            self.cl.admission.check = self.admission_check
         
         self.log("Supporter initialized!")
     
@@ -95,17 +144,17 @@ class Supporter:
             stackstr += '  ' + traceback.format_exc().lstrip(trc)
         return stackstr
     
-    def log(self, event):
-        print("{0}: {1}".format(self.timestamp(4), event))
+    def log(self, event, *args, level=INFO, sample=None): # Queues a message for the log writer, args are formatted into it only if it is written
+        logger.log(level, event, *args, sample=sample)
     
-    def sendPacket(self, payload, listener_detected=False, listener_id=None):
+    def sendPacket(self, payload, listener_detected=False, listener_id=None, droppable=False):
         if not self.cl == None:
             if listener_detected:
                 if "id" in payload:
                     payload["listener"] = listener_id
-                self.cl.sendPacket(payload)
+                self.cl.sendPacket(payload, droppable)
             else:
-                self.cl.sendPacket(payload)
+                self.cl.sendPacket(payload, droppable)
     
     def get_client_statedata(self, client): # "steals" information from the CloudLink module to get better client data
         if not self.cl == None:
@@ -128,7 +177,7 @@ class Supporter:
                         self.cl.statedata["ulist"]["objs"][client['id']][key] = newvalue
                         return True
                     except:
-                        self.log("{0}".format(self.full_stack()))
+                        self.log(self.full_stack(), level=ERROR)
                         return False
                 else:
                     return False
@@ -144,7 +193,7 @@ class Supporter:
                             del self.cl.statedata["ulist"]["objs"][client['id']][key]
                             return True
                         except:
-                            self.log("{0}".format(self.full_stack()))
+                            self.log(self.full_stack(), level=ERROR)
                             return False
                 else:
                     return False
@@ -158,7 +207,7 @@ class Supporter:
                     "count": current_users,
                     "timestamp": self.timestamp(1)
                 }
-                self.log("New peak in # of concurrent users: {0}".format(current_users))
+                self.log("New peak in # of concurrent users: {0}", current_users)
                 #self.create_system_message("Yay! New peak in # of concurrent users: {0}".format(current_users))
                 payload = {
                     "mode": "peak",
@@ -169,52 +218,46 @@ class Supporter:
     def on_close(self, client):
         if not self.cl == None:
             if type(client) == dict:
-                self.log("{0} Disconnected.".format(client["id"]))
+                self.log("{0} Disconnected.", client["id"])
+                username = self.cl._get_username_of_obj(client)
+                if not username == "":
+                    self.chats.remove_user(username, client["id"])
             elif type(client) == str:
-                self.log("{0} Logged out.".format(self.cl._get_username_of_obj(client)))
+                self.log("{0} Logged out.", self.cl._get_username_of_obj(client))
             self.log_peak_users()
     
+    def admission_check(self, ip):
+        if self.status["repair_mode"]:
+            return "repair_mode"
+        return None
+    
     def on_connect(self, client):
         if not self.cl == None:
             if self.status["repair_mode"]:
-                self.log("Refusing connection from {0} due to repair mode being enabled".format(client["id"]))
+                self.log("Refusing connection from {0} due to repair mode being enabled", client["id"])
                 self.cl.kickClient(client)
             else:
-                self.log("{0} Connected.".format(client["id"]))
+                self.log("{0} Connected.", client["id"])
                 self.modify_client_statedata(client, "authtype", "")
                 self.modify_client_statedata(client, "authed", False)
                 
                 # Rate limiter
                 self.modify_client_statedata(client, "last_packet", 0)
     
-    def on_packet(self, message):
+    def on_packet(self, packet):
         if not self.cl == None:
-            # CL Turbo Support
-            self.listener_detected = ("listener" in message)
-            self.listener_id = None
-            
-            if self.listener_detected:
-                self.listener_id = message["listener"]
-            
-            # Read packet contents
-            id = message["id"]
-            val = message["val"]
-            clienttype = None
-            client = message["id"]
-            if type(message["id"]) == dict:
-                ip = self.cl.getIPofObject(client)
-                clienttype = 0
-            elif type(message["id"]) == str:
-                ip = self.cl.getIPofUsername(client)
-                clienttype = 1
+            if type(packet) == dict:
+                # Plain packet dicts (older CloudLink versions) get wrapped, looking up the IP like before
+                client = packet["id"]
+                if type(client) == dict:
+                    ip = self.cl.getIPofObject(client)
+                else:
+                    ip = self.cl.getIPofUsername(client)
+                packet = Packet.from_dict(packet, ip=ip)
             
             # Handle packet
-            cmd = None
-            if "cmd" in message:    
-                cmd = message["cmd"]
-            
             if not self.packet_handler == None:
-                self.packet_handler(cmd, ip, val, self.listener_detected, self.listener_id, client, clienttype)
+                self.packet_handler(packet)
     
     def timestamp(self, ttype):
         today = datetime.now()
@@ -241,18 +284,46 @@ class Supporter:
         # Rate limiter
         self.modify_client_statedata(client, "last_packet", int(time.time()))
     
+    def set_filter(self, filter): # Compiles a config.filter ({"whitelist": [...], "blacklist": [...]}, or None for the default filter) and swaps it in
+        with self.filter_lock:
+            word_filter = WordFilter(filter, self.word_filter.version + 1)
+            self.filter = filter
+            self.word_filter = word_filter
+        return word_filter.version
+    
     def wordfilter(self, message):
-        # Word censor
-        if self.filter != None:
-            self.profanity.load_censor_words(whitelist_words=self.filter["whitelist"])
-            message = self.profanity.censor(message)
-            self.profanity.load_censor_words(whitelist_words=self.filter["whitelist"], custom_words=self.filter["blacklist"])
-            message = self.profanity.censor(message)
-        else:
-            self.log("Failed loading profanity filter : Using default filter as fallback")
-            self.profanity.load_censor_words()
-            message = self.profanity.censor(message)
-        return message
+        # Word censor, with the filter compiled by set_filter. Floods and copy-pasted posts repeat
+        # the same text, so recent results are kept; the filter version in the key means results
+        # from an older filter are never used, they just fall out of the cache.
+        word_filter = self.word_filter
+        if (self.wordfilter_cache_size <= 0) or (not type(message) == str):
+            return word_filter.censor(message)
+        key = (word_filter.version, message)
+        with self.wordfilter_cache_lock:
+            censored = self.wordfilter_cache.get(key)
+            if not censored == None:
+                self.wordfilter_cache.move_to_end(key)
+                self.wordfilter_hits += 1
+                return censored
+            self.wordfilter_misses += 1
+        censored = word_filter.censor(message)
+        with self.wordfilter_cache_lock:
+            self.wordfilter_cache[key] = censored
+            while len(self.wordfilter_cache) > self.wordfilter_cache_size:
+                self.wordfilter_cache.popitem(last=False)
+        return censored
+    
+    def get_wordfilter_stats(self): # Returns the wordfilter cache's hit rate, for tuning wordfilter_cache_size
+        with self.wordfilter_cache_lock:
+            lookups = self.wordfilter_hits + self.wordfilter_misses
+            return {
+                "filter_version": self.word_filter.version,
+                "cache_size": self.wordfilter_cache_size,
+                "cached": len(self.wordfilter_cache),
+                "hits": self.wordfilter_hits,
+                "misses": self.wordfilter_misses,
+                "hit_rate": self.wordfilter_hits / lookups if lookups > 0 else 0
+            }
     
     def isAuthenticated(self, client):
         if not self.cl == None:
@@ -285,14 +356,17 @@ class Supporter:
         if not self.cl == None:
             # really janky code that automatically sets user ID
             self.modify_client_statedata(client, "username", username)
-            self.cl.statedata["ulist"]["usernames"][username] = client["id"]
-            self.sendPacket({"cmd": "ulist", "val": self.cl._get_ulist()})
-            self.log("{0} autoID given".format(username))
+            self.cl._add_username(username, client)
+            self.log("{0} autoID given", username, level=DEBUG)
     
     def kickUser(self, username, status="Kicked"):
         if not self.cl == None:
-            if username in self.cl.getUsernames():
-                self.log("Kicking {0}".format(username))
+            if (not username in self.cl.statedata["ulist"]["usernames"]) and self.cl.presence.is_remote(username):
+                # Connected to another worker, which sends the status and closes the connection
+                self.log("Kicking {0}", username)
+                self.cl.kickClient(username, status)
+            elif username in self.cl.getUsernames():
+                self.log("Kicking {0}", username)
 
                 # Tell client it's going to get kicked
                 self.sendPacket({"cmd": "direct", "val": self.cl.codes[status], "id": username})
@@ -300,12 +374,11 @@ class Supporter:
                 # Unauthenticate client
                 client = self.cl.statedata["ulist"]["objs"][self.cl.statedata["ulist"]["usernames"][username]]["object"]
                 self.cl._closed_connection_server(client, None)
-                self.sendPacket({"cmd": "ulist", "val": self.cl._get_ulist()})
                 
                 # Thread final closing
                 def run(client):
                     time.sleep(1)
-                    client["handler"].send_close(1000, bytes('', encoding='utf-8'))
+                    self.cl._send_close(client)
                 Thread(target=run, args=(client,)).start()
     
     def check_for_spam(self, type, client, burst=1, seconds=1):
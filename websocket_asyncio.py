@@ -0,0 +1,506 @@
+import asyncio
+import base64
+import hashlib
+import struct
+import threading
+import time
+import traceback
+import zlib
+from collections import deque
+
+"""
+
+CloudLink Asyncio Transport
+
+This module provides an asyncio-based websocket server that exposes the same interface as
+websocket_server.WebsocketServer (clients, set_fn_*, send_message, run_forever, shutdown_*).
+Every connection is a coroutine on a single event loop, so idle clients cost a few KB each
+instead of a whole thread. Outgoing frames go through a bounded per-connection queue that a
+writer task drains, so a slow client never blocks whoever is sending to it.
+
+The server can negotiate permessage-deflate (RFC 7692). It always compresses without context
+takeover, so a message compresses to the same bytes for every client and a broadcast is only
+compressed once (see PreparedMessage).
+
+"""
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+CLOSE_STATUS_NORMAL = 1000
+CLOSE_STATUS_PROTOCOL_ERROR = 1002
+CLOSE_STATUS_TOO_LARGE = 1009
+DEFAULT_CLOSE_REASON = bytes('', encoding='utf-8')
+
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+REJECT_RESPONSE = b"HTTP/1.1 503 Service Unavailable\r\nConnection: close\r\nContent-Length: 0\r\n\r\n" # Sent to connections refused by admission control
+
+def encode_frame(payload, opcode=OPCODE_TEXT, mask=None, rsv1=False): # Builds a single unfragmented frame
+    if type(payload) == str:
+        payload = payload.encode("utf-8")
+    header = bytearray()
+    header.append(0x80 | (0x40 if rsv1 else 0) | opcode)
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length <= 125:
+        header.append(mask_bit | length)
+    elif length <= 65535:
+        header.append(mask_bit | 126)
+        header.extend(struct.pack("!H", length))
+    else:
+        header.append(mask_bit | 127)
+        header.extend(struct.pack("!Q", length))
+    if mask:
+        header.extend(mask)
+        payload = apply_mask(payload, mask)
+    return bytes(header) + payload
+
+def apply_mask(data, mask): # XORs the payload with the 4-byte mask (the same operation masks and unmasks)
+    length = len(data)
+    if length == 0:
+        return b""
+    key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+    return (int.from_bytes(data, "big") ^ key).to_bytes(length, "big")
+
+async def read_frame(reader): # Reads a frame header, returns (fin, rsv1, opcode, masked, length)
+    head = await reader.readexactly(2)
+    fin = bool(head[0] & 0x80)
+    rsv1 = bool(head[0] & 0x40)
+    opcode = head[0] & 0x0F
+    masked = bool(head[1] & 0x80)
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    return fin, rsv1, opcode, masked, length
+
+def parse_extensions(header): # Parses a Sec-WebSocket-Extensions header into [(name, {param: value})]
+    offers = []
+    for offer in header.split(","):
+        parts = [part.strip() for part in offer.split(";")]
+        if parts[0] == "":
+            continue
+        params = {}
+        for part in parts[1:]:
+            if "=" in part:
+                key, value = part.split("=", 1)
+                params[key.strip().lower()] = value.strip().strip('"')
+            elif not part == "":
+                params[part.lower()] = None
+        offers.append((parts[0].lower(), params))
+    return offers
+
+class PreparedMessage: # A message that is encoded (and compressed) at most once, however many clients it goes to
+    def __init__(self, message, opcode=OPCODE_TEXT):
+        if type(message) == str:
+            message = message.encode("utf-8")
+        self.payload = message
+        self.opcode = opcode
+        self._plain = None
+        self._deflated = {} # Window bits -> compressed frame
+
+    def plain(self):
+        if self._plain == None:
+            self._plain = encode_frame(self.payload, self.opcode)
+        return self._plain
+
+    def deflated(self, window_bits, level):
+        if not window_bits in self._deflated:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits)
+            data = compressor.compress(self.payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data.endswith(DEFLATE_TAIL):
+                data = data[:-4]
+            self._deflated[window_bits] = encode_frame(data, self.opcode, rsv1=True)
+        return self._deflated[window_bits]
+
+class FrameTooLarge(Exception):
+    pass
+
+class Connection:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.client = None
+        self.headers = {}
+        self.closing = False
+        self.queue = deque() # Outgoing frames waiting for the writer task
+        self.deflate_bits = None # Server window bits when permessage-deflate was negotiated
+        self.inflater = None
+        self.inflate_reset = False # Client compresses each message on its own (client_no_context_takeover)
+        self.wakeup = asyncio.Event()
+        self.writer_task = None
+        self.last_seen = time.monotonic() # When the client last sent a frame (pongs included)
+
+    async def handshake(self): # Performs the HTTP upgrade, returns False if the request is not a websocket upgrade
+        try:
+            request = await self.reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return False
+
+        lines = request.decode("latin-1").split("\r\n")
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                self.headers[key.strip().lower()] = value.strip()
+
+        if (not "websocket" in self.headers.get("upgrade", "").lower()) or (not "sec-websocket-key" in self.headers):
+            self.writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+
+        accept = base64.b64encode(hashlib.sha1((self.headers["sec-websocket-key"] + GUID).encode()).digest()).decode()
+        response = [
+            "HTTP/1.1 101 Switching Protocols",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Sec-WebSocket-Accept: {0}".format(accept)
+        ]
+        if self.server.compression and ("sec-websocket-extensions" in self.headers):
+            extension = self._negotiate_deflate(self.headers["sec-websocket-extensions"])
+            if not extension == None:
+                response.append("Sec-WebSocket-Extensions: {0}".format(extension))
+        self.writer.write(("\r\n".join(response) + "\r\n\r\n").encode())
+        return True
+
+    def _negotiate_deflate(self, header): # Accepts the first usable permessage-deflate offer, returns the response value or None
+        for name, params in parse_extensions(header):
+            if not name == "permessage-deflate":
+                continue
+            window_bits = self.server.compression_window_bits
+            if "server_max_window_bits" in params:
+                try:
+                    window_bits = min(window_bits, int(params["server_max_window_bits"]))
+                except (TypeError, ValueError):
+                    continue
+            # zlib can't produce raw deflate streams with an 8-bit window, so offers capped at 8 are declined
+            if (window_bits < 9) or (window_bits > 15):
+                continue
+            self.deflate_bits = window_bits
+            self.inflater = zlib.decompressobj(-15)
+            response = "permessage-deflate; server_no_context_takeover"
+            if self.deflate_bits < 15:
+                response += "; server_max_window_bits={0}".format(self.deflate_bits)
+            self.inflate_reset = ("client_no_context_takeover" in params)
+            return response
+        return None
+
+    def inflate(self, data): # Decompresses a message, raising FrameTooLarge past max_message_size
+        data = self.inflater.decompress(data + DEFLATE_TAIL, self.server.max_message_size + 1)
+        if (len(data) > self.server.max_message_size) or (len(self.inflater.unconsumed_tail) > 0):
+            raise FrameTooLarge()
+        if self.inflate_reset:
+            self.inflater = zlib.decompressobj(-15)
+        return data
+
+    def send_message(self, message, droppable=False): # Queues a text frame (thread-safe)
+        self.send_prepared(PreparedMessage(message), droppable)
+
+    def send_prepared(self, message, droppable=False): # Queues a PreparedMessage, compressed if this client negotiated it
+        if (self.deflate_bits == None) or (len(message.payload) < self.server.compression_min_size):
+            self.send_frame(message.plain(), droppable)
+        else:
+            self.send_frame(message.deflated(self.deflate_bits, self.server.compression_level), droppable)
+
+    def send_pong(self, payload):
+        self.send_frame(encode_frame(payload, OPCODE_PONG))
+
+    def send_ping(self, payload=b""): # Live clients answer with a pong, which counts as activity (thread-safe)
+        self.send_frame(encode_frame(payload, OPCODE_PING))
+
+    def send_frame(self, frame, droppable=False): # Queues raw frame bytes (thread-safe), droppable frames are skipped for slow clients
+        if self.server.in_loop():
+            self._enqueue(frame, droppable)
+        else:
+            self.server.loop.call_soon_threadsafe(self._enqueue, frame, droppable)
+
+    def depth(self): # Number of frames waiting to be written
+        return len(self.queue)
+
+    def _enqueue(self, frame, droppable):
+        if self.closing or self.writer.is_closing():
+            return
+        depth = len(self.queue)
+        if droppable and (depth >= self.server.slow_queue):
+            self.server.dropped += 1
+            return
+        if depth >= self.server.max_queue:
+            # The client isn't reading, drop it instead of buffering without limit
+            self.server.evicted += 1
+            self.closing = True
+            self.queue.clear()
+            self.writer.transport.abort()
+            return
+        self._write(frame)
+
+    def _write(self, frame):
+        self.queue.append(frame)
+        self.wakeup.set()
+
+    async def _writer_loop(self): # Writes queued frames, waiting for the socket to drain between batches
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while len(self.queue) > 0:
+                    while len(self.queue) > 0:
+                        self.writer.write(self.queue.popleft())
+                    await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def send_close(self, status=CLOSE_STATUS_NORMAL, reason=DEFAULT_CLOSE_REASON): # Starts the closing handshake
+        if self.server.in_loop():
+            self._close(status, reason)
+        else:
+            self.server.loop.call_soon_threadsafe(self._close, status, reason)
+
+    def _close(self, status, reason):
+        if not self.closing:
+            self.closing = True
+            self._write(encode_frame(struct.pack("!H", status) + reason, OPCODE_CLOSE))
+            # Drop the socket if the client never answers the close frame
+            self.server.loop.call_later(self.server.close_timeout, self.writer.close)
+
+    def abort(self): # Drops the socket without waiting for queued data, e.g. for dead peers (thread-safe)
+        if self.server.in_loop():
+            self.writer.transport.abort()
+        else:
+            self.server.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+class WebsocketServer:
+    def __init__(self, host="127.0.0.1", port=0, max_message_size=1048576, close_timeout=5, reuse_port=False, max_queue=256, slow_queue=32,
+                 compression=False, compression_level=6, compression_window_bits=15, compression_min_size=256, admission=None):
+        self.host = host
+        self.port = port
+        self.max_message_size = max_message_size # Frames above this size close the connection with 1009
+        self.close_timeout = close_timeout # Seconds to wait for a close frame reply before dropping the socket
+        self.reuse_port = reuse_port
+        self.max_queue = max_queue # Clients with more queued frames than this are disconnected
+        self.slow_queue = slow_queue # Droppable frames are skipped for clients with more queued frames than this
+        self.dropped = 0
+        self.evicted = 0
+        self.compression = compression # Negotiate permessage-deflate with clients that offer it
+        self.compression_level = compression_level # zlib level, 1 (fastest) to 9 (smallest)
+        self.compression_window_bits = compression_window_bits # Server window size, 9 to 15
+        self.compression_min_size = compression_min_size # Messages smaller than this (in bytes) are sent uncompressed
+        self.admission = admission # admission.admit(ip) returns None to accept a connection, admission.release(ip) is called when it closes
+        self.loop = None
+        self.thread = None
+        self.id_counter = 0
+        self._clients = {}
+        self._server = None
+        self._loop_thread_id = None
+        self.new_client = None
+        self.client_left = None
+        self.message_received = None
+
+    @property
+    def clients(self): # Snapshot of connected clients, safe to iterate from any thread
+        return list(self._clients.values())
+
+    def set_fn_new_client(self, fn):
+        self.new_client = fn
+
+    def set_fn_client_left(self, fn):
+        self.client_left = fn
+
+    def set_fn_message_received(self, fn):
+        self.message_received = fn
+
+    def in_loop(self):
+        return threading.get_ident() == self._loop_thread_id
+
+    def send_message(self, client, msg):
+        client["handler"].send_message(msg)
+
+    def send_message_to_all(self, msg):
+        message = PreparedMessage(msg)
+        for client in self.clients:
+            client["handler"].send_prepared(message)
+
+    def call_soon(self, fn, *args): # Schedules fn on the event loop from any thread
+        if self.in_loop():
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _callback(self, fn, *args):
+        if not fn == None:
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+    async def _handle(self, reader, writer):
+        address = writer.get_extra_info("peername")
+        ip = None
+        if (not self.admission == None) and (type(address) == tuple):
+            # Reject before the handshake, so a refused connection costs as little as possible
+            ip = address[0]
+            if not self.admission.admit(ip) == None:
+                ip = None
+                writer.write(REJECT_RESPONSE)
+                writer.close()
+                return
+        handler = Connection(self, reader, writer)
+        client = None
+        try:
+            if not await handler.handshake():
+                return
+
+            self.id_counter += 1
+            client = {
+                "id": self.id_counter,
+                "handler": handler,
+                "address": address
+            }
+            handler.client = client
+            handler.writer_task = self.loop.create_task(handler._writer_loop())
+            self._clients[client["id"]] = client
+            self._callback(self.new_client, client, self)
+
+            await self._read_loop(handler, client)
+        except FrameTooLarge:
+            handler._close(CLOSE_STATUS_TOO_LARGE, DEFAULT_CLOSE_REASON)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            if not client == None:
+                self._callback(self.client_left, client, self)
+                if client["id"] in self._clients:
+                    del self._clients[client["id"]]
+            if not handler.writer_task == None:
+                handler.writer_task.cancel()
+                # Flush what is already queued (e.g. a close frame) unless the socket is gone
+                if (len(handler.queue) > 0) and (not writer.is_closing()):
+                    try:
+                        await asyncio.wait_for(self._flush(handler), self.close_timeout)
+                    except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):
+                        pass
+            writer.close()
+            if not ip == None:
+                self.admission.release(ip)
+
+    async def _flush(self, handler):
+        while len(handler.queue) > 0:
+            handler.writer.write(handler.queue.popleft())
+        await handler.writer.drain()
+
+    async def _read_loop(self, handler, client):
+        fragments = []
+        fragment_opcode = None
+        fragment_size = 0
+        compressed = False
+        reader = handler.reader
+        while True:
+            fin, rsv1, opcode, masked, length = await read_frame(reader)
+            handler.last_seen = time.monotonic()
+            if length > self.max_message_size:
+                raise FrameTooLarge()
+            if rsv1 and ((handler.inflater == None) or (opcode >= OPCODE_CLOSE) or (opcode == OPCODE_CONTINUATION)):
+                # RSV1 is only valid on the first frame of a message, and only after permessage-deflate was negotiated
+                handler._close(CLOSE_STATUS_PROTOCOL_ERROR, DEFAULT_CLOSE_REASON)
+                return
+            if masked:
+                mask = await reader.readexactly(4)
+                payload = apply_mask(await reader.readexactly(length), mask)
+            else:
+                payload = await reader.readexactly(length)
+
+            if opcode == OPCODE_CLOSE:
+                if not handler.closing:
+                    handler._close(CLOSE_STATUS_NORMAL, DEFAULT_CLOSE_REASON)
+                return
+            elif opcode == OPCODE_PING:
+                handler.send_pong(payload)
+                continue
+            elif opcode == OPCODE_PONG:
+                continue
+
+            # Reassemble fragmented messages
+            if opcode == OPCODE_CONTINUATION:
+                if fragment_opcode == None:
+                    handler._close(CLOSE_STATUS_PROTOCOL_ERROR, DEFAULT_CLOSE_REASON)
+                    return
+            else:
+                fragment_opcode = opcode
+                compressed = rsv1
+            fragments.append(payload)
+            fragment_size += length
+            if fragment_size > self.max_message_size:
+                raise FrameTooLarge()
+            if not fin:
+                continue
+
+            message = b"".join(fragments)
+            opcode = fragment_opcode
+            fragments = []
+            fragment_opcode = None
+            fragment_size = 0
+            if compressed:
+                message = handler.inflate(message)
+
+            if opcode == OPCODE_TEXT:
+                try:
+                    message = message.decode("utf-8")
+                except UnicodeDecodeError:
+                    handler._close(CLOSE_STATUS_PROTOCOL_ERROR, DEFAULT_CLOSE_REASON)
+                    return
+                self._callback(self.message_received, client, self, message)
+            elif opcode == OPCODE_BINARY:
+                # Passed on as bytes, the receiver decides what to do with them
+                self._callback(self.message_received, client, self, message)
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, reuse_port=self.reuse_port)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._loop_thread_id = threading.get_ident()
+        try:
+            self.loop.run_until_complete(self._serve())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def run_forever(self, threaded=False):
+        self.loop = asyncio.new_event_loop()
+        if threaded:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        else:
+            self.thread = threading.current_thread()
+            try:
+                self._run()
+            except KeyboardInterrupt:
+                pass
+
+    def _stop(self):
+        if not self._server == None:
+            self._server.close()
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+
+    def shutdown_gracefully(self, status=CLOSE_STATUS_NORMAL, reason=DEFAULT_CLOSE_REASON):
+        for client in self.clients:
+            client["handler"].send_close(status, reason)
+        self.call_soon(self._stop)
+
+    def shutdown_abruptly(self):
+        for client in self.clients:
+            client["handler"].abort()
+        self.call_soon(self._stop)